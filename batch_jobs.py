@@ -0,0 +1,475 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from firebase_admin import firestore
+from work_leases import claim_documents, release_lease, lease_field, CLAIM_OVERFETCH
+from retry_queue import failure_updates, requeue_due
+from prompt_budget import model_name, prompt_text_tokens
+from llm_stages import STAGES, TRIPLET_GROUPS
+
+# Offline batch mode for bulk triplet and reference extraction. Eligible
+# papers are claimed with a lease that outlasts the provider's completion
+# window (so the interactive stages leave them alone), their prompts are
+# written to a JSONL file of chat completion requests and submitted as one
+# batch job. Once the job is done its results go through the same parsers
+# and Firestore writes as the interactive stages:
+#
+#   python -m batch_jobs submit triplet_group_a --limit 20000
+#   python -m batch_jobs ingest <job id>
+#   python -m batch_jobs run references --limit 5000 --backend local
+
+# Override in the optional [batch] section of secrets.toml
+DEFAULT_BATCH_CONFIG = {
+    'backend': 'openai',            # or 'local' for the file-based stand-in
+    'local_directory': 'batch_jobs',
+    'completion_window': '24h',
+    'max_requests': 50000,          # OpenAI's limit per batch
+    'lease_seconds': 26 * 60 * 60,  # longer than the completion window
+    'poll_seconds': 300,
+}
+
+JOBS_COLLECTION = 'batch_jobs'
+
+# Job states, as reported by the backends
+RUNNING, COMPLETED, FAILED, EXPIRED, CANCELLED = 'running', 'completed', 'failed', 'expired', 'cancelled'
+FINISHED_STATES = (COMPLETED, FAILED, EXPIRED, CANCELLED)
+
+# Papers claimed per transaction, within Firestore's 500 writes per transaction
+CLAIM_CHUNK = 200
+
+# Status field and value to restore on retry for each task
+TASKS = {
+    **{group: (group, 'ToProcess') for group in TRIPLET_GROUPS},
+    'references': ('status', 'TextExtracted'),
+}
+
+class BatchRequestError(Exception):
+    """A request in a batch job that the provider couldn't complete"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def load_batch_config() -> dict:
+    """Batch job settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_BATCH_CONFIG)
+    try:
+        import streamlit as st
+        if 'batch' in st.secrets:
+            config.update(dict(st.secrets['batch']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API: results within the completion window at batch pricing"""
+
+    name = 'openai'
+
+    def __init__(self, client=None, completion_window: str = '24h'):
+        if client is None:
+            from clients import get_openai_client
+            client = get_openai_client()
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, path: str, metadata: dict) -> str:
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint='/v1/chat/completions',
+                                           completion_window=self.completion_window, metadata=metadata)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        return {'completed': COMPLETED, 'failed': FAILED, 'expired': EXPIRED,
+                'cancelling': CANCELLED, 'cancelled': CANCELLED}.get(status, RUNNING)
+
+    def results(self, batch_id: str):
+        """Result lines of the output and error files (expired and cancelled jobs have partial output)"""
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+class LocalBatchBackend:
+    """File-based stand-in for a provider's batch interface.
+
+    Submitted request files are copied into `directory`; the first time a
+    job is polled its requests are sent one at a time to `llm` (any chat
+    model, e.g. the benchmark's FakeLLM) and the responses written to an
+    output file in the OpenAI batch output format.
+    """
+
+    name = 'local'
+
+    def __init__(self, directory: str, llm):
+        self.directory = directory
+        self.llm = llm
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f'{batch_id}.{kind}.jsonl')
+
+    def submit(self, path: str, metadata: dict) -> str:
+        batch_id = f'local-{uuid.uuid4().hex[:12]}'
+        shutil.copyfile(path, self._path(batch_id, 'input'))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        output_path = self._path(batch_id, 'output')
+        if not os.path.exists(output_path):
+            with open(self._path(batch_id, 'input')) as f, open(output_path + '.tmp', 'w') as out:
+                for line in f:
+                    if line.strip():
+                        out.write(json.dumps(self._run(json.loads(line))) + '\n')
+            os.replace(output_path + '.tmp', output_path)
+        return COMPLETED
+
+    def _run(self, request: dict) -> dict:
+        from langchain_core.messages import convert_to_messages
+        from rate_limiter import get_rate_limiter, estimate_tokens
+
+        body = request['body']
+        options = {key: value for key, value in body.items() if key not in ('model', 'messages')}
+        messages = convert_to_messages(body['messages'])
+        try:
+            message = get_rate_limiter().call('openai', lambda: self.llm.invoke(messages, **options),
+                                              tokens=estimate_tokens(str(body['messages'])))
+        except Exception as e:
+            return {'custom_id': request['custom_id'], 'response': None,
+                    'error': {'code': type(e).__name__, 'message': str(e)}}
+        usage = getattr(message, 'usage_metadata', None) or {}
+        return {'custom_id': request['custom_id'], 'error': None, 'response': {
+            'status_code': 200,
+            'body': {
+                'object': 'chat.completion',
+                'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': message.content}}],
+                'usage': {'prompt_tokens': usage.get('input_tokens', 0),
+                          'completion_tokens': usage.get('output_tokens', 0),
+                          'total_tokens': usage.get('total_tokens', 0)},
+            },
+        }}
+
+    def results(self, batch_id: str):
+        with open(self._path(batch_id, 'output')) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def get_backend(config: dict, llm=None):
+    """The configured batch backend; the local one runs its requests through `llm`"""
+    if config['backend'] == 'local':
+        return LocalBatchBackend(config['local_directory'], llm)
+    return OpenAIBatchBackend(completion_window=config['completion_window'])
+
+def _candidates(db, task: str, limit: int, frontier):
+    """Eligibility check and candidate papers for a task, in the interactive stage's order"""
+    if task == 'references':
+        def eligible(data):
+            return (data.get('status') == 'TextExtracted' and data.get('qualified') is True
+                    and frontier.has_budget(data.get('depth', 1), llm_tokens=1))
+        return eligible, frontier.next_papers_for_references(limit * CLAIM_OVERFETCH)
+
+    def eligible(data):
+        return data.get(task) == 'ToProcess' and data.get('qualified') is True
+    query = db.collection('pdf_files').where(task, '==', 'ToProcess').where('qualified', '==', True)
+    return eligible, query.limit(limit * CLAIM_OVERFETCH).stream()
+
+def _claim(db, task: str, limit: int, owner: str, lease_seconds: int, frontier) -> list:
+    """Claim up to `limit` eligible papers for a job, a transaction-sized chunk at a time"""
+    eligible, candidates = _candidates(db, task, limit, frontier)
+    claimed, chunk = [], []
+    for doc in candidates:
+        chunk.append(doc)
+        if len(chunk) >= CLAIM_CHUNK:
+            claimed.extend(claim_documents(db, chunk, task, limit - len(claimed), owner, lease_seconds, eligible))
+            chunk = []
+            if len(claimed) >= limit:
+                return claimed
+    if chunk and len(claimed) < limit:
+        claimed.extend(claim_documents(db, chunk, task, limit - len(claimed), owner, lease_seconds, eligible))
+    return claimed
+
+def request_body(task: str, text: str, llm) -> dict:
+    """Chat completion request for a paper, matching what the interactive stage sends"""
+    if task == 'references':
+        from main import references_prompt, references_response_format
+        return {'model': model_name(llm),
+                'messages': [{'role': 'system', 'content': references_prompt(text, llm)}],
+                'response_format': references_response_format()}
+    stage = STAGES[task]
+    llm = stage.llm_for(llm)
+    return {'model': model_name(llm), 'messages': [{'role': 'user', 'content': stage.prompt(text, llm)}]}
+
+def _fail(db, task: str, doc_id: str, data: dict, error: Exception):
+    status_field, retry_value = TASKS[task]
+    db.collection('pdf_files').document(doc_id).update({
+        **failure_updates(task, data, error, retry_value=retry_value),
+        ('triplet_error' if task != 'references' else 'error_message'): str(error),
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+        **release_lease(task)
+    })
+
+def _reserve_tokens(papers: list, texts: dict, llm, frontier) -> tuple:
+    """Split reference papers into those the per-depth LLM token budgets can afford and the rest.
+
+    Returns:
+        tuple: (affordable papers, papers over budget, dict of tokens to charge per depth)
+    """
+    affordable, over_budget, reserved = [], [], {}
+    for doc in papers:
+        depth = doc.to_dict().get('depth', 1)
+        tokens = prompt_text_tokens(llm, 'references', texts[doc.id])
+        if frontier.has_budget(depth, llm_tokens=reserved.get(depth, 0) + tokens):
+            reserved[depth] = reserved.get(depth, 0) + tokens
+            affordable.append(doc)
+        else:
+            over_budget.append(doc)
+    return affordable, over_budget, reserved
+
+def submit_batch(db, task: str, limit: int, llm, backend, config: dict = None, frontier=None) -> dict:
+    """Claim eligible papers and submit their requests as one batch job.
+
+    For references, the prompt tokens of the job are charged to the per-depth
+    budgets when it is submitted, since the provider bills for them from then
+    on; papers the budgets can't afford are released.
+
+    Args:
+        db: Firestore client
+        task (str): A triplet group (see TRIPLET_GROUPS) or 'references'
+        limit (int): Most papers in the job (capped at max_requests)
+        llm: Model whose name and prompt budgets the requests use
+        backend: OpenAIBatchBackend or LocalBatchBackend
+        config (dict): Settings (default from secrets.toml)
+        frontier (CrawlFrontier): Depth order and budgets for references
+
+    Returns:
+        dict: The batch_jobs record, with its 'id' and the number of papers whose text
+        couldn't be read ('unreadable') or that were over budget ('over_budget'), or
+        None if no papers were eligible
+    """
+    from text_segments import load_texts
+
+    if task not in TASKS:
+        raise ValueError(f"Unknown batch task {task!r}, expected one of {', '.join(TASKS)}")
+    config = config or load_batch_config()
+    if task == 'references' and frontier is None:
+        from crawl_frontier import CrawlFrontier, load_crawl_config
+        frontier = CrawlFrontier(db, load_crawl_config())
+
+    # Papers whose retry backoff has passed are eligible again
+    requeue_due(db, task)
+    job_id = f"{task}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    owner = f'batch-{job_id}'
+    papers = _claim(db, task, min(limit, int(config['max_requests'])), owner, int(config['lease_seconds']), frontier)
+    if not papers:
+        return None
+
+    # Texts of the whole job, from text segments where the papers have been packed
+    texts, errors = load_texts(papers)
+    for doc in papers:
+        if doc.id in errors:
+            _fail(db, task, doc.id, doc.to_dict(), errors[doc.id])
+    papers = [doc for doc in papers if doc.id not in errors]
+    over_budget, reserved = [], {}
+    if task == 'references':
+        papers, over_budget, reserved = _reserve_tokens(papers, texts, llm, frontier)
+        if over_budget:
+            batch = db.batch()
+            for doc in over_budget:
+                batch.update(doc.reference, release_lease(task))
+            batch.commit()
+
+    requests = 0
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+        for doc in papers:
+            f.write(json.dumps({'custom_id': doc.id, 'method': 'POST', 'url': '/v1/chat/completions',
+                                'body': request_body(task, texts[doc.id], llm)}) + '\n')
+            requests += 1
+    try:
+        if not requests:
+            return None
+        batch_id = backend.submit(f.name, {'job_id': job_id, 'task': task})
+    except Exception:
+        # Hand the papers back to the interactive stages
+        batch = db.batch()
+        for doc in papers:
+            batch.update(doc.reference, release_lease(task))
+        batch.commit()
+        raise
+    finally:
+        os.remove(f.name)
+    for depth, tokens in reserved.items():
+        frontier.charge(depth, llm_tokens=tokens)
+
+    job = {
+        'task': task,
+        'backend': backend.name,
+        'batch_id': batch_id,
+        'lease_owner': owner,
+        'model': model_name(llm),
+        'requests': requests,
+        'status': RUNNING,
+        'created_timestamp': firestore.SERVER_TIMESTAMP,
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+    }
+    db.collection(JOBS_COLLECTION).document(job_id).set(job)
+    return {**job, 'id': job_id, 'unreadable': len(errors), 'over_budget': len(over_budget)}
+
+def poll_batch(db, job_id: str, backend) -> str:
+    """Check a job with its backend and record its state"""
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    job = job_ref.get().to_dict()
+    if job['status'] in FINISHED_STATES or job['status'] == 'ingested':
+        return job['status']
+    state = backend.status(job['batch_id'])
+    if state != job['status']:
+        job_ref.update({'status': state, 'updated_timestamp': firestore.SERVER_TIMESTAMP})
+    return state
+
+def _ingest_result(db, task: str, doc, result: dict) -> bool:
+    """Parse and store one paper's result as the interactive stage would; returns whether anything was found"""
+    from langchain_core.messages import AIMessage
+    from pipeline_metrics import record_llm_usage
+
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        error = result.get('error') or (response.get('body') or {}).get('error') or {}
+        raise BatchRequestError(f"Batch request failed: {error.get('message', error) or 'no response'}",
+                                response.get('status_code'))
+    body = response['body']
+    usage = body.get('usage') or {}
+    message = AIMessage(content=body['choices'][0]['message']['content'] or '',
+                        response_metadata={'token_usage': usage})
+    record_llm_usage(message)
+
+    file_data = doc.to_dict()
+    if task == 'references':
+        from main import parse_references
+        from pipeline_stages import save_references
+
+        references = parse_references(message.content)
+        save_references(db, doc.id, file_data, references)
+        return bool(references)
+    from pipeline_stages import save_triplets
+
+    return save_triplets(db, task, doc.id, file_data, STAGES[task].result(message))
+
+def ingest_batch(db, job_id: str, backend) -> dict:
+    """Store the results of a finished job.
+
+    Results are only applied to papers the job still holds the lease on.
+    Failed requests are marked failed and scheduled for retry as in the
+    interactive stages; papers left without a result (an expired or
+    cancelled job) are released for the interactive stages to pick up.
+
+    Args:
+        db: Firestore client
+        job_id (str): batch_jobs document ID
+        backend: The backend the job was submitted to
+
+    Returns:
+        dict: Counts of 'saved', 'empty', 'failed', 'skipped' and 'released' papers
+    """
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    job = job_ref.get().to_dict()
+    if job['status'] == 'ingested':
+        return job.get('results', {})
+    state = poll_batch(db, job_id, backend)
+    if state not in FINISHED_STATES:
+        raise RuntimeError(f"Batch job {job_id} is still {state}")
+    task, owner = job['task'], job['lease_owner']
+
+    # Papers this job still holds; a lease that ran out may have been taken over
+    held = {doc.id: doc for doc in db.collection('pdf_files').where(f"{lease_field(task)}.owner", '==', owner).stream()}
+    counts = {'saved': 0, 'empty': 0, 'failed': 0, 'skipped': 0, 'released': 0}
+    if state != FAILED:
+        for result in backend.results(job['batch_id']):
+            doc = held.pop(result['custom_id'], None)
+            if doc is None:
+                counts['skipped'] += 1
+                continue
+            try:
+                found = _ingest_result(db, task, doc, result)
+                counts['saved' if found else 'empty'] += 1
+            except Exception as e:
+                # Recorded on the paper, with a retry scheduled
+                _fail(db, task, doc.id, doc.to_dict(), e)
+                counts['failed'] += 1
+
+    if held:
+        batch = db.batch()
+        for doc in held.values():
+            batch.update(doc.reference, release_lease(task))
+        batch.commit()
+        counts['released'] = len(held)
+
+    job_ref.update({'status': 'ingested', 'provider_status': state, 'results': counts,
+                    'updated_timestamp': firestore.SERVER_TIMESTAMP})
+    return counts
+
+def run_batch(db, task: str, limit: int, llm, backend, config: dict = None, frontier=None) -> dict:
+    """Submit a job, wait for it to finish and ingest its results"""
+    config = config or load_batch_config()
+    job = submit_batch(db, task, limit, llm, backend, config, frontier)
+    if job is None:
+        return {}
+    while poll_batch(db, job['id'], backend) not in FINISHED_STATES:
+        time.sleep(float(config['poll_seconds']))
+    return ingest_batch(db, job['id'], backend)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m batch_jobs',
+                                     description='Run triplet or reference extraction as offline batch jobs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('submit', 'claim eligible papers and submit a batch job'),
+                            ('run', 'submit a job, wait for it and ingest the results')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('task', choices=list(TASKS))
+        command.add_argument('--limit', type=int, default=1000, help='most papers in the job')
+        command.add_argument('--backend', choices=['openai', 'local'], help='overrides [batch] backend')
+    for name, help_text in (('status', 'check a job'), ('ingest', 'store the results of a finished job')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('job_id')
+    args = parser.parse_args(argv)
+
+    from firebase_utils import get_db
+    from main import get_llm
+
+    db = get_db()
+    config = load_batch_config()
+    if getattr(args, 'backend', None):
+        config['backend'] = args.backend
+    if args.command in ('status', 'ingest'):
+        config['backend'] = db.collection(JOBS_COLLECTION).document(args.job_id).get().to_dict()['backend']
+    llm = get_llm()
+    backend = get_backend(config, llm)
+
+    if args.command == 'submit':
+        job = submit_batch(db, args.task, args.limit, llm, backend, config)
+        if job is None:
+            print('No eligible papers')
+        else:
+            print(job['id'])
+            print(f"{job['requests']} requests; {job['unreadable']} papers with unreadable text, "
+                  f"{job['over_budget']} over the LLM token budget")
+    elif args.command == 'run':
+        print(run_batch(db, args.task, args.limit, llm, backend, config))
+    elif args.command == 'status':
+        print(poll_batch(db, args.job_id, backend))
+    else:
+        print(ingest_batch(db, args.job_id, backend))
+
+if __name__ == '__main__':
+    main()
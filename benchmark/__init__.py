@@ -0,0 +1 @@
+# Offline benchmark for the processing pipeline; run with `python -m benchmark --help`
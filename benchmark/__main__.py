@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmark.corpus import SyntheticCorpus, CorpusServer
+from benchmark.fake_firebase import FakeFirestore, FakeBucket
+from benchmark.fake_services import FakeLLM, FakeSearch
+from llm_stages import TRIPLET_GROUPS
+
+# Runs the whole pipeline (upload -> extract -> qualify -> references ->
+# crawl -> triplets) offline and reports throughput and latency per stage:
+#
+#   python -m benchmark --papers 100 --workers 4 --llm-latency 0.5
+#   python -m benchmark --json baseline.json
+#   python -m benchmark --compare baseline.json
+
+STAGES = ['upload', 'extract', 'qualify', 'references', 'crawl', *TRIPLET_GROUPS]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='Benchmark the processing pipeline against local stand-ins.')
+    corpus = parser.add_argument_group('corpus')
+    corpus.add_argument('--papers', type=int, default=50, help='papers in the synthetic corpus')
+    corpus.add_argument('--seeds', type=int, default=5, help='papers uploaded at the start')
+    corpus.add_argument('--duplicates', type=int, default=0,
+                        help='seed papers also uploaded as a near-duplicate preprint')
+    corpus.add_argument('--references', type=int, default=5, help='references per paper')
+    corpus.add_argument('--pages', type=int, default=4, help='body pages per paper')
+    corpus.add_argument('--relevant-fraction', type=float, default=0.8)
+    corpus.add_argument('--seed', type=int, default=0)
+    run = parser.add_argument_group('pipeline')
+    run.add_argument('--workers', type=int, default=1, help='concurrent workers per stage')
+    run.add_argument('--batch', type=int, default=5, help='documents each worker claims per run')
+    run.add_argument('--max-depth', type=int, default=3)
+    run.add_argument('--no-resolver', action='store_true',
+                     help='search for every reference instead of resolving DOIs and arXiv IDs first')
+    run.add_argument('--related-results', type=int, default=2,
+                     help="other papers' PDFs in each search answer, which the crawl should not download")
+    run.add_argument('--fetch-all', action='store_true',
+                     help='download every search result instead of stopping at the first verified match')
+    run.add_argument('--text-segments', action='store_true',
+                     help='pack the extracted texts into text segments before the triplet stages')
+    run.add_argument('--model', default='gpt-4-turbo-preview', help='model the fake LLM reports (sets prompt budgets)')
+    latency = parser.add_argument_group('simulated latency (seconds)')
+    latency.add_argument('--llm-latency', type=float, default=0.05)
+    latency.add_argument('--llm-seconds-per-1k-tokens', type=float, default=0.0)
+    latency.add_argument('--llm-jitter', type=float, default=0.2)
+    latency.add_argument('--search-latency', type=float, default=0.02)
+    latency.add_argument('--http-latency', type=float, default=0.0)
+    latency.add_argument('--connect-latency', type=float, default=0.0,
+                         help='per new HTTP connection, standing in for the TCP/TLS handshake')
+    latency.add_argument('--firestore-latency', type=float, default=0.0)
+    latency.add_argument('--storage-latency', type=float, default=0.0)
+    output = parser.add_argument_group('output')
+    output.add_argument('--json', metavar='PATH', help='write the report as JSON')
+    output.add_argument('--compare', metavar='PATH', help='compare with a JSON report from an earlier run')
+    output.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown counted as a regression (default 0.2)')
+    output.add_argument('--verbose', action='store_true', help='show pipeline output')
+    return parser.parse_args(argv)
+
+def _drain(stage_fn, workers: int) -> int:
+    """Run a stage on `workers` concurrent workers until a round finds nothing to do"""
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        worker_ids = [f'benchmark-{i}' for i in range(workers)]
+        while True:
+            processed = sum(pool.map(stage_fn, worker_ids))
+            total += processed
+            if not processed:
+                return total
+
+def _backfill_triplet_fields(db):
+    """Mark every paper for every triplet group, as System Administration does"""
+    batch = db.batch()
+    for doc in db.collection('pdf_files').stream():
+        data = doc.to_dict()
+        batch.update(doc.reference, {group: 'ToProcess' for group in TRIPLET_GROUPS if group not in data})
+    batch.commit()
+
+def run_benchmark(args) -> dict:
+    # Imported here so the stand-ins are in place before anything connects
+    import firebase_utils
+    from rate_limiter import RateLimiter, use_rate_limiter
+    from host_health import HostHealth, use_host_health
+    from crawl_frontier import CrawlFrontier
+    from paper_resolver import resolve_reference, DEFAULT_RESOLVER_CONFIG
+    from pipeline_metrics import metrics, DocumentTimer
+    import pipeline_stages
+    import text_segments
+
+    # Keep LangSmith tracing off even if secrets.toml configures it
+    os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+    corpus = SyntheticCorpus(args.papers, args.references, args.relevant_fraction, args.pages, args.seed)
+    db = FakeFirestore(latency=args.firestore_latency)
+    bucket = FakeBucket(latency=args.storage_latency)
+    firebase_utils.use_clients(db, bucket)
+    workdir = tempfile.mkdtemp(prefix='reference_crawler_benchmark_')
+    use_rate_limiter(RateLimiter(limits={}, path=os.path.join(workdir, 'rate_limits.sqlite')))
+    use_host_health(HostHealth({'path': os.path.join(workdir, 'hosts.sqlite')}))
+    text_segments.DEFAULT_SEGMENT_CONFIG['local_directory'] = os.path.join(workdir, 'text_segments')
+    llm = FakeLLM(args.model, args.llm_latency, args.llm_seconds_per_1k_tokens, args.llm_jitter, args.seed)
+    frontier = CrawlFrontier(db, {'max_depth': args.max_depth, 'fetch_all_candidates': args.fetch_all})
+    ui = pipeline_stages.ConsoleUI(verbose=args.verbose)
+    wall = dict.fromkeys(STAGES, 0.0)
+    documents = dict.fromkeys(STAGES, 0)
+
+    def timed(stage, fn):
+        started = time.perf_counter()
+        documents[stage] += fn()
+        wall[stage] += time.perf_counter() - started
+
+    def upload():
+        seeds = corpus.papers[:args.seeds]
+        uploads = [(paper, False) for paper in seeds] + [(paper, True) for paper in seeds[:args.duplicates]]
+        for paper, preprint in uploads:
+            timer = DocumentTimer('upload')
+            filename = f'preprint_{paper.filename}' if preprint else paper.filename
+            firebase_utils.upload_pdf_to_storage(io.BytesIO(corpus.pdf(paper, preprint)), filename)
+            firebase_utils.add_pdf_record(filename)
+            timer.finish()
+        return len(uploads)
+
+    with CorpusServer(corpus, latency=args.http_latency, connect_latency=args.connect_latency) as server:
+        search = FakeSearch(corpus, server, latency=args.search_latency, related=args.related_results)
+        # The corpus server answers the arXiv and DOI lookups too
+        resolve = functools.partial(resolve_reference, config={
+            **DEFAULT_RESOLVER_CONFIG, 'enabled': not args.no_resolver,
+            'arxiv_url': server.base_url, 'doi_lookup_url': f'{server.base_url}/works/doi:'})
+        stages = {
+            'extract': lambda worker_id: pipeline_stages.extract_text(args.batch, worker_id, ui),
+            'qualify': lambda worker_id: pipeline_stages.qualify_papers(args.batch, worker_id, llm, frontier, ui),
+            'references': lambda worker_id: pipeline_stages.process_references(args.batch, worker_id, frontier, ui, llm),
+            'crawl': lambda worker_id: pipeline_stages.crawl_references(args.batch, worker_id, frontier, ui, search,
+                                                                        resolve),
+            **{group: (lambda worker_id, group=group:
+                       pipeline_stages.generate_triplets(group, args.batch, worker_id, llm, ui))
+               for group in TRIPLET_GROUPS},
+        }
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with quiet:
+            timed('upload', upload)
+            # Each pass takes the crawl one level deeper
+            while True:
+                before = sum(documents.values())
+                for stage in ('extract', 'qualify', 'references', 'crawl'):
+                    timed(stage, lambda: _drain(stages[stage], args.workers))
+                if sum(documents.values()) == before:
+                    break
+            _backfill_triplet_fields(db)
+            if args.text_segments:
+                text_segments.compact_texts(db, limit=len(corpus.papers) + args.duplicates)
+            for stage in TRIPLET_GROUPS:
+                timed(stage, lambda: _drain(stages[stage], args.workers))
+        total_seconds = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()['stages']
+    report = {'settings': vars(args).copy(), 'total_seconds': total_seconds, 'stages': {}}
+    for key in ('json', 'compare', 'verbose'):
+        report['settings'].pop(key, None)
+    for stage in STAGES:
+        values = snapshot.get(stage, {})
+        report['stages'][stage] = {
+            'documents': documents[stage],
+            'errors': int(values.get('errors_total', 0)),
+            'wall_seconds': wall[stage],
+            'documents_per_second': documents[stage] / wall[stage] if wall[stage] else 0.0,
+            'latency_seconds': values.get('latency_seconds', {}),
+            'llm_requests': int(values.get('llm_requests_total', 0)),
+            'llm_tokens': int(values.get('llm_prompt_tokens_total', 0) + values.get('llm_completion_tokens_total', 0)),
+            'search_calls': int(values.get('search_calls_total', 0)),
+            'bytes_downloaded': int(values.get('bytes_downloaded_total', 0)),
+        }
+    duplicates = db.collection('pdf_files').where('status', '==', 'Duplicate').stream()
+    report['firestore'] = {'reads': db.reads, 'writes': db.writes,
+                           'pdf_files': db.count('pdf_files'), 'references': db.count('references'),
+                           'duplicates': len(list(duplicates))}
+    report['storage'] = {'downloads': bucket.downloads, 'uploads': bucket.uploads}
+    return report
+
+def print_report(report: dict):
+    def seconds(value):
+        return f'{value * 1000:8.1f}ms' if value is not None else f'{"-":>10}'
+
+    print(f"{'stage':<16}{'docs':>6}{'errors':>8}{'wall':>9}{'docs/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}"
+          f"{'llm':>6}{'search':>8}")
+    for stage, values in report['stages'].items():
+        latency = values['latency_seconds']
+        print(f"{stage:<16}{values['documents']:>6}{values['errors']:>8}{values['wall_seconds']:>8.2f}s"
+              f"{values['documents_per_second']:>9.2f}{seconds(latency.get('p50'))}{seconds(latency.get('p95'))}"
+              f"{seconds(latency.get('p99'))}{values['llm_requests']:>6}{values['search_calls']:>8}")
+    firestore = report['firestore']
+    print(f"\nTotal {report['total_seconds']:.2f}s; Firestore {firestore['reads']} reads, {firestore['writes']} writes; "
+          f"{firestore['pdf_files']} papers ({firestore.get('duplicates', 0)} near-duplicates), "
+          f"{firestore['references']} references")
+    if 'storage' in report:
+        print(f"Storage {report['storage']['downloads']} downloads, {report['storage']['uploads']} uploads")
+
+def compare_reports(report: dict, baseline: dict, tolerance: float) -> list:
+    """Stages that got slower than the baseline by more than `tolerance`"""
+    if report['settings'] != baseline.get('settings'):
+        print('Warning: the baseline was run with different settings')
+    regressions = []
+    for stage, values in report['stages'].items():
+        before = baseline['stages'].get(stage)
+        if not before or not before['documents_per_second'] or not values['documents']:
+            continue
+        change = values['documents_per_second'] / before['documents_per_second'] - 1
+        p95, p95_before = values['latency_seconds'].get('p95'), before['latency_seconds'].get('p95')
+        print(f"{stage:<16} throughput {change:+.0%}" +
+              (f", p95 {p95 / p95_before - 1:+.0%}" if p95 and p95_before else ''))
+        if change < -tolerance:
+            regressions.append(stage)
+    return regressions
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from controlled_vocabulary import MARKETING_CUES, CUSTOMER_TRAITS, BEHAVIORAL_OUTCOMES
+
+# Synthetic papers that cite each other, rendered as real PDFs so text
+# extraction, reference parsing and crawling all do representative work.
+
+_TOPIC_WORDS = ['Adolescent', 'Online', 'Retail', 'Mobile', 'Shopping', 'Decision', 'Persuasion',
+                'Consumer', 'Attention', 'Pricing', 'Digital', 'Youth', 'Choice', 'Platform']
+_OFF_TOPIC_WORDS = ['Soil', 'Hydrology', 'Glacier', 'Sediment', 'Basalt', 'Aquifer', 'Erosion', 'Tectonic']
+_SURNAMES = ['Smith', 'Chen', 'Garcia', 'Okafor', 'Novak', 'Tanaka', 'Singh', 'Muller', 'Rossi', 'Kim']
+_FILLER = ('Participants completed the task in a controlled setting and responses were coded '
+           'by two independent raters with high agreement across all conditions of the study.')
+# Body lines are random word sequences, so distinct papers share few word 5-grams
+_BODY_WORDS = sorted(set(_FILLER.lower().rstrip('.').split()))
+
+LINES_PER_PAGE = 50
+
+@dataclass
+class Paper:
+    paper_id: int
+    title: str
+    authors: str
+    year: int
+    relevant: bool
+    cites: List[int] = field(default_factory=list)
+
+    @property
+    def filename(self) -> str:
+        return f'paper_{self.paper_id:05d}.pdf'
+
+    @property
+    def doi(self):
+        # A third of the papers are cited with a DOI and a third with an arXiv ID
+        return f'10.5555/synthetic.{self.paper_id}' if self.paper_id % 3 == 0 else None
+
+    @property
+    def arxiv_id(self):
+        return f'2401.{self.paper_id:05d}' if self.paper_id % 3 == 1 else None
+
+    def reference_line(self) -> str:
+        line = f'{self.authors} ({self.year}). {self.title}. Journal of Synthetic Research.'
+        if self.doi:
+            line += f' https://doi.org/{self.doi}'
+        elif self.arxiv_id:
+            line += f' arXiv:{self.arxiv_id}'
+        return line
+
+class SyntheticCorpus:
+    """A citation graph of synthetic papers.
+
+    Args:
+        papers (int): Number of papers in the corpus
+        references_per_paper (int): Papers each paper cites
+        relevant_fraction (float): Share of papers about the pipeline's topic
+        body_pages (int): Pages of body text before the reference list
+        seed (int): Seed for the random generator, so runs are comparable
+    """
+
+    def __init__(self, papers: int = 50, references_per_paper: int = 5, relevant_fraction: float = 0.8,
+                 body_pages: int = 4, seed: int = 0):
+        rng = random.Random(seed)
+        self.body_pages = body_pages
+        self.papers = []
+        for paper_id in range(papers):
+            relevant = rng.random() < relevant_fraction
+            words = rng.sample(_TOPIC_WORDS if relevant else _OFF_TOPIC_WORDS, 3)
+            authors = ' and '.join(f'{name}, {rng.choice("ABCDEFGHJK")}.' for name in rng.sample(_SURNAMES, 2))
+            self.papers.append(Paper(paper_id, f'{" ".join(words)} Study {paper_id}', authors,
+                                     rng.randint(1995, 2024), relevant))
+        for paper in self.papers:
+            others = [p.paper_id for p in self.papers if p.paper_id != paper.paper_id]
+            paper.cites = rng.sample(others, min(references_per_paper, len(others)))
+        self.by_title = {paper.title: paper for paper in self.papers}
+        self._pdfs = {}
+        self._lock = threading.Lock()
+
+    def text_lines(self, paper: Paper, preprint: bool = False) -> list:
+        """Lines of a paper; the preprint version differs only in a few lines"""
+        rng = random.Random(paper.paper_id)
+        lines = [paper.title, paper.authors, '', 'Abstract']
+        if preprint:
+            lines[2] = 'Preprint. This version has not been peer reviewed.'
+        if paper.relevant:
+            cue, trait, outcome = rng.choice(MARKETING_CUES), rng.choice(CUSTOMER_TRAITS), rng.choice(BEHAVIORAL_OUTCOMES)
+            lines += [f'We find that the {cue} raises {trait} among teens,',
+                      f'which in turn predicts {outcome} in young adults.']
+        else:
+            lines += ['We survey long-term sediment transport in mountain catchments.']
+        for _ in range(self.body_pages * LINES_PER_PAGE):
+            lines.append(' '.join(rng.choice(_BODY_WORDS) for _ in range(12)))
+        if preprint:
+            lines.append('Draft manuscript; the published version may differ.')
+        lines += ['', 'References']
+        lines += [self.papers[cited].reference_line() for cited in paper.cites]
+        return lines
+
+    def pdf(self, paper: Paper, preprint: bool = False) -> bytes:
+        with self._lock:
+            if (paper.paper_id, preprint) not in self._pdfs:
+                self._pdfs[(paper.paper_id, preprint)] = render_pdf(self.text_lines(paper, preprint))
+            return self._pdfs[(paper.paper_id, preprint)]
+
+    def find(self, reference_text: str):
+        """The paper a reference line points to, if it is in the corpus"""
+        for title, paper in self.by_title.items():
+            if f'{title}.' in reference_text:
+                return paper
+        return None
+
+def _escape(line: str) -> str:
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def render_pdf(lines: list) -> bytes:
+    """A minimal PDF with one line of Helvetica text per input line"""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    objects = {1: b'<< /Type /Catalog /Pages 2 0 R >>',
+               3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'}
+    kids = []
+    for index, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        kids.append(f'{page_id} 0 R')
+        stream = 'BT /F1 10 Tf 14 TL 50 750 Td ' + ' '.join(f'({_escape(line)}) Tj T*' for line in page_lines) + ' ET'
+        stream = stream.encode('latin-1', 'replace')
+        objects[page_id] = (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>').encode()
+        objects[content_id] = b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream)
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(pages)} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b'%d 0 obj\n%s\nendobj\n' % (object_id, objects[object_id])
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for object_id in sorted(objects):
+        out += b'%010d 00000 n \n' % offsets[object_id]
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+class CorpusServer:
+    """Serves the corpus over HTTP on localhost from a background thread.
+
+    /papers/<filename> returns the PDF, /landing/<filename> an HTML landing
+    page (which the crawler must skip); anything else is a 404. It also
+    stands in for the identifier resolvers: /pdf/<arXiv ID> returns the PDF
+    and /works/doi:<DOI> an OpenAlex record pointing at it.
+
+    Args:
+        corpus (SyntheticCorpus): Papers to serve
+        latency (float): Seconds to wait before each response
+        connect_latency (float): Seconds to wait when a client opens a new
+            connection, standing in for the TCP/TLS handshake
+    """
+
+    def __init__(self, corpus: SyntheticCorpus, latency: float = 0.0, connect_latency: float = 0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.connect_latency = connect_latency
+        files = {paper.filename: paper for paper in corpus.papers}
+        by_arxiv_id = {paper.arxiv_id: paper for paper in corpus.papers if paper.arxiv_id}
+        by_doi = {paper.doi: paper for paper in corpus.papers if paper.doi}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled clients can reuse connections
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                if server.connect_latency:
+                    time.sleep(server.connect_latency)
+                super().setup()
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                kind, _, name = self.path.split('?')[0].strip('/').partition('/')
+                if kind == 'pdf':
+                    kind, paper = 'papers', by_arxiv_id.get(name)
+                elif kind == 'works' and name.startswith('doi:'):
+                    paper = by_doi.get(name[len('doi:'):])
+                else:
+                    paper = files.get(name)
+                if paper is None or kind not in ('papers', 'landing', 'works'):
+                    self.send_error(404)
+                    return
+                if kind == 'papers':
+                    body, content_type = corpus.pdf(paper), 'application/pdf'
+                elif kind == 'works':
+                    location = {'pdf_url': server.url(paper)}
+                    body = json.dumps({'doi': f'https://doi.org/{paper.doi}', 'best_oa_location': location,
+                                       'oa_locations': [location]}).encode()
+                    content_type = 'application/json'
+                else:
+                    body, content_type = f'<html><body>{paper.title}</body></html>'.encode(), 'text/html'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def url(self, paper: Paper, kind: str = 'papers') -> str:
+        return f'{self.base_url}/{kind}/{paper.filename}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,439 @@
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1 import transforms
+
+# In-memory stand-ins for the Firestore client and Storage bucket, covering
+# the calls the pipeline makes. Every read and write can be given a latency
+# to approximate network round trips.
+
+_DOCUMENT_ID = '__name__'
+
+def _get_field(data: dict, field_path: str):
+    """Value at a dotted field path, or KeyError"""
+    if field_path == _DOCUMENT_ID:
+        raise KeyError(field_path)
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+def _apply(data: dict, field_path: str, value):
+    """Set, transform or delete the field at a dotted path"""
+    parts = field_path.split('.')
+    parent = data
+    for part in parts[:-1]:
+        if not isinstance(parent.get(part), dict):
+            parent[part] = {}
+        parent = parent[part]
+    key = parts[-1]
+    if value is transforms.DELETE_FIELD:
+        parent.pop(key, None)
+    elif isinstance(value, transforms.Increment):
+        parent[key] = parent.get(key, 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        current = list(parent.get(key) or [])
+        parent[key] = current + [v for v in value.values if v not in current]
+    elif isinstance(value, transforms.ArrayRemove):
+        parent[key] = [v for v in parent.get(key) or [] if v not in value.values]
+    else:
+        parent[key] = _resolve(value)
+
+def _resolve(value):
+    """Copy of a plain value with server timestamps filled in"""
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v) for v in value]
+    return copy.deepcopy(value)
+
+def _merge(data: dict, updates: dict, prefix: str = ''):
+    """set(..., merge=True): nested maps are merged rather than replaced"""
+    for key, value in updates.items():
+        if isinstance(value, dict) and value:
+            _merge(data, value, f'{prefix}{key}.')
+        else:
+            _apply(data, f'{prefix}{key}', value)
+
+def _matches(data: dict, doc_id: str, field_path: str, op: str, value) -> bool:
+    try:
+        actual = doc_id if field_path == _DOCUMENT_ID else _get_field(data, field_path)
+    except KeyError:
+        return False
+    try:
+        if op == '==':
+            return actual == value
+        if op == '!=':
+            return actual != value
+        if op == '<':
+            return actual < value
+        if op == '<=':
+            return actual <= value
+        if op == '>':
+            return actual > value
+        if op == '>=':
+            return actual >= value
+        if op == 'in':
+            return actual in value
+        if op == 'not-in':
+            return actual not in value
+        if op == 'array-contains':
+            return isinstance(actual, list) and value in actual
+        if op == 'array-contains-any':
+            return isinstance(actual, list) and any(v in actual for v in value)
+    except TypeError:
+        # Firestore only compares values of the same type
+        return False
+    raise ValueError(f"Unsupported operator {op!r}")
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_field(self._data or {}, field_path))
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f'{self._collection_path}/{self.id}'
+
+    @property
+    def parent(self):
+        return FakeCollection(self._client, self._collection_path)
+
+    def collection(self, name):
+        return FakeCollection(self._client, f'{self.path}/{name}')
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._read(self)
+
+    def set(self, data, merge=False):
+        self._client._write([('set', self, data, merge)])
+
+    def update(self, data):
+        self._client._write([('update', self, data, None)])
+
+    def delete(self):
+        self._client._write([('delete', self, None, None)])
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+class FakeQuery:
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+
+    def _copy(self, **changes):
+        values = dict(filters=self._filters, orders=self._orders, limit=self._limit)
+        values.update(changes)
+        return FakeQuery(self._client, self._collection_path, **values)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((str(field_path), op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((str(field_path), direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        # Projections only save bandwidth; return whole documents
+        return self
+
+    def stream(self, transaction=None):
+        return iter(self.get())
+
+    def get(self, transaction=None):
+        return self._client._query(self._collection_path, self._filters, self._orders, self._limit)
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self):
+        with self._client._lock:
+            ids = list(self._client._collections.get(self._collection_path, {}))
+        return [self.document(doc_id) for doc_id in ids]
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, None))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, None))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        if writes:
+            self._client._write(writes)
+        return writes
+
+class FakeTransaction(FakeWriteBatch):
+    """Serializes transactions by holding the client's lock from begin to commit.
+
+    Implements the parts of the Transaction interface that
+    firestore.transactional drives.
+    """
+
+    _max_attempts = 5
+    _read_only = False
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self._client._lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _clean_up(self):
+        self._writes = []
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._clean_up()
+
+    def _rollback(self):
+        self._clean_up()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+    def get_all(self, references):
+        return self._client.get_all(references)
+
+class FakeFirestore:
+    """In-memory Firestore client.
+
+    Args:
+        latency (float): Seconds added to every read, query and commit
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections = {}
+        self._lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        collection_path, doc_id = path.rsplit('/', 1)
+        return FakeDocumentReference(self, collection_path, doc_id)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return [self._read(ref) for ref in references]
+
+    def _read(self, ref):
+        self._wait()
+        with self._lock:
+            self.reads += 1
+            data = self._collections.get(ref._collection_path, {}).get(ref.id)
+            return FakeSnapshot(ref, copy.deepcopy(data))
+
+    def _query(self, collection_path, filters, orders, limit):
+        self._wait()
+        with self._lock:
+            docs = self._collections.get(collection_path, {})
+            rows = [(doc_id, data) for doc_id, data in docs.items()
+                    if all(_matches(data, doc_id, *f) for f in filters)]
+            for field_path, direction in reversed(orders):
+                rows.sort(key=lambda row: row[0] if field_path == _DOCUMENT_ID else _get_field(row[1], field_path),
+                          reverse=direction == 'DESCENDING')
+            if limit is not None:
+                rows = rows[:limit]
+            self.reads += len(rows)
+            return [FakeSnapshot(FakeDocumentReference(self, collection_path, doc_id), copy.deepcopy(data))
+                    for doc_id, data in rows]
+
+    def _write(self, writes):
+        self._wait()
+        with self._lock:
+            # Check every update first so a failed commit changes nothing
+            for kind, ref, _, _ in writes:
+                if kind == 'update' and ref.id not in self._collections.get(ref._collection_path, {}):
+                    raise NotFound(f"No document to update: {ref.path}")
+            for kind, ref, data, merge in writes:
+                docs = self._collections.setdefault(ref._collection_path, {})
+                if kind == 'delete':
+                    docs.pop(ref.id, None)
+                elif kind == 'update':
+                    for field_path, value in data.items():
+                        _apply(docs[ref.id], field_path, value)
+                elif merge:
+                    _merge(docs.setdefault(ref.id, {}), data)
+                else:
+                    docs[ref.id] = {}
+                    for key, value in data.items():
+                        _apply(docs[ref.id], key, value)
+                self.writes += 1
+
+    def count(self, collection_path: str) -> int:
+        with self._lock:
+            return len(self._collections.get(collection_path, {}))
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def public_url(self):
+        return f'memory://{self.bucket.name}/{self.name}'
+
+    @property
+    def size(self):
+        data = self.bucket._objects.get(self.name)
+        return len(data) if data is not None else None
+
+    def exists(self):
+        return self.name in self.bucket._objects
+
+    def _read(self):
+        self.bucket._wait()
+        self.bucket.downloads += 1
+        try:
+            return self.bucket._objects[self.name]
+        except KeyError:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def _store(self, data: bytes):
+        self.bucket._wait()
+        self.bucket.uploads += 1
+        self.bucket._objects[self.name] = data
+
+    def upload_from_file(self, file_obj, **kwargs):
+        self._store(file_obj.read())
+
+    def upload_from_string(self, data, content_type=None):
+        self._store(data.encode() if isinstance(data, str) else data)
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as f:
+            self._store(f.read())
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        data = self._read()
+        # Like Cloud Storage, `end` is the last byte included
+        if start is not None or end is not None:
+            return data[start or 0:end + 1 if end is not None else None]
+        return data
+
+    def download_as_text(self, encoding='utf-8', **kwargs):
+        return self._read().decode(encoding)
+
+    def download_to_filename(self, filename, **kwargs):
+        data = self._read()
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def download_to_file(self, file_obj, **kwargs):
+        file_obj.write(self._read())
+
+    def delete(self):
+        self.bucket._objects.pop(self.name, None)
+
+class FakeBucket:
+    """In-memory Storage bucket.
+
+    Args:
+        latency (float): Seconds added to every upload and download
+    """
+
+    def __init__(self, name: str = 'benchmark', latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self._objects = {}
+        # Requests made, for the benchmark report
+        self.downloads = 0
+        self.uploads = 0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self._objects else None
+
+    def list_blobs(self, prefix=''):
+        return [FakeBlob(self, name) for name in list(self._objects) if name.startswith(prefix)]
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from langchain_core.messages import AIMessage
+from controlled_vocabulary import MARKETING_CUES, CUSTOMER_TRAITS, BEHAVIORAL_OUTCOMES
+from rate_limiter import get_rate_limiter, estimate_tokens
+from pipeline_metrics import metrics
+
+# Deterministic stand-ins for the OpenAI chat model and the search API.
+# Answers are derived from the synthetic paper text in the prompt, so the
+# pipeline's parsers and Firestore writes see realistic output.
+
+_REFERENCE_LINE = re.compile(r'^(?P<authors>.+?) \((?P<year>\d{4})\)\. (?P<title>.+?)\. Journal')
+_PAPER_HEADER = re.compile(r'^=== Paper (?P<key>\S+) ===$', re.MULTILINE)
+
+def _paper_text(prompt: str) -> str:
+    """The paper text embedded in one of the pipeline's prompts"""
+    for marker in ('Text of the paper:', 'Text:'):
+        if marker in prompt:
+            text = prompt.split(marker, 1)[1]
+            return text.split('The output should be formatted as a JSON instance', 1)[0]
+    return prompt
+
+def _prompt_text(prompt) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    return '\n'.join(getattr(message, 'content', str(message)) for message in prompt)
+
+def _terms_in(text: str, vocabulary: list) -> list:
+    lowered = text.lower()
+    return [term for term in vocabulary if term.lower() in lowered]
+
+class FakeLLM:
+    """Deterministic chat model with configurable latency.
+
+    Handles the (single and batched) qualification, triplet and reference
+    extraction prompts.
+    Each call sleeps `latency` seconds plus `seconds_per_1k_tokens` per
+    thousand prompt tokens, with +/- `jitter` as a fraction of that.
+
+    Args:
+        model_name (str): Model to report, which sets the prompt budget
+        latency (float): Fixed seconds per call
+        seconds_per_1k_tokens (float): Extra seconds per thousand prompt tokens
+        jitter (float): Random variation, e.g. 0.2 for +/-20%
+        seed (int): Seed for the jitter
+    """
+
+    def __init__(self, model_name: str = 'gpt-4-turbo-preview', latency: float = 0.0,
+                 seconds_per_1k_tokens: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.model_name = model_name
+        self.latency = latency
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self, prompt_tokens: int) -> float:
+        seconds = self.latency + self.seconds_per_1k_tokens * prompt_tokens / 1000
+        with self._lock:
+            self.calls += 1
+            if self.jitter:
+                seconds *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+        return max(seconds, 0)
+
+    def _message(self, prompt: str, content: str) -> AIMessage:
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        return AIMessage(content=content, usage_metadata={
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+        })
+
+    def qualification(self, text: str) -> dict:
+        topics = _terms_in(text, MARKETING_CUES + CUSTOMER_TRAITS + BEHAVIORAL_OUTCOMES)
+        return {
+            'is_relevant': bool(topics),
+            'topics_found': topics,
+            'confidence': 0.9 if topics else 0.8,
+            'reasoning': 'Mentions the controlled vocabulary' if topics else 'No consumer behavior topics',
+        }
+
+    def answer(self, prompt: str) -> str:
+        if 'is_relevant' in prompt and _PAPER_HEADER.search(prompt):
+            # Batched qualification: one result per "=== Paper <key> ===" section
+            sections = _PAPER_HEADER.split(prompt)[1:]
+            return json.dumps({'papers': [dict(self.qualification(text), paper_id=key)
+                                          for key, text in zip(sections[::2], sections[1::2])]})
+        text = _paper_text(prompt)
+        if 'is_relevant' in prompt:
+            return json.dumps(self.qualification(text))
+        if 'triplets' in prompt:
+            cues = _terms_in(text, MARKETING_CUES)
+            traits = _terms_in(text, CUSTOMER_TRAITS)
+            outcomes = _terms_in(text, BEHAVIORAL_OUTCOMES)
+            triplets = [{'subject': cue, 'predicate': 'triggers', 'object': trait} for cue in cues for trait in traits]
+            triplets += [{'subject': trait, 'predicate': 'increases', 'object': outcome}
+                         for trait in traits for outcome in outcomes]
+            for triplet in triplets:
+                triplet.update(frequency='1', context='Synthetic benchmark corpus')
+            return json.dumps({'triplets': triplets})
+        return json.dumps({'references': self.references(text)})
+
+    def references(self, text: str) -> list:
+        lines = text.split('References', 1)[1].splitlines() if 'References' in text else []
+        references = []
+        for line in lines:
+            match = _REFERENCE_LINE.match(line.strip())
+            if match:
+                references.append({
+                    'reference_text': line.strip(),
+                    'authors': match['authors'],
+                    'title': match['title'],
+                    'year': match['year'],
+                })
+        return references
+
+    def invoke(self, prompt, **kwargs) -> AIMessage:
+        prompt = _prompt_text(prompt)
+        time.sleep(self._delay(estimate_tokens(prompt)))
+        return self._message(prompt, self.answer(prompt))
+
+    async def ainvoke(self, prompt, **kwargs) -> AIMessage:
+        prompt = _prompt_text(prompt)
+        await asyncio.sleep(self._delay(estimate_tokens(prompt)))
+        return self._message(prompt, self.answer(prompt))
+
+    def with_structured_output(self, schema, include_raw: bool = False, **kwargs):
+        return _StructuredOutput(self, include_raw)
+
+class _StructuredOutput:
+    def __init__(self, llm: FakeLLM, include_raw: bool):
+        self.llm = llm
+        self.include_raw = include_raw
+
+    def invoke(self, prompt, **kwargs):
+        raw = self.llm.invoke(prompt)
+        parsed = json.loads(raw.content)
+        if self.include_raw:
+            return {'raw': raw, 'parsed': parsed, 'parsing_error': None}
+        return parsed
+
+class FakeSearch:
+    """Search provider over the synthetic corpus.
+
+    Returns the corpus server's PDF URL for a reference's paper, preceded by
+    an HTML landing page when `landing_pages` is set, the way real results
+    often are, and followed by PDFs of `related` other papers.
+
+    Args:
+        corpus (SyntheticCorpus): Papers that can be found
+        server (CorpusServer): Where the papers are served
+        latency (float): Seconds per search call
+        landing_pages (bool): Also return an HTML landing page per hit
+        related (int): Other papers' PDFs returned after each hit
+    """
+
+    def __init__(self, corpus, server, latency: float = 0.0, landing_pages: bool = True, related: int = 0):
+        self.corpus = corpus
+        self.server = server
+        self.latency = latency
+        self.landing_pages = landing_pages
+        self.related = related
+
+    def search(self, paper_info: str) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        paper = self.corpus.find(paper_info)
+        if paper is None:
+            return []
+        results = []
+        if self.landing_pages:
+            results.append({'url': self.server.url(paper, 'landing'), 'title': paper.title})
+        results.append({'url': self.server.url(paper), 'title': paper.title})
+        papers = self.corpus.papers
+        for offset in range(1, min(self.related, len(papers) - 1) + 1):
+            other = papers[(paper.paper_id + offset) % len(papers)]
+            results.append({'url': self.server.url(other), 'title': other.title})
+        return results
+
+    def __call__(self, paper_info: str, *args, **kwargs) -> list:
+        # Same accounting as search_providers.search_papers
+        metrics.add('search_calls_total')
+        return get_rate_limiter().call('google_cse', lambda: self.search(paper_info))
@@ -0,0 +1,75 @@
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold-start import time of each Streamlit page: the page's top-level
+# imports are run in a fresh interpreter, so nothing is cached in
+# sys.modules, and the slowest top-level packages are listed:
+#
+#   python -m benchmark.imports
+#   python -m benchmark.imports --repeat 5 --json imports.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def page_files() -> list:
+    return ['ui.py'] + sorted(glob.glob('pages/*.py', root_dir=ROOT),
+                              key=lambda path: int(os.path.basename(path).split('_', 1)[0]))
+
+def page_imports(path: str) -> str:
+    """Source of a page's module-level import statements"""
+    with open(os.path.join(ROOT, path)) as f:
+        tree = ast.parse(f.read())
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+def _parse_importtime(stderr: str) -> dict:
+    """Cumulative microseconds of each top-level import from `python -X importtime`"""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(' '):
+            packages[name.strip()] = packages.get(name.strip(), 0) + int(cumulative)
+    return packages
+
+def cold_start(path: str) -> dict:
+    """Seconds to run a page's imports in a new interpreter, with the slowest packages"""
+    code = f"import time\nstarted = time.perf_counter()\n{page_imports(path)}\nprint(time.perf_counter() - started)"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True,
+                            text=True, env={**os.environ, 'PYTHONPATH': ROOT})
+    if result.returncode:
+        raise RuntimeError(f"Importing {path} failed:\n{result.stderr.splitlines()[-1]}")
+    packages = _parse_importtime(result.stderr)
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:3]
+    return {'seconds': float(result.stdout.strip().splitlines()[-1]),
+            'slowest': [(name, micros / 1e6) for name, micros in slowest if name != 'time']}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmark.imports',
+                                     description='Measure cold-start import time per Streamlit page.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per page; the median is reported')
+    parser.add_argument('--json', metavar='PATH', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = {}
+    print(f"{'page':<36}{'cold start':>12}  slowest imports")
+    for path in page_files():
+        runs = [cold_start(path) for _ in range(args.repeat)]
+        seconds = statistics.median(run['seconds'] for run in runs)
+        slowest = runs[-1]['slowest']
+        report[path] = {'seconds': seconds, 'slowest': slowest}
+        print(f"{path:<36}{seconds * 1000:>10.0f}ms  " +
+              ', '.join(f'{name} {value * 1000:.0f}ms' for name, value in slowest))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
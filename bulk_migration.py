@@ -0,0 +1,167 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from firebase_admin import firestore
+
+MIGRATIONS_COLLECTION = 'migrations'
+
+def _migration_id(collection_name: str, field_name: str) -> str:
+    return f"{collection_name}__{field_name}".replace('/', '_')
+
+def plan_partitions(db, collection_name: str, partition_count: int) -> dict:
+    """Split a collection into document ID ranges.
+
+    Uses Firestore partition queries on the collection group, which return
+    roughly equal sized ranges without reading the documents.
+
+    Args:
+        db: Firestore client
+        collection_name (str): Top-level collection to split
+        partition_count (int): Desired number of partitions
+
+    Returns:
+        dict: Partition key ('p0', 'p1', ...) -> {'start': doc ID or None, 'end': doc ID or None}
+    """
+    boundaries = []
+    for partition in db.collection_group(collection_name).get_partitions(partition_count):
+        if partition.start_at is not None:
+            boundaries.append(partition.start_at.id)
+    boundaries = sorted(set(boundaries))
+    starts = [None] + boundaries
+    ends = boundaries + [None]
+    return {f'p{i}': {'start': start, 'end': end} for i, (start, end) in enumerate(zip(starts, ends))}
+
+def _partition_query(db, collection_name, start_after, start_at, end_before):
+    collection = db.collection(collection_name)
+    query = collection.order_by(firestore.FieldPath.document_id())
+    if start_after:
+        query = query.start_after({firestore.FieldPath.document_id(): collection.document(start_after)})
+    elif start_at:
+        query = query.start_at({firestore.FieldPath.document_id(): collection.document(start_at)})
+    if end_before:
+        query = query.end_before({firestore.FieldPath.document_id(): collection.document(end_before)})
+    return query
+
+def migrate_missing_field(db, collection_name: str, field_name: str, default_value,
+                          partition_count: int = 8, max_workers: int = 8, page_size: int = 500,
+                          dry_run: bool = False, restart: bool = False, progress=None) -> dict:
+    """Add a field with a default value to every document that lacks it.
+
+    The collection is split into ID ranges that are scanned concurrently.
+    Each range reads only the field being migrated, writes through a
+    BulkWriter, and records the last document ID it finished in
+    `migrations/<collection>__<field>` after each page, so an interrupted
+    run resumes where it stopped. A dry run only counts the documents that
+    would change and leaves no checkpoint behind.
+
+    Args:
+        db: Firestore client
+        collection_name (str): The name of the Firestore collection
+        field_name (str): The name of the field to check/add
+        default_value: The value to assign if the field is missing
+        partition_count (int): Number of ID ranges to split the collection into
+        max_workers (int): Number of ranges processed at the same time
+        page_size (int): Documents read per page, and between checkpoints
+        dry_run (bool): Count missing documents without updating them
+        restart (bool): Ignore any existing checkpoint and start over
+        progress (callable): Called as progress(scanned, missing) from the calling thread
+
+    Returns:
+        dict: Totals with 'scanned', 'missing' and 'updated' counts, and whether
+        the run 'resumed' from a checkpoint
+    """
+    checkpoint_ref = db.collection(MIGRATIONS_COLLECTION).document(_migration_id(collection_name, field_name))
+    checkpoint = None if (dry_run or restart) else checkpoint_ref.get()
+
+    if checkpoint is not None and checkpoint.exists \
+            and checkpoint.get('status') == 'Running' and checkpoint.get('value') == default_value:
+        partitions = checkpoint.get('partitions')
+        resumed = True
+    else:
+        resumed = False
+        partitions = plan_partitions(db, collection_name, partition_count)
+        for state in partitions.values():
+            state.update({'last_id': None, 'done': False, 'scanned': 0, 'missing': 0})
+        if not dry_run:
+            checkpoint_ref.set({
+                'collection': collection_name,
+                'field': field_name,
+                'value': default_value,
+                'status': 'Running',
+                'partitions': partitions,
+                'created_timestamp': firestore.SERVER_TIMESTAMP,
+                'updated_timestamp': firestore.SERVER_TIMESTAMP
+            })
+
+    lock = threading.Lock()
+    # Set on the first failure, so the other partitions stop after their current page
+    stop = threading.Event()
+    totals = {
+        'scanned': sum(state['scanned'] for state in partitions.values()),
+        'missing': sum(state['missing'] for state in partitions.values()),
+        'updated': 0,
+        'resumed': resumed,
+    }
+    if resumed and progress is not None:
+        # Start from the counts of the interrupted run
+        progress(totals['scanned'], totals['missing'])
+
+    def run_partition(key, state):
+        if state['done']:
+            return
+        writer = None if dry_run else db.bulk_writer()
+        # Closing flushes any writes still queued, even when the scan fails part way
+        try:
+            last_id = state['last_id']
+            while not stop.is_set():
+                query = _partition_query(db, collection_name, last_id, state['start'], state['end'])
+                docs = list(query.select([field_name]).limit(page_size).stream())
+                missing = [doc for doc in docs if field_name not in doc.to_dict()]
+                if writer is not None:
+                    for doc in missing:
+                        writer.update(doc.reference, {field_name: default_value})
+                    # Only checkpoint once the page's writes are durable
+                    writer.flush()
+                if docs:
+                    last_id = docs[-1].id
+                done = len(docs) < page_size
+                with lock:
+                    totals['scanned'] += len(docs)
+                    totals['missing'] += len(missing)
+                    if writer is not None:
+                        totals['updated'] += len(missing)
+                if writer is not None:
+                    checkpoint_ref.update({
+                        f'partitions.{key}.last_id': last_id,
+                        f'partitions.{key}.done': done,
+                        f'partitions.{key}.scanned': firestore.Increment(len(docs)),
+                        f'partitions.{key}.missing': firestore.Increment(len(missing)),
+                        'updated_timestamp': firestore.SERVER_TIMESTAMP
+                    })
+                if done:
+                    break
+        except Exception:
+            stop.set()
+            raise
+        finally:
+            if writer is not None:
+                writer.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_partition, key, state) for key, state in partitions.items()]
+        pending = futures
+        while pending:
+            _, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+            if progress is not None:
+                with lock:
+                    progress(totals['scanned'], totals['missing'])
+            # Surface the first failure; the checkpoint lets the next run resume
+            for future in futures:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+
+    if not dry_run:
+        checkpoint_ref.update({
+            'status': 'Completed',
+            'updated_timestamp': firestore.SERVER_TIMESTAMP
+        })
+    return totals
@@ -0,0 +1,78 @@
+import io
+import re
+from urllib.parse import urlsplit
+
+# Ranks a reference's candidate URLs (from the resolver or a search) so the
+# crawl can download the likeliest copy of the cited paper first and stop
+# at the first PDF that is verified to be it, instead of storing every hit.
+
+# Hosts of publishers, repositories and preprint servers, matched as domain suffixes
+ACADEMIC_DOMAINS = (
+    'arxiv.org', 'doi.org', 'ncbi.nlm.nih.gov', 'europepmc.org', 'semanticscholar.org', 'ssrn.com',
+    'researchgate.net', 'sciencedirect.com', 'springer.com', 'wiley.com', 'tandfonline.com', 'sagepub.com',
+    'jstor.org', 'acm.org', 'ieee.org', 'nature.com', 'frontiersin.org', 'mdpi.com', 'plos.org',
+    'osf.io', 'psyarxiv.com', 'core.ac.uk', 'zenodo.org', '.edu', '.ac.uk',
+)
+
+# Candidates built from the reference's own DOI, arXiv ID or PDF link
+IDENTIFIER_SOURCES = {'pdf_url', 'arxiv', 'doi'}
+
+_STOPWORDS = {'the', 'and', 'for', 'with', 'from', 'that', 'this', 'into', 'its', 'are', 'pdf'}
+
+def title_words(title: str) -> set:
+    return {word for word in re.findall(r'[a-z0-9]+', str(title).lower())
+            if len(word) > 2 and word not in _STOPWORDS}
+
+def title_similarity(title: str, other: str) -> float:
+    """Overlap of two titles' words, between 0 and 1.
+
+    Search engines cut long titles short, so a title that is all contained
+    in the other counts as a full match; very short titles need an exact
+    word match instead.
+    """
+    words, other_words = title_words(title), title_words(other)
+    if not words or not other_words:
+        return 0.0
+    common = len(words & other_words)
+    if min(len(words), len(other_words)) < 3:
+        return common / len(words | other_words)
+    return common / min(len(words), len(other_words))
+
+def is_academic_url(url: str) -> bool:
+    host = urlsplit(url).netloc.lower().split(':')[0]
+    return any(host == domain or host.endswith(domain if domain.startswith('.') else f'.{domain}')
+               for domain in ACADEMIC_DOMAINS)
+
+def score_candidate(result: dict, reference_title: str) -> float:
+    """How likely a candidate URL is the cited paper's PDF (higher is better)"""
+    score = 3 * title_similarity(result.get('title', ''), reference_title)
+    if result.get('source') in IDENTIFIER_SOURCES:
+        score += 3
+    if urlsplit(result['url']).path.lower().endswith('.pdf'):
+        score += 1
+    if is_academic_url(result['url']):
+        score += 1
+    return score
+
+def rank_candidates(results: list, reference_title: str) -> list:
+    """Candidates best first; ties keep the order they came in"""
+    return sorted(results, key=lambda result: -score_candidate(result, reference_title))
+
+def pdf_matches_title(content: bytes, reference_title: str, threshold: float):
+    """Whether a PDF's first page carries the reference's title.
+
+    Returns:
+        bool or None: None if the first page has no text to check
+    """
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        text = reader.pages[0].extract_text() if reader.pages else ''
+    except Exception as e:
+        print(f"Could not read the first page of a downloaded PDF: {e}")
+        return None
+    words = title_words(reference_title)
+    if not text or not words:
+        return None
+    return len(words & title_words(text)) / len(words) >= threshold
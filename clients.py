@@ -0,0 +1,161 @@
+import asyncio
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import streamlit as st
+
+# Long-lived provider clients shared by every session and worker thread in
+# the process, so calls reuse pooled keep-alive connections instead of
+# paying for a TCP/TLS handshake (and client setup) each time.
+
+# Override in the optional [http] section of secrets.toml
+DEFAULT_HTTP_CONFIG = {
+    'max_connections': 64,
+    'max_keepalive_connections': 32,
+    'keepalive_expiry': 30,
+    'connect_timeout': 10,
+    'http2': True,
+}
+
+# Most search clients kept for reuse; more are created under heavier concurrency
+SEARCH_CLIENT_POOL_SIZE = 8
+
+# Clients by key, created on first use; the lock keeps concurrent workers
+# from each building their own
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _shared(key, factory):
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+def load_http_config() -> dict:
+    """HTTP pool settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_HTTP_CONFIG)
+    try:
+        if 'http' in st.secrets:
+            config.update(dict(st.secrets['http']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_http_client():
+    """Pooled httpx client for downloads; HTTP/2 when the h2 package is installed"""
+    return _shared('http', _new_http_client)
+
+def _new_http_client():
+    import httpx
+
+    config = load_http_config()
+    return httpx.Client(
+        http2=bool(config['http2']) and _http2_available(),
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=int(config['max_connections']),
+                            max_keepalive_connections=int(config['max_keepalive_connections']),
+                            keepalive_expiry=float(config['keepalive_expiry'])),
+        timeout=httpx.Timeout(120, connect=float(config['connect_timeout'])),
+    )
+
+class ClientPool:
+    """Reusable clients that can't be shared between threads.
+
+    Each caller borrows an idle client (or a new one if none is idle) and
+    returns it afterwards; up to `size` idle clients are kept.
+    """
+
+    def __init__(self, factory, size: int):
+        self.factory = factory
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def client(self):
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            client = self.factory()
+        try:
+            yield client
+        finally:
+            try:
+                self._idle.put_nowait(client)
+            except queue.Full:
+                pass
+
+def get_search_pool(google_api_key: str, google_cse_id: str) -> ClientPool:
+    """Google Custom Search clients for a key and engine.
+
+    Each client holds an httplib2 connection, which isn't thread-safe, so
+    they are pooled rather than shared.
+    """
+    def factory():
+        from langchain_google_community import GoogleSearchAPIWrapper
+
+        return GoogleSearchAPIWrapper(google_api_key=google_api_key, google_cse_id=google_cse_id, k=5)
+
+    return _shared(('search', google_api_key, google_cse_id), lambda: ClientPool(factory, SEARCH_CLIENT_POOL_SIZE))
+
+def get_openai_client():
+    """OpenAI SDK client, for the Files and Batch APIs that LangChain doesn't cover"""
+    return _shared('openai', _new_openai_client)
+
+def _new_openai_client():
+    from openai import OpenAI
+
+    return OpenAI(api_key=st.secrets['OPENAI_API_KEY'])
+
+def get_event_loop():
+    """Event loop for async LLM calls, running in its own thread for the life of the process.
+
+    Async clients keep their pooled connections bound to the loop that
+    opened them (langchain_openai caches one httpx.AsyncClient per process),
+    so every run awaits them on this loop instead of a fresh asyncio.run()
+    loop that is closed afterwards.
+    """
+    return _shared('event_loop', _new_event_loop)
+
+def _new_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='async-clients', daemon=True).start()
+    return loop
+
+def configure_tracing():
+    """Turn on LangSmith tracing if a [langsmith] section is in secrets.toml.
+
+    Example:
+        [langsmith]
+        api_key = "lsv2_..."
+        project = "ReferenceCrawler"
+    """
+    try:
+        settings = dict(st.secrets['langsmith']) if 'langsmith' in st.secrets else {}
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        settings = {}
+    if not settings.get('api_key'):
+        return
+    os.environ.setdefault('LANGCHAIN_TRACING_V2', 'true')
+    os.environ.setdefault('LANGCHAIN_API_KEY', settings['api_key'])
+    os.environ.setdefault('LANGCHAIN_PROJECT', settings.get('project', 'ReferenceCrawler'))
+    os.environ.setdefault('LANGCHAIN_ENDPOINT', settings.get('endpoint', 'https://api.smith.langchain.com'))
+
+@st.cache_resource
+def get_chat_model(model_name: str, temperature: float = 0):
+    """OpenAI chat model shared by every session (and its connection pool)"""
+    from langchain_openai import ChatOpenAI
+
+    configure_tracing()
+    # Every call goes through the rate limiter, which does the retrying; the
+    # client's own retries would multiply with its attempts
+    return ChatOpenAI(openai_api_key=st.secrets['OPENAI_API_KEY'], model_name=model_name, temperature=temperature,
+                      max_retries=0)
@@ -0,0 +1,58 @@
+# Controlled vocabulary used by the Group B triplet prompt and the triplet store
+
+MARKETING_CUES = [
+    'Countdown Timer',
+    'Flash Sale Banner',
+    'Scarcity Message',
+    'Product Rating',
+    'Urgency Tone',
+    'Social Proof Message',
+]
+
+CUSTOMER_TRAITS = [
+    'Impulsivity',
+    'FOMO',
+    'Cognitive Load',
+    'Low Self-Regulation',
+    'Trust in Authority',
+    'Anxiety',
+]
+
+BEHAVIORAL_OUTCOMES = [
+    'Impulsive Purchase',
+    'Cart Abandonment',
+    'Satisfaction',
+    'Regret',
+    'Return Behavior',
+]
+
+# Free-text phrasings the LLM commonly uses for vocabulary terms.
+# Keys are matched after normalization, so case, spacing and plurals don't matter.
+ENTITY_ALIASES = {
+    'countdown clock': 'Countdown Timer',
+    'timer': 'Countdown Timer',
+    'flash sale': 'Flash Sale Banner',
+    'limited stock message': 'Scarcity Message',
+    'scarcity cue': 'Scarcity Message',
+    'scarcity': 'Scarcity Message',
+    'rating': 'Product Rating',
+    'customer rating': 'Product Rating',
+    'online review': 'Product Rating',
+    'urgency': 'Urgency Tone',
+    'urgency cue': 'Urgency Tone',
+    'social proof': 'Social Proof Message',
+    'impulsiveness': 'Impulsivity',
+    'fear of missing out': 'FOMO',
+    'low self-control': 'Low Self-Regulation',
+    'self-regulation failure': 'Low Self-Regulation',
+    'impulse buying': 'Impulsive Purchase',
+    'impulsive buying': 'Impulsive Purchase',
+    'impulse purchase': 'Impulsive Purchase',
+    'impulsive buying behavior': 'Impulsive Purchase',
+    'shopping cart abandonment': 'Cart Abandonment',
+    'customer satisfaction': 'Satisfaction',
+    'post-purchase regret': 'Regret',
+    'product return': 'Return Behavior',
+}
+
+VOCABULARY = MARKETING_CUES + CUSTOMER_TRAITS + BEHAVIORAL_OUTCOMES
@@ -0,0 +1,94 @@
+from firebase_admin import firestore
+
+# What the crawl tried for a reference (resolver candidates, search results
+# and failed downloads) is kept in one document per crawl run under
+# references/<id>/crawl_attempts, instead of in arrays on the reference
+# itself. Reference documents stay small and fixed-size however often a
+# reference is retried, so the pages and listeners that scan the collection
+# move far fewer bytes; the reference only carries counts.
+
+ATTEMPTS_COLLECTION = 'crawl_attempts'
+
+# Fields older crawls stored on the reference document
+LEGACY_FIELDS = ['resolved_results', 'search_results', 'failed_downloads']
+
+def record_attempt(batch, reference_ref, resolved_results: list, search_results: list,
+                   failed_downloads: list, downloaded_files: list, error: str = None) -> dict:
+    """Add a crawl run's log to a write batch.
+
+    Returns:
+        dict: Summary updates for the reference document itself
+    """
+    batch.set(reference_ref.collection(ATTEMPTS_COLLECTION).document(), {
+        'resolved_results': resolved_results,
+        'search_results': search_results,
+        'failed_downloads': failed_downloads,
+        'downloaded_files': downloaded_files,
+        'error': error,
+        'created_timestamp': firestore.SERVER_TIMESTAMP
+    })
+    return {
+        'crawl_attempts': firestore.Increment(1),
+        'resolved_result_count': len(resolved_results),
+        'search_result_count': len(search_results),
+        'failed_download_count': firestore.Increment(len(failed_downloads)),
+    }
+
+def load_attempts(db, reference_id: str) -> list:
+    """A reference's crawl runs, oldest first"""
+    attempts = db.collection('references').document(reference_id).collection(ATTEMPTS_COLLECTION)
+    return [doc.to_dict() for doc in attempts.order_by('created_timestamp').stream()]
+
+def move_legacy_fields(db, page_size: int = 200, progress=None) -> dict:
+    """Move the crawl arrays of references crawled before crawl_attempts existed.
+
+    Each reference that still has them gets one crawl_attempts document
+    with their contents and the counts on itself, and the arrays are
+    deleted, in one batch per page. References already moved are skipped,
+    so an interrupted run can simply be started again.
+
+    Args:
+        db: Firestore client
+        page_size (int): References read per page
+        progress (callable): Called as progress(scanned, moved) after each page
+
+    Returns:
+        dict: Totals with 'scanned' and 'moved' counts
+    """
+    collection = db.collection('references')
+    totals = {'scanned': 0, 'moved': 0}
+    last = None
+    while True:
+        query = collection.order_by(firestore.FieldPath.document_id()).select(LEGACY_FIELDS).limit(page_size)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        batch = db.batch()
+        for doc in docs:
+            data = doc.to_dict()
+            if not any(field in data for field in LEGACY_FIELDS):
+                continue
+            failed = data.get('failed_downloads') or []
+            batch.set(doc.reference.collection(ATTEMPTS_COLLECTION).document(), {
+                'resolved_results': data.get('resolved_results') or [],
+                'search_results': data.get('search_results') or [],
+                'failed_downloads': failed,
+                'migrated': True,
+                'created_timestamp': firestore.SERVER_TIMESTAMP
+            })
+            batch.update(doc.reference, {
+                **{field: firestore.DELETE_FIELD for field in LEGACY_FIELDS},
+                'crawl_attempts': firestore.Increment(1),
+                'resolved_result_count': len(data.get('resolved_results') or []),
+                'search_result_count': len(data.get('search_results') or []),
+                'failed_download_count': firestore.Increment(len(failed)),
+            })
+            totals['moved'] += 1
+        batch.commit()
+        totals['scanned'] += len(docs)
+        if progress is not None:
+            progress(totals['scanned'], totals['moved'])
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+    return totals
@@ -0,0 +1,152 @@
+import re
+from firebase_admin import firestore
+from rate_limiter import estimate_tokens
+
+# Budgets are per depth; 0 means unlimited
+DEFAULT_CRAWL_CONFIG = {
+    'max_depth': 3,
+    'papers_per_depth': 0,
+    'search_queries_per_depth': 0,
+    'llm_tokens_per_depth': 0,
+    'candidate_pool': 20,
+    # Download every search result instead of stopping at the first verified copy of the paper
+    'fetch_all_candidates': False,
+    # Share of the reference title's words a PDF's first page must contain to count as the paper
+    'title_match_threshold': 0.6,
+}
+
+BUDGET_FIELDS = {
+    'papers': 'papers_per_depth',
+    'search_queries': 'search_queries_per_depth',
+    'llm_tokens': 'llm_tokens_per_depth',
+}
+
+def load_crawl_config() -> dict:
+    """Crawl settings from the optional [crawl] section of secrets.toml"""
+    import streamlit as st
+
+    config = dict(DEFAULT_CRAWL_CONFIG)
+    if 'crawl' in st.secrets:
+        config.update(dict(st.secrets['crawl']))
+    return config
+
+def citation_key(title: str, year: str = '') -> str:
+    """Key that identifies the same cited work across different citing papers"""
+    words = re.sub(r'[^a-z0-9\s]', ' ', str(title).lower()).split()
+    if not words:
+        return ''
+    year = str(year or '').strip()
+    return '_'.join(words + ([year] if year else []))[:500]
+
+class CrawlFrontier:
+    """Breadth-first scheduler for the crawl with per-depth budgets.
+
+    Work is handed out from the shallowest depth that still has budget, up
+    to max_depth. Within a depth, references cited by more qualified papers
+    are crawled first. Usage is tracked in `crawl_budget/depth_<n>` so the
+    budgets hold across sessions.
+    """
+
+    def __init__(self, db, config: dict = None):
+        self.db = db
+        self.config = dict(DEFAULT_CRAWL_CONFIG)
+        self.config.update(config or {})
+        self._usage = {}
+
+    @property
+    def max_depth(self) -> int:
+        return int(self.config['max_depth'])
+
+    def _usage_ref(self, depth: int):
+        return self.db.collection('crawl_budget').document(f'depth_{depth}')
+
+    def usage(self, depth: int, refresh: bool = False) -> dict:
+        """Papers, search queries and LLM tokens spent so far at a depth"""
+        if refresh or depth not in self._usage:
+            snapshot = self._usage_ref(depth).get()
+            data = snapshot.to_dict() if snapshot.exists else {}
+            self._usage[depth] = {field: data.get(field, 0) for field in BUDGET_FIELDS}
+        return self._usage[depth]
+
+    def has_budget(self, depth: int, **needs) -> bool:
+        """Whether the depth is within max_depth and can afford the given usage.
+
+        Example: has_budget(2, search_queries=1, papers=1)
+        """
+        if depth > self.max_depth:
+            return False
+        usage = self.usage(depth)
+        for field, amount in needs.items():
+            limit = int(self.config.get(BUDGET_FIELDS[field], 0) or 0)
+            if limit and usage[field] + amount > limit:
+                return False
+        return True
+
+    def charge(self, depth: int, **spent):
+        """Record usage at a depth, e.g. charge(2, llm_tokens=1200)"""
+        usage = self.usage(depth)
+        for field, amount in spent.items():
+            usage[field] += amount
+        self._usage_ref(depth).set({
+            **{field: firestore.Increment(amount) for field, amount in spent.items()},
+            'depth': depth,
+            'updated_timestamp': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+    def _priorities(self, references) -> dict:
+        """Number of distinct qualified papers citing each reference's work"""
+        keys = {doc.id: doc.to_dict().get('citation_key') for doc in references}
+        refs = [self.db.collection('citations').document(key) for key in set(keys.values()) if key]
+        counts = {}
+        for snapshot in self.db.get_all(refs):
+            if snapshot.exists:
+                counts[snapshot.id] = len(snapshot.to_dict().get('cited_by', []))
+        return {doc_id: counts.get(key, 1) for doc_id, key in keys.items()}
+
+    def next_references(self, limit: int) -> list:
+        """References to crawl next, shallowest depth first.
+
+        Args:
+            limit (int): Maximum number of references to return
+
+        Returns:
+            list: Reference DocumentSnapshots ordered by depth, then citation count
+        """
+        selected = []
+        for depth in range(1, self.max_depth + 1):
+            if len(selected) >= limit:
+                break
+            if not self.has_budget(depth, search_queries=1):
+                continue
+            query = self.db.collection('references')
+            query = query.where('status', '==', 'NewReference')
+            query = query.where('depth', '==', depth)
+            # Read a wider pool than needed so the most cited references win
+            candidates = list(query.limit(limit * int(self.config['candidate_pool'])).stream())
+            if not candidates:
+                continue
+            priorities = self._priorities(candidates)
+            candidates.sort(key=lambda doc: priorities[doc.id], reverse=True)
+            selected.extend(candidates[:limit - len(selected)])
+        return selected
+
+    def next_papers_for_references(self, limit: int) -> list:
+        """Qualified papers to extract references from, shallowest depth first.
+
+        Papers at max_depth are never expanded, since their references would
+        fall outside the crawl. Papers without a depth field can't be
+        selected; the System Administration page's Add Depth gives them
+        depth 1.
+        """
+        selected = []
+        for depth in range(1, self.max_depth):
+            if len(selected) >= limit:
+                break
+            if not self.has_budget(depth, llm_tokens=1):
+                continue
+            query = self.db.collection('pdf_files')
+            query = query.where('status', '==', 'TextExtracted')
+            query = query.where('qualified', '==', True)
+            query = query.where('depth', '==', depth)
+            selected.extend(query.limit(limit - len(selected)).stream())
+        return selected
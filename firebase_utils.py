@@ -1,4 +1,8 @@
 from firebase_admin import credentials, firestore, initialize_app, storage, get_app
+import tempfile
+from contextlib import contextmanager
+from bulk_migration import migrate_missing_field
+from pipeline_metrics import record_bytes
 
 # Initialize Firebase only if it hasn't been initialized
 def get_firebase_app():
@@ -15,35 +19,77 @@ def get_firebase_app():
         cred = credentials.Certificate(firebase_config)
         return initialize_app(cred, {'storageBucket': 'referencecrawler.firebasestorage.app'})
 
-# Get or initialize Firebase app
-app = get_firebase_app()
+# Downloads are buffered in memory up to this size and spill to an unnamed
+# temporary file above it, which is removed when the buffer is closed
+SPILL_THRESHOLD_BYTES = 32 * 1024 * 1024
 
-# Get Firestore and Storage clients
-db = firestore.client(app)
-bucket = storage.bucket(app=app)
+# Firestore and Storage clients, created on first use
+_clients = {}
+
+def get_db():
+    if 'db' not in _clients:
+        _clients['db'] = firestore.client(get_firebase_app())
+    return _clients['db']
+
+def get_bucket():
+    if 'bucket' not in _clients:
+        _clients['bucket'] = storage.bucket(app=get_firebase_app())
+    return _clients['bucket']
+
+def use_clients(db=None, bucket=None):
+    """Use the given Firestore and Storage clients instead of the Firebase app's.
+
+    The benchmark uses this to run the pipeline against in-memory fakes.
+    """
+    if db is not None:
+        _clients['db'] = db
+    if bucket is not None:
+        _clients['bucket'] = bucket
+
+def __getattr__(name):
+    # Keeps `firebase_utils.db` working for older code; importing firebase_utils
+    # doesn't connect, but `from firebase_utils import db` does, so pages use get_db()
+    if name == 'db':
+        return get_db()
+    if name == 'bucket':
+        return get_bucket()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Firebase utility functions
 def upload_pdf_to_storage(file, filename):
-    blob = bucket.blob(f'pdf_files/{filename}')
+    blob = get_bucket().blob(f'pdf_files/{filename}')
     blob.upload_from_file(file)
+    record_bytes(uploaded=blob.size or 0)
     return blob.public_url
 
-def download_pdf_from_storage(filename, temp_file):
-    blob = bucket.blob(f'pdf_files/{filename}')
-    blob.download_to_filename(temp_file.name)
+@contextmanager
+def open_pdf_from_storage(filename, spill_threshold=SPILL_THRESHOLD_BYTES):
+    """Download a PDF into a buffer, for pypdf or an upload to read in place.
 
-def download_txt_from_storage(filename, temp_file):
-    """Download a text file from Firebase Storage"""
-    blob = bucket.blob(f'txt_files/{filename}.txt')
-    blob.download_to_filename(temp_file.name)
+    Yields:
+        A binary file object at the start of the PDF; in memory unless the
+        PDF is larger than spill_threshold, and gone when the block exits
+    """
+    with tempfile.SpooledTemporaryFile(max_size=spill_threshold) as buffer:
+        get_bucket().blob(f'pdf_files/{filename}').download_to_file(buffer)
+        record_bytes(downloaded=buffer.tell())
+        buffer.seek(0)
+        yield buffer
+
+def download_pdf_as_bytes(filename):
+    """Download a PDF's content directly from Firebase Storage"""
+    content = get_bucket().blob(f'pdf_files/{filename}').download_as_bytes()
+    record_bytes(downloaded=len(content))
+    return content
 
 def upload_txt_to_storage(content, filename):
-    blob = bucket.blob(f'txt_files/{filename}.txt')
+    blob = get_bucket().blob(f'txt_files/{filename}.txt')
     blob.upload_from_string(content)
+    record_bytes(uploaded=len(content.encode()))
     return blob.public_url
 
 def add_pdf_record(file_id):
-    db.collection('pdf_files').add({
+    get_db().collection('pdf_files').add({
         'file_id': file_id,
         'status': 'Initial',
         'depth': 1,
@@ -53,7 +99,7 @@ def add_pdf_record(file_id):
     })
 
 def update_pdf_record(doc_id, updates):
-    db.collection('pdf_files').document(doc_id).update(updates)
+    get_db().collection('pdf_files').document(doc_id).update(updates)
 
 def download_text_from_storage(filename):
     """Download text content directly from Firebase Storage
@@ -64,26 +110,25 @@ def download_text_from_storage(filename):
     Returns:
         str: Text content of the file
     """
-    blob = bucket.blob(f'txt_files/{filename}.txt')
-    return blob.download_as_text()
+    blob = get_bucket().blob(f'txt_files/{filename}.txt')
+    text = blob.download_as_text()
+    record_bytes(downloaded=len(text.encode()))
+    return text
 
 # Add more Firebase utility functions as needed
-def add_missing_field(collection_name: str, field_name: str, default_value):
+def add_missing_field(collection_name: str, field_name: str, default_value, **kwargs):
     """
     Adds a missing field with a default value to documents in a Firestore collection.
 
+    Runs as a partitioned, resumable bulk migration; see
+    bulk_migration.migrate_missing_field for the available options.
+
     Args:
         collection_name (str): The name of the Firestore collection.
         field_name (str): The name of the field to check/add.
         default_value: The value to assign if the field is missing.
+
+    Returns:
+        dict: Totals with 'scanned', 'missing' and 'updated' counts
     """
-    docs = db.collection(collection_name).stream()
-
-    for doc in docs:
-        data = doc.to_dict()
-        if field_name not in data:
-            doc_ref = db.collection(collection_name).document(doc.id)
-            doc_ref.update({field_name: default_value})
-            print(f"Updated {doc.id}: set '{field_name}' to {default_value}")
-        else:
-            print(f"Skipped {doc.id}: '{field_name}' already exists")
+    return migrate_missing_field(get_db(), collection_name, field_name, default_value, **kwargs)
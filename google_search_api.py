@@ -1,35 +1,52 @@
 import streamlit as st
 
-import os
+from clients import get_search_pool
+from rate_limiter import get_rate_limiter
+from pipeline_metrics import metrics
 
-from langchain_core.tools import Tool
-from langchain_google_community import GoogleSearchAPIWrapper
 
+def google_cse_results(paper_info, google_api_key, google_cse_id, num_results=5):
+    """One Google Custom Search request for a paper's PDF.
 
-def search_and_get_paper_links(paper_info, google_api_key=st.secrets['GOOGLE_API_KEY'], google_cse_id=st.secrets['GOOGLE_CSE_ID']):
-    """Search for papers and return their URLs and titles.
-    
-    Args:
-        paper_info (str): The paper information to search for
-        google_api_key (str): Google Custom Search API key
-        google_cse_id (str): Google Custom Search Engine ID
-        
     Returns:
-        list[dict]: List of dictionaries containing 'url' and 'title' for each result
+        list[dict]: 'url' and 'title' of each result
     """
-    print(f"Searching for {paper_info}\n***********\n\n\n")
-    os.environ["GOOGLE_CSE_ID"] = google_cse_id
-    os.environ["GOOGLE_API_KEY"] = google_api_key
-    
-    tool = GoogleSearchAPIWrapper(k=5)
-    results = tool.results(f"{paper_info} filetype:pdf", num_results=5)
-    
+    # Reuse a pooled client (and its connection) instead of building one per search
+    with get_search_pool(google_api_key, google_cse_id).client() as tool:
+        results = tool.results(f"{paper_info} filetype:pdf", num_results=num_results)
+
     search_results = []
     for result in results:
+        if 'link' not in result:
+            # The wrapper returns [{'Result': ...}] when nothing was found
+            continue
         print(f"Result: {result}")
         search_results.append({
             'url': result['link'],
             'title': result.get('title', '').replace(' PDF', '').strip()  # Clean up title
         })
-    
-    return search_results
\ No newline at end of file
+    return search_results
+
+def search_and_get_paper_links(paper_info, google_api_key=None, google_cse_id=None):
+    """Search for papers with Google Custom Search only and return their URLs and titles.
+
+    The crawl uses search_providers.search_papers, which falls back to
+    other providers when this one is slow or out of quota.
+
+    Args:
+        paper_info (str): The paper information to search for
+        google_api_key (str): Google Custom Search API key (default from secrets.toml)
+        google_cse_id (str): Google Custom Search Engine ID (default from secrets.toml)
+
+    Returns:
+        list[dict]: List of dictionaries containing 'url' and 'title' for each result
+    """
+    print(f"Searching for {paper_info}\n***********\n\n\n")
+    google_api_key = google_api_key or st.secrets['GOOGLE_API_KEY']
+    google_cse_id = google_cse_id or st.secrets['GOOGLE_CSE_ID']
+
+    metrics.add('search_calls_total')
+    return get_rate_limiter().call(
+        'google_cse',
+        lambda: google_cse_results(paper_info, google_api_key, google_cse_id)
+    )
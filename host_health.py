@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from rate_limiter import _Transaction
+
+# Health of the hosts the crawl downloads from: success and failure counts,
+# a latency EWMA and consecutive failures per host. It drives a circuit
+# breaker per host (a host that keeps failing is skipped for a cool-down,
+# then gets one trial request) and adaptive timeouts, so a dead or slow host
+# no longer costs the full 120 s timeout on every result that points at it.
+# Like the rate limiter's buckets, the table lives in a small SQLite file,
+# shared by every worker on the machine and kept across restarts.
+
+# Override in the optional [host_health] section of secrets.toml
+DEFAULT_HOST_HEALTH_CONFIG = {
+    'failure_threshold': 3,        # consecutive failures that open a host's breaker
+    'open_seconds': 600,           # first cool-down; doubles each time the trial request fails too
+    'max_open_seconds': 86400,
+    'min_attempts': 10,            # downloads before a host can be skipped for its success rate
+    'min_success_rate': 0.1,
+    'ewma_alpha': 0.3,             # weight of the newest latency in the EWMA
+    'timeout_multiplier': 4,       # read timeout as a multiple of the host's latency EWMA
+    'min_read_timeout': 15,
+    'max_read_timeout': 120,
+    'connect_timeout': 10,
+    'failing_connect_timeout': 3,  # for hosts whose last download failed
+    'path': None,                  # SQLite file (default in the temp directory)
+}
+
+def load_host_health_config() -> dict:
+    """Host health settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_HOST_HEALTH_CONFIG)
+    try:
+        import streamlit as st
+        if 'host_health' in st.secrets:
+            config.update(dict(st.secrets['host_health']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+class HostHealth:
+    """Per-host health table, circuit breakers and timeouts for the crawl.
+
+    A host's breaker opens after `failure_threshold` consecutive failures,
+    or once it has failed nearly every download (`min_success_rate` over at
+    least `min_attempts`). While open the host is skipped; after the
+    cool-down one worker gets a trial request, whose success closes the
+    breaker and whose failure reopens it for twice as long.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = dict(DEFAULT_HOST_HEALTH_CONFIG)
+        self.config.update(config if config is not None else load_host_health_config())
+        self.path = self.config['path'] or os.path.join(tempfile.gettempdir(), 'reference_crawler_hosts.sqlite')
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS hosts '
+                         '(host TEXT PRIMARY KEY, successes INTEGER, failures INTEGER, '
+                         'consecutive_failures INTEGER, latency_ewma REAL, open_until REAL, '
+                         'trips INTEGER, last_error TEXT, updated REAL)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(self._local.conn)
+
+    def _row(self, conn, host: str) -> dict:
+        row = conn.execute('SELECT successes, failures, consecutive_failures, latency_ewma, open_until, trips, '
+                           'last_error FROM hosts WHERE host = ?', (host,)).fetchone()
+        keys = ('successes', 'failures', 'consecutive_failures', 'latency_ewma', 'open_until', 'trips', 'last_error')
+        return dict(zip(keys, row)) if row else dict(zip(keys, (0, 0, 0, None, 0.0, 0, None)))
+
+    def _save(self, conn, host: str, state: dict):
+        conn.execute('INSERT OR REPLACE INTO hosts (host, successes, failures, consecutive_failures, latency_ewma, '
+                     'open_until, trips, last_error, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (host, state['successes'], state['failures'], state['consecutive_failures'],
+                      state['latency_ewma'], state['open_until'], state['trips'], state['last_error'], time.time()))
+
+    def allow(self, url: str) -> bool:
+        """Whether to download from the URL's host now.
+
+        Once an open breaker's cool-down is over, the first caller gets the
+        trial request and the others keep skipping the host until it's done.
+        """
+        host = host_of(url)
+        now = time.time()
+        with self._connection() as conn:
+            state = self._row(conn, host)
+            if not state['trips']:
+                return True
+            if state['open_until'] > now:
+                return False
+            # Half-open: hold the breaker open for everyone else while the trial runs
+            state['open_until'] = now + self._open_seconds(state['trips'])
+            self._save(conn, host, state)
+            return True
+
+    def timeout(self, url: str):
+        """httpx.Timeout for a download from the URL's host"""
+        import httpx
+
+        with self._connection() as conn:
+            state = self._row(conn, host_of(url))
+        read = float(self.config['max_read_timeout'])
+        if state['latency_ewma'] is not None:
+            read = min(max(state['latency_ewma'] * float(self.config['timeout_multiplier']),
+                           float(self.config['min_read_timeout'])), read)
+        connect = float(self.config['failing_connect_timeout'] if state['consecutive_failures']
+                        else self.config['connect_timeout'])
+        return httpx.Timeout(read, connect=connect)
+
+    def record_success(self, url: str, seconds: float):
+        alpha = float(self.config['ewma_alpha'])
+        host = host_of(url)
+        with self._connection() as conn:
+            state = self._row(conn, host)
+            state['successes'] += 1
+            state['consecutive_failures'] = 0
+            state['trips'] = 0
+            state['open_until'] = 0.0
+            previous = state['latency_ewma']
+            state['latency_ewma'] = seconds if previous is None else alpha * seconds + (1 - alpha) * previous
+            self._save(conn, host, state)
+
+    def record_failure(self, url: str, error: str):
+        """Count a failed download (timeout, connection error or server error) and trip the breaker if due"""
+        host = host_of(url)
+        with self._connection() as conn:
+            state = self._row(conn, host)
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            state['last_error'] = str(error)[:500]
+            if self._should_open(state):
+                state['trips'] += 1
+                state['open_until'] = time.time() + self._open_seconds(state['trips'])
+                print(f"Skipping {host} for {self._open_seconds(state['trips']):.0f}s after "
+                      f"{state['consecutive_failures']} failed downloads in a row")
+            self._save(conn, host, state)
+
+    def _should_open(self, state: dict) -> bool:
+        if state['trips']:
+            # The trial request of a half-open breaker failed
+            return True
+        if state['consecutive_failures'] >= int(self.config['failure_threshold']):
+            return True
+        attempts = state['successes'] + state['failures']
+        return (attempts >= int(self.config['min_attempts'])
+                and state['successes'] / attempts < float(self.config['min_success_rate']))
+
+    def _open_seconds(self, trips: int) -> float:
+        return min(float(self.config['open_seconds']) * 2 ** max(trips - 1, 0), float(self.config['max_open_seconds']))
+
+    def hosts(self, limit: int = 100) -> list:
+        """Health of the hosts with the most failures, for display"""
+        with self._connection() as conn:
+            rows = conn.execute('SELECT host FROM hosts ORDER BY failures DESC, successes DESC LIMIT ?',
+                                (limit,)).fetchall()
+            states = [(host, self._row(conn, host)) for (host,) in rows]
+        now = time.time()
+        return [{'host': host, **state,
+                 'success_rate': state['successes'] / max(state['successes'] + state['failures'], 1),
+                 'open_for': max(state['open_until'] - now, 0.0)}
+                for host, state in states]
+
+    def reset(self, host: str = None):
+        """Forget one host's health, or every host's"""
+        with self._connection() as conn:
+            if host:
+                conn.execute('DELETE FROM hosts WHERE host = ?', (host,))
+            else:
+                conn.execute('DELETE FROM hosts')
+
+_host_health = None
+_host_health_lock = threading.Lock()
+
+def get_host_health() -> HostHealth:
+    """Process-wide HostHealth"""
+    global _host_health
+    with _host_health_lock:
+        if _host_health is None:
+            _host_health = HostHealth()
+        return _host_health
+
+def use_host_health(health: HostHealth):
+    """Replace the process-wide HostHealth, e.g. with a fresh table for the benchmark"""
+    global _host_health
+    with _host_health_lock:
+        _host_health = health
@@ -0,0 +1,320 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from typing import List, TYPE_CHECKING
+from pydantic import BaseModel, Field
+from rate_limiter import invoke_llm, ainvoke_llm
+from prompt_budget import build_prompt, build_batch_prompt, output_tokens, batch_output_tokens, model_name, count_tokens
+from pipeline_metrics import metrics
+from controlled_vocabulary import MARKETING_CUES, CUSTOMER_TRAITS, BEHAVIORAL_OUTCOMES
+
+if TYPE_CHECKING:
+    # Only for type hints; LangChain is imported when a stage's parser is first built
+    from langchain_openai import ChatOpenAI
+
+# Every LLM extraction task (qualification and the triplet groups) is an
+# LLMStage declared in STAGES below: its instructions, output schema, prompt
+# budget and, optionally, a model of its own. The engine builds each
+# stage's parser and prompt template once, and puts everything static
+# ahead of the paper text so that requests share a prefix the provider can
+# cache. Parse failures are retried and counted here, and parsed results
+# are cached, for every stage alike.
+#
+# A new triplet group is a new entry with an output_collection; the
+# pipeline, batch jobs, retries and the Processing page pick it up from
+# TRIPLET_GROUPS.
+
+# Requests resent when a response can't be parsed, unless a stage says otherwise
+PARSE_RETRIES = 1
+
+# Parsed results kept per process, by stage, model and prompt
+CACHE_SIZE = 512
+
+# Marks a stage whose parse failures are raised rather than replaced by a default
+RAISE = object()
+
+class _ResultCache:
+    """Thread-safe LRU cache of parsed results"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+_cache = _ResultCache(CACHE_SIZE)
+
+class LLMStage:
+    """An LLM task declared as instructions, an output schema and a prompt budget.
+
+    Args:
+        name (str): Stage name; triplet groups use their pdf_files status field
+        instructions (str): What to do, shown before the format instructions
+        schema (type): Pydantic model the response is parsed into
+        budget (str): Prompt budget task in prompt_budget.py
+        text_heading (str): Line introducing the paper text, after the static part
+        model (str): Model for this stage; by default the model passed in
+        fallback: Result when a response can't be parsed after the retries;
+            RAISE (the default) raises the parse error instead
+        parse_retries (int): Requests resent after an unparseable response
+        output_collection (str): Firestore collection for the rows of a triplet group
+        title (str): Name shown on the Processing page and in messages
+    """
+
+    def __init__(self, name: str, instructions: str, schema, budget: str, text_heading: str = 'Text of the paper:',
+                 model: str = None, fallback=RAISE, parse_retries: int = PARSE_RETRIES,
+                 output_collection: str = None, title: str = None):
+        self.name = name
+        self.instructions = instructions
+        self.schema = schema
+        self.budget = budget
+        self.text_heading = text_heading
+        self.model = model
+        self.fallback = fallback
+        self.parse_retries = parse_retries
+        self.output_collection = output_collection
+        self.title = title or name
+        self._template_tokens = {}
+
+    @cached_property
+    def parser(self):
+        from langchain.output_parsers import PydanticOutputParser
+
+        return PydanticOutputParser(pydantic_object=self.schema)
+
+    @cached_property
+    def template(self) -> str:
+        """Static start of every prompt: instructions, format instructions, text heading"""
+        return f"{self.instructions.strip()}\n\n{self.parser.get_format_instructions()}\n\n{self.text_heading}\n"
+
+    def template_tokens(self, model: str) -> int:
+        if model not in self._template_tokens:
+            self._template_tokens[model] = count_tokens(self.template, model)
+        return self._template_tokens[model]
+
+    def llm_for(self, llm):
+        """The stage's own model if it names one, otherwise llm"""
+        if not self.model or self.model == model_name(llm):
+            return llm
+        from clients import get_chat_model
+
+        return get_chat_model(self.model)
+
+    def prompt(self, text: str, llm) -> str:
+        """Prompt for one paper, with the text cut to the model's context"""
+        return build_prompt(llm, self.budget, self.template, text,
+                            template_tokens=self.template_tokens(model_name(llm)))
+
+    def batch_prompt(self, texts: dict, llm) -> str:
+        """Prompt for several papers, each under a `=== Paper <key> ===` header"""
+        return build_batch_prompt(llm, self.budget, self.template, texts)
+
+    def parse(self, message):
+        """Parse a response (an AIMessage); raises OutputParserException if it doesn't fit the schema"""
+        return self.parser.parse(message.content)
+
+    def result(self, message):
+        """Parse a response, falling back to the stage's default (or raising) if it can't be parsed"""
+        try:
+            return self.parse(message)
+        except Exception as e:
+            return self._give_up(e)
+
+    def _give_up(self, error):
+        metrics.add('llm_parse_failures_total')
+        if self.fallback is RAISE:
+            raise error
+        print(f"Could not parse the {self.name} response, using the default: {error}")
+        return self.fallback
+
+    def _cache_key(self, prompt: str, llm) -> str:
+        return hashlib.sha256(f"{self.name}\0{model_name(llm)}\0{prompt}".encode()).hexdigest()
+
+    def run(self, text: str, llm: 'ChatOpenAI'):
+        """Run the stage on a paper's text and return the parsed result"""
+        llm = self.llm_for(llm)
+        return self._complete(self.prompt(text, llm), llm, output_tokens(llm, self.budget))
+
+    def run_batch(self, texts: dict, llm: 'ChatOpenAI'):
+        """Run the stage on several papers in one request (see batch_prompt)"""
+        llm = self.llm_for(llm)
+        return self._complete(self.batch_prompt(texts, llm), llm, batch_output_tokens(llm, self.budget, len(texts)))
+
+    async def arun(self, text: str, llm: 'ChatOpenAI'):
+        """Async run, so many papers can wait on the LLM at once"""
+        llm = self.llm_for(llm)
+        prompt = self.prompt(text, llm)
+        key = self._cache_key(prompt, llm)
+        cached = _cache.get(key)
+        if cached is not None:
+            metrics.add('llm_cache_hits_total')
+            return cached
+        error = None
+        for attempt in range(self.parse_retries + 1):
+            if attempt:
+                metrics.add('llm_parse_retries_total')
+            message = await ainvoke_llm(llm, prompt, output_tokens(llm, self.budget))
+            try:
+                result = self.parse(message)
+            except Exception as e:
+                error = e
+                continue
+            _cache.put(key, result)
+            return result
+        return self._give_up(error)
+
+    def _complete(self, prompt: str, llm, completion_tokens: int):
+        key = self._cache_key(prompt, llm)
+        cached = _cache.get(key)
+        if cached is not None:
+            metrics.add('llm_cache_hits_total')
+            return cached
+        error = None
+        for attempt in range(self.parse_retries + 1):
+            if attempt:
+                metrics.add('llm_parse_retries_total')
+            message = invoke_llm(llm, prompt, completion_tokens)
+            try:
+                result = self.parse(message)
+            except Exception as e:
+                error = e
+                continue
+            _cache.put(key, result)
+            return result
+        return self._give_up(error)
+
+# Output schemas
+
+class PaperQualification(BaseModel):
+    is_relevant: bool = Field(description="Whether the paper is relevant to consumer behavior and persuasion")
+    topics_found: List[str] = Field(description="List of relevant topics found in the paper")
+    confidence: float = Field(description="Confidence score between 0 and 1")
+    reasoning: str = Field(description="Brief explanation of why the paper is or isn't relevant")
+
+class PaperQualificationResult(PaperQualification):
+    paper_id: str = Field(description="ID of the paper exactly as given in its header, e.g. P1")
+
+class BatchQualification(BaseModel):
+    papers: List[PaperQualificationResult] = Field(description="One qualification for each paper")
+
+class OneTriplet(BaseModel):
+    subject: str = Field(description="Subject of the triplet")
+    predicate: str = Field(description="Predicate of the triplet")
+    object: str = Field(description="Object of the triplet")
+
+class ListTriplets(BaseModel):
+    triplets: List[OneTriplet] = Field(description="List of triplets found in the paper")
+
+class OneTripletB(OneTriplet):
+    frequency: str = Field(description="Frequency of the triplet")
+    context: str = Field(description="Context of the triplet")
+
+class ListTripletsB(BaseModel):
+    triplets: List[OneTripletB] = Field(description="List of triplets found in the paper")
+
+# Stages
+
+QUALIFICATION_INSTRUCTIONS = """Focus on topics like:
+- Consumer decision making
+- Persuasion techniques
+- Marketing influence
+- Social media influence
+- Behavioral economics
+- Consumer psychology
+"""
+
+STAGES = {}
+
+def register(stage: LLMStage) -> LLMStage:
+    STAGES[stage.name] = stage
+    return stage
+
+QUALIFY = register(LLMStage(
+    'qualify',
+    f"""Analyze the following academic paper text and determine if it's relevant to consumer behavior and persuasion.
+{QUALIFICATION_INSTRUCTIONS}""",
+    PaperQualification, 'qualify',
+    # An unparseable answer counts as not relevant
+    fallback=None,
+))
+
+QUALIFY_BATCH = register(LLMStage(
+    'qualify_batch',
+    f"""Analyze each of the following academic papers and determine if it's relevant to consumer behavior and persuasion.
+{QUALIFICATION_INSTRUCTIONS}
+Judge each paper on its own text only, and return one result per paper with its ID.""",
+    BatchQualification, 'qualify',
+    text_heading='Papers:',
+    # qualify_paper_batch splits a batch it can't parse instead
+    parse_retries=0,
+))
+
+register(LLMStage(
+    'triplet_group_a',
+    """From the paragraph below, extract any cause-effect relationships involving marketing cues, psychological traits, and behaviors in teens or young adults. Format each as a triple:
+ Cue → causes/influences → Trait or Behavior [in Teens/Young Adults]
+ For example, if the text says:
+If the paragraph says:
+"Scarcity messages like 'Only 3 left!' have been shown to increase impulsive buying behavior, particularly in adolescents with high fear of missing out (FOMO)."
+
+The triplets would be:
+      "subject": "Scarcity Message",
+      "predicate": "triggers",
+      "object": "FOMO"
+""",
+    ListTriplets, 'triplets',
+    fallback=[],
+    output_collection='triplets_group_a',
+    title='Triplet Group A',
+))
+
+register(LLMStage(
+    'triplet_group_b',
+    f"""
+You are a research assistant helping build a knowledge graph about consumer behavior in teens and young adults.
+Your job is to extract triples from scientific text using the following controlled vocabulary:
+Marketing Cues (Stimuli): {', '.join(MARKETING_CUES)}
+Customer Traits / Susceptibilities: {', '.join(CUSTOMER_TRAITS)}
+Behavioral Outcomes (related to purchases): {', '.join(BEHAVIORAL_OUTCOMES)}
+
+For each valid statement in the text, extract a triple like this:
+ Subject → Predicate → Object [in Teens or Young Adults]
+Use only the vocabulary above. You can repeat the same type of triple if it appears multiple times.
+
+Also output:
+Frequency: How many times the relationship appears in the text
+Context: If available (e.g., mobile app, discount season)
+
+For example, if the text says:
+"Scarcity messages like 'Only 3 left!' have been shown to increase impulsive buying behavior, particularly in adolescents with high fear of missing out (FOMO)."
+
+
+The triplets would be:
+      "subject": "Scarcity Message",
+      "predicate": "triggers",
+      "object": "FOMO"
+      "frequency": "1"
+      "context": "Mobile e-commerce, back-to-school season"
+""",
+    ListTripletsB, 'triplets',
+    fallback=[],
+    output_collection='triplets_group_b',
+    title='Triplet Group B',
+))
+
+# Triplet groups in declaration order; each is also a pdf_files status field
+TRIPLET_GROUPS = [name for name, stage in STAGES.items() if stage.output_collection]
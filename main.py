@@ -1,23 +1,16 @@
 import streamlit as st
 
-import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage
-
-os.environ["LANGCHAIN_TRACING_V2"]="true"
-os.environ["LANGCHAIN_API_KEY"]="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"
-os.environ["LANGSMITH_API_KEY"]="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"
-os.environ["LANGCHAIN_PROJECT"]="ReferenceCrawler"
-os.environ['LANGCHAIN_ENDPOINT']="https://api.smith.langchain.com"
-
-# Initialize Langchain components
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200
-)
-llm = ChatOpenAI(model=st.secrets['OPENAI_API_MODEL'], api_key=st.secrets['OPENAI_API_KEY'])
+from clients import get_chat_model
+from rate_limiter import get_rate_limiter, estimate_tokens
+from prompt_budget import build_prompt, output_tokens
+from pipeline_metrics import record_llm_usage
+
+# LangChain and pypdf are imported where they're first used, so pages that
+# don't call an LLM or parse PDFs don't pay for loading them
+
+def get_llm():
+    """Default LLM for reference extraction, created on first use"""
+    return get_chat_model(st.secrets['OPENAI_API_MODEL'], temperature=None)
 
 class ReferenceResult:
     reference_text : str
@@ -30,35 +23,67 @@ class ReferenceResults:
 
 
 # Core processing functions
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF and return as a single string"""
-    # Load PDF
-    loader = PyPDFLoader(file_path)
-    # Load the document pages
-    pages = loader.load()
-    # Combine all page content
-    text = "\n\n".join(page.page_content for page in pages)
-    return text
-
-def extract_references_from_text(text : str):
-    """Extract references from text using LLM"""
-    if (len(text)>50000):
-        text=text[:50000]
-
-    prompt = f"""
+def extract_text_from_pdf(source):
+    """Extract text from PDF and return as a single string
+
+    Args:
+        source: Path of the PDF, or a binary file object such as a BytesIO
+            (read in place, without a copy on disk)
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(source)
+    # Same text as LangChain's PyPDFLoader: each page stripped, pages separated by a blank line
+    return "\n\n".join(page.extract_text(extraction_mode='plain').strip() for page in reader.pages)
+
+def references_prompt(text: str, llm) -> str:
+    """Reference extraction prompt, also used for offline batch requests (see batch_jobs.py)"""
+    # Long papers are cut to the model's context, keeping the reference list
+    return build_prompt(llm, 'references', """
     Extract all academic references from the following text. 
     Format each reference as a separate item in a list with the following fields: reference_text, authors, title, year.   
     If no references are found, return an empty list.
     Please double-check your work and ensure that every single reference is correctly extracted.
     Call the list "references"
-    \n\nText:\n {text}
-    """
+    \n\nText:\n """, text, """
+    """)
+
+def references_response_format() -> dict:
+    """The OpenAI response_format that with_structured_output(ReferenceResults) requests"""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    function = convert_to_openai_tool(ReferenceResults)['function']
+    return {'type': 'json_schema', 'json_schema': {
+        'name': function['name'],
+        'description': function.get('description', ''),
+        'strict': False,
+        'schema': function['parameters'],
+    }}
+
+def parse_references(content: str) -> list:
+    """References in a structured output response, parsed as with_structured_output does"""
+    from langchain_core.output_parsers import JsonOutputParser
+
+    return JsonOutputParser().parse(content)['references']
+
+def extract_references_from_text(text : str, llm=None):
+    """Extract references from text using LLM (the default one unless given)"""
+    from langchain_core.messages import SystemMessage
+
+    llm = llm or get_llm()
+    prompt = references_prompt(text, llm)
 
-    response=llm.with_structured_output(ReferenceResults).invoke(
-        [SystemMessage(content=prompt)]
+    response=get_rate_limiter().call(
+        'openai',
+        lambda: llm.with_structured_output(ReferenceResults, include_raw=True).invoke([SystemMessage(content=prompt)]),
+        tokens=estimate_tokens(prompt) + output_tokens(llm, 'references')
     )
-    print(f"Response: {response}")
-    return response['references']
+    # include_raw keeps the AIMessage so token usage can be recorded
+    record_llm_usage(response['raw'])
+    if response['parsing_error'] is not None:
+        raise response['parsing_error']
+    print(f"Response: {response['parsed']}")
+    return response['parsed']['references']
 
 # Function to search and download papers
 def search_and_download(query,api_key):
@@ -0,0 +1,231 @@
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from firebase_admin import firestore
+
+# Near-duplicate detection for extracted papers. Each paper gets a MinHash
+# signature over its word 5-grams; an LSH index in Firestore (a document per
+# band value, with one small document per paper in its `papers`
+# subcollection) finds papers sharing a band, and those whose estimated
+# Jaccard similarity reaches the threshold are treated as copies.
+
+# Signature layout; changing these invalidates stored signatures and the index
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+
+# Override in the optional [near_duplicates] section of secrets.toml. With
+# 32 bands of 4 rows, papers above about 0.5 similarity are almost always
+# compared, so thresholds from 0.5 up are reliable.
+DEFAULT_NEAR_DUPLICATE_CONFIG = {
+    'enabled': True,
+    'threshold': 0.8,
+}
+
+INDEX_COLLECTION = 'near_duplicate_bands'
+MEMBERS_COLLECTION = 'papers'
+
+# Papers read per band in a lookup. Bands that very many papers share
+# (boilerplate such as a licence notice) are cut off here; a real copy
+# shares most of its bands, so it is still found through the others.
+MAX_BAND_MEMBERS = 100
+
+# Concurrent band reads per lookup
+BAND_READ_WORKERS = 8
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+def load_near_duplicate_config() -> dict:
+    """Near-duplicate settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_NEAR_DUPLICATE_CONFIG)
+    try:
+        import streamlit as st
+        if 'near_duplicates' in st.secrets:
+            config.update(dict(st.secrets['near_duplicates']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def shingles(text: str) -> set:
+    """Hashed word 5-grams of the text, ignoring case, punctuation and layout"""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return set()
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(' '.join(words).encode())}
+    return {zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode())
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def minhash(text: str) -> list:
+    """MinHash signature (NUM_PERM values) of the text, or [] if it has no words"""
+    hashes = np.fromiter(shingles(text), dtype=np.uint64)
+    if not len(hashes):
+        return []
+    # Arithmetic wraps around at 64 bits, which still gives independent hashes
+    with np.errstate(over='ignore'):
+        permuted = ((np.outer(_A, hashes) + _B[:, None]) % _MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=1).tolist()
+
+def similarity(signature: list, other: list) -> float:
+    """Estimated Jaccard similarity of two papers' shingles"""
+    if len(signature) != NUM_PERM or len(other) != NUM_PERM:
+        return 0.0
+    return float(np.mean(np.array(signature) == np.array(other)))
+
+def band_keys(signature: list) -> list:
+    """LSH index document IDs for a signature, one per band"""
+    return [f"{band}-{zlib.crc32(str(signature[band * ROWS:(band + 1) * ROWS]).encode()):08x}"
+            for band in range(BANDS)]
+
+def _band_members(db, key: str):
+    return db.collection(INDEX_COLLECTION).document(key).collection(MEMBERS_COLLECTION)
+
+def find_near_duplicate(db, doc_id: str, signature: list, threshold: float):
+    """The canonical copy of the most similar indexed paper.
+
+    Args:
+        db: Firestore client
+        doc_id (str): The paper being checked (never matches itself)
+        signature (list): Its MinHash signature
+        threshold (float): Lowest estimated Jaccard similarity that counts
+
+    Returns:
+        tuple: (canonical paper ID, similarity), or (None, 0.0) if there is none
+    """
+    if not signature:
+        return None, 0.0
+
+    def members(key):
+        return [doc.id for doc in _band_members(db, key).limit(MAX_BAND_MEMBERS).stream()]
+
+    candidates = set()
+    with ThreadPoolExecutor(max_workers=BAND_READ_WORKERS) as pool:
+        for paper_ids in pool.map(members, band_keys(signature)):
+            candidates.update(paper_ids)
+    candidates.discard(doc_id)
+    if not candidates:
+        return None, 0.0
+
+    best, best_similarity = None, 0.0
+    for snapshot in db.get_all([db.collection('pdf_files').document(paper_id) for paper_id in sorted(candidates)]):
+        if not snapshot.exists:
+            continue
+        data = snapshot.to_dict()
+        score = similarity(signature, data.get('minhash', []))
+        if score >= threshold and score > best_similarity:
+            # A match that is itself a copy points at its canonical paper
+            best, best_similarity = data.get('duplicate_of') or snapshot.id, score
+    return best, best_similarity
+
+def index_paper(db, doc_id: str, signature: list):
+    """Add a paper to the LSH index, one fixed-size document per band"""
+    if not signature:
+        return
+    batch = db.batch()
+    for key in band_keys(signature):
+        batch.set(_band_members(db, key).document(doc_id), {'created_timestamp': firestore.SERVER_TIMESTAMP})
+    batch.commit()
+
+def move_legacy_bands(db, progress=None) -> dict:
+    """Move band membership stored as `paper_ids` arrays into the bands' papers subcollections.
+
+    The index used to keep every paper of a band in an array on the band
+    document, which grows without bound toward Firestore's 1 MB document
+    limit. Each band is moved in batches of up to 400 papers, the last of
+    which also deletes the array; an interrupted run can be started again.
+
+    Args:
+        db: Firestore client
+        progress (callable): Called as progress(bands, papers) after each band
+
+    Returns:
+        dict: 'bands' and 'papers' moved
+    """
+    totals = {'bands': 0, 'papers': 0}
+    for band in db.collection(INDEX_COLLECTION).stream():
+        paper_ids = band.to_dict().get('paper_ids')
+        if paper_ids is None:
+            continue
+        for start in range(0, max(len(paper_ids), 1), 400):
+            batch = db.batch()
+            for paper_id in paper_ids[start:start + 400]:
+                batch.set(_band_members(db, band.id).document(paper_id),
+                          {'created_timestamp': firestore.SERVER_TIMESTAMP})
+            if start + 400 >= len(paper_ids):
+                batch.update(band.reference, {'paper_ids': firestore.DELETE_FIELD})
+            batch.commit()
+        totals['bands'] += 1
+        totals['papers'] += len(paper_ids)
+        if progress is not None:
+            progress(totals['bands'], totals['papers'])
+    return totals
+
+def check_near_duplicate(db, doc_id: str, text: str, config: dict = None) -> dict:
+    """Sign an extracted paper, look it up in the index and add it.
+
+    Args:
+        db: Firestore client
+        doc_id (str): pdf_files document ID
+        text (str): Extracted text
+        config (dict): Settings (default from secrets.toml)
+
+    Returns:
+        dict: Fields for the pdf_files record: 'minhash', plus 'duplicate_of'
+            and 'duplicate_similarity' when the paper is a near-duplicate
+    """
+    config = config or load_near_duplicate_config()
+    if not config['enabled']:
+        return {}
+    signature = minhash(text)
+    updates = {'minhash': signature}
+    canonical, score = find_near_duplicate(db, doc_id, signature, float(config['threshold']))
+    if canonical:
+        updates.update(duplicate_of=canonical, duplicate_similarity=score)
+    # Copies are indexed too, so a third version closer to the copy still finds the canonical paper
+    index_paper(db, doc_id, signature)
+    return updates
+
+def index_existing_papers(db, config: dict = None, progress=None) -> dict:
+    """Sign and index extracted papers that predate near-duplicate detection.
+
+    Papers already past text extraction keep their status; copies found
+    among them only get duplicate_of, for review on the Edit page.
+
+    Args:
+        db: Firestore client
+        config (dict): Settings (default from secrets.toml)
+        progress: Optional callable(indexed, duplicates) called after each paper
+
+    Returns:
+        dict: 'indexed' and 'duplicates' counts
+    """
+    from firebase_utils import download_text_from_storage
+
+    config = config or load_near_duplicate_config()
+    totals = {'indexed': 0, 'duplicates': 0}
+    query = db.collection('pdf_files').where('status', 'in', ['TextExtracted', 'TextProcessed'])
+    for doc in query.stream():
+        data = doc.to_dict()
+        if data.get('minhash'):
+            continue
+        try:
+            updates = check_near_duplicate(db, doc.id, download_text_from_storage(data['file_id']),
+                                           {**config, 'enabled': True})
+        except Exception as e:
+            print(f"Could not index {doc.id}: {e}")
+            continue
+        doc.reference.update(updates)
+        totals['indexed'] += 1
+        totals['duplicates'] += int('duplicate_of' in updates)
+        if progress:
+            progress(totals['indexed'], totals['duplicates'])
+    return totals
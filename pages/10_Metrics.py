@@ -0,0 +1,101 @@
+import streamlit as st
+import pandas as pd
+import json
+import time
+from datetime import datetime
+from pipeline_metrics import metrics, maybe_start_metrics_server
+from host_health import get_host_health
+
+st.set_page_config(
+    page_title="Pipeline Metrics",
+    page_icon="⏱️",
+    layout="wide"
+)
+
+st.title('⏱️ Pipeline Metrics')
+
+maybe_start_metrics_server()
+
+st.markdown(f"""
+Per-stage metrics for this server process since
+{datetime.fromtimestamp(metrics.started).strftime('%Y-%m-%d %H:%M:%S')}.
+Latency percentiles and throughput cover the last {metrics.window_seconds // 60} minutes.
+""")
+if 'METRICS_PORT' in st.secrets:
+    st.caption(f"Prometheus endpoint: `:{st.secrets['METRICS_PORT']}/metrics` (JSON at `/metrics.json`)")
+
+snapshot = metrics.snapshot()
+if not snapshot['stages']:
+    st.info('No pipeline activity recorded yet. Run a stage on the Processing page.')
+    st.stop()
+
+def fmt_seconds(value):
+    return f"{value:.2f}s" if value is not None else '-'
+
+# Per-stage summary table
+rows = []
+for stage, values in sorted(snapshot['stages'].items()):
+    latency = values['latency_seconds']
+    rows.append({
+        'Stage': stage,
+        'Documents': int(values.get('documents_total', 0)),
+        'Errors': int(values.get('errors_total', 0)),
+        'Docs/min (5m)': round(values['documents_per_minute_5m'], 2),
+        'p50': fmt_seconds(latency['p50']),
+        'p95': fmt_seconds(latency['p95']),
+        'p99': fmt_seconds(latency['p99']),
+        'LLM Requests': int(values.get('llm_requests_total', 0)),
+        'Prompt Tokens': int(values.get('llm_prompt_tokens_total', 0)),
+        'Completion Tokens': int(values.get('llm_completion_tokens_total', 0)),
+        'Search Calls': int(values.get('search_calls_total', 0)),
+        'MB Downloaded': round(values.get('bytes_downloaded_total', 0) / 1e6, 2),
+        'MB Uploaded': round(values.get('bytes_uploaded_total', 0) / 1e6, 2),
+    })
+st.subheader('Stages')
+st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+# Rolling throughput and latency per minute
+documents = metrics.recent_documents()
+if documents:
+    df = pd.DataFrame(documents, columns=['timestamp', 'stage', 'seconds', 'ok'])
+    df['minute'] = pd.to_datetime(df['timestamp'], unit='s').dt.floor('min')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader('Throughput (documents/minute)')
+        throughput = df.pivot_table(index='minute', columns='stage', values='seconds', aggfunc='count', fill_value=0)
+        st.line_chart(throughput)
+    with col2:
+        st.subheader('p95 Latency (seconds)')
+        latency = df.pivot_table(index='minute', columns='stage', values='seconds', aggfunc=lambda s: s.quantile(0.95))
+        st.line_chart(latency)
+
+# Hosts the crawl downloads from, shared by the workers on this machine
+hosts = get_host_health().hosts()
+if hosts:
+    st.subheader('Crawl Hosts')
+    st.dataframe(pd.DataFrame([{
+        'Host': host['host'],
+        'Downloads': host['successes'] + host['failures'],
+        'Success Rate': f"{host['success_rate']:.0%}",
+        'Failures in a Row': host['consecutive_failures'],
+        'Latency EWMA': fmt_seconds(host['latency_ewma']),
+        'Skipped For': fmt_seconds(host['open_for']) if host['open_for'] else '-',
+        'Last Error': host['last_error'] or '',
+    } for host in hosts]), use_container_width=True, hide_index=True)
+    if st.button('Reset Host Health'):
+        get_host_health().reset()
+        st.rerun()
+
+# Exports
+col1, col2, col3 = st.columns(3)
+timestamp = time.strftime('%Y%m%d_%H%M%S')
+with col1:
+    st.download_button('Download Prometheus Text', data=metrics.prometheus_text(),
+                       file_name=f'metrics_{timestamp}.prom', mime='text/plain')
+with col2:
+    st.download_button('Download JSON', data=json.dumps(snapshot, indent=2),
+                       file_name=f'metrics_{timestamp}.json', mime='application/json')
+with col3:
+    if st.button("🔄 Refresh Data"):
+        st.rerun()
@@ -1,20 +1,15 @@
 import streamlit as st
-import tempfile
-import requests
-import hashlib
-import datetime
-from firebase_utils import (
-    db, download_pdf_from_storage, update_pdf_record,
-    upload_txt_to_storage, download_txt_from_storage,
-    upload_pdf_to_storage, download_text_from_storage
+from firebase_utils import get_db
+from clients import get_chat_model
+from crawl_frontier import CrawlFrontier, load_crawl_config
+from work_leases import new_worker_id
+from retry_queue import requeue_due, requeue_dead_letters, RETRY_STAGES
+from pipeline_metrics import maybe_start_metrics_server
+from llm_stages import STAGES, TRIPLET_GROUPS
+from pipeline_stages import (
+    extract_text, qualify_papers, process_references,
+    crawl_references, generate_triplets
 )
-from firebase_admin import firestore
-from main import extract_text_from_pdf, extract_references_from_text
-from google_search_api import search_and_get_paper_links
-from qualify_paper import qualify_paper
-from langchain_openai import ChatOpenAI
-from generate_triplet_group_a import generate_triplet_group_a
-from generate_triplet_group_b import generate_triplet_group_b
 
 st.set_page_config(
     page_title="Process Papers",
@@ -30,6 +25,28 @@ This page handles the processing pipeline for your uploaded papers:
 3. Reference Crawling - Search and download referenced papers
 """)
 
+maybe_start_metrics_server()
+
+# Each browser session is a separate worker; claimed documents are leased to it
+worker_id = st.session_state.setdefault('worker_id', new_worker_id())
+
+# Crawl frontier settings and per-depth budget usage
+crawl_config = load_crawl_config()
+with st.expander('Crawl Frontier'):
+    crawl_config['max_depth'] = st.number_input('Maximum crawl depth', min_value=1,
+                                                value=int(crawl_config['max_depth']), step=1, key='max_depth')
+    frontier = CrawlFrontier(get_db(), crawl_config)
+    st.caption('Work is scheduled breadth-first by depth. Budgets are per depth; 0 means unlimited.')
+    st.table([
+        {
+            'Depth': depth,
+            'Papers': f"{usage['papers']} / {crawl_config['papers_per_depth'] or '∞'}",
+            'Search Queries': f"{usage['search_queries']} / {crawl_config['search_queries_per_depth'] or '∞'}",
+            'LLM Tokens': f"{usage['llm_tokens']} / {crawl_config['llm_tokens_per_depth'] or '∞'}",
+        }
+        for depth, usage in ((d, frontier.usage(d)) for d in range(1, frontier.max_depth + 1))
+    ])
+
 st.divider()
 # Text Extraction Section
 col1, col2 = st.columns([1, 1])
@@ -38,39 +55,7 @@ with col1:
 with col2:
     if st.button('Extract Text from PDFs'):
         with st.spinner('Extracting text from PDFs...'):
-            # Fetch initial records
-            docs = db.collection('pdf_files').where('status', '==', 'Initial').limit(extract_limit).stream()
-            processed = 0
-        for doc in docs:
-            try:
-                file_data = doc.to_dict()
-                # Download PDF from Firebase Storage
-                with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                    download_pdf_from_storage(file_data['file_id'], temp_file)
-                    # Extract text from PDF
-                    text_content = extract_text_from_pdf(temp_file.name)
-                    # Save extracted text to Firebase Storage
-                    txt_url = upload_txt_to_storage(text_content, file_data['file_id'])
-                    # Update Firestore record
-                    update_pdf_record(doc.id, {
-                        'status': 'TextExtracted',
-                        'txt_file_location': txt_url,
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-                    processed += 1
-            except Exception as e:
-                st.error(f"Error processing {file_data.get('file_id', 'unknown file')}: {str(e)}")
-                # Update status to failed
-                update_pdf_record(doc.id, {
-                    'status': 'FailedProcessing',
-                    'error_message': str(e),
-                    'updated_timestamp': firestore.SERVER_TIMESTAMP
-                })
-                continue
-        if processed > 0:
-            st.success(f'Extracted text from {processed} PDF(s) successfully.')
-        else:
-            st.info('No new PDFs to process.')
+            extract_text(extract_limit, worker_id, ui=st)
 
 # Qualify Papers Section
 st.divider()
@@ -81,63 +66,8 @@ with col1:
 with col2:
     qualify_button = st.button('Qualify Papers')
     if qualify_button:
-        # Get papers that haven't been qualified yet
-        # Create a query for papers with either TextExtracted or TextProcessed status
-        # and no qualified field or qualified=None
-        papers = []
-        query = db.collection('pdf_files')
-        query = query.where('status', 'in', ['TextExtracted', 'TextProcessed'])
-        query = query.limit(qualify_limit)
-        
-        for doc in query.stream():
-            doc_data = doc.to_dict()
-            # Include if qualified field is missing or None
-            if 'qualified' not in doc_data or doc_data['qualified'] is None:
-                papers.append(doc)
-        
-        st.write(f"Found {len(papers)} unqualified papers")
-        
-        if papers:
-            llm = ChatOpenAI(
-                openai_api_key=st.secrets['OPENAI_API_KEY'],
-                model_name='gpt-4-turbo-preview',
-                temperature=0
-            )
-            
-            processed = 0
-            progress_bar = st.progress(0)
-            
-            for i, doc in enumerate(papers):
-                doc_data = doc.to_dict()
-                st.write(f"Qualifying paper: {doc_data.get('title', doc_data['file_id'])}")
-                
-                try:
-                    # Get the extracted text from Firebase Storage
-                    text_content = download_text_from_storage(doc_data['file_id'])
-                    
-                    # Qualify the paper
-                    is_qualified = qualify_paper(text_content, llm)
-                    
-                    # Update the paper's qualification status
-                    update_pdf_record(doc.id, {
-                        'qualified': is_qualified,
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-                    processed += 1
-                except Exception as e:
-                    st.error(f"Error qualifying paper {doc_data['file_id']}: {str(e)}")
-                    # Update status to failed
-                    update_pdf_record(doc.id, {
-                        'status': 'FailedProcessing',
-                        'error_message': str(e),
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-                finally:
-                    progress_bar.progress((i + 1) / len(papers))
-            
-            st.success(f'Qualified {processed} paper(s).')
-        else:
-            st.info('No papers ready for qualification.')
+        llm = get_chat_model('gpt-4-turbo-preview')
+        qualify_papers(qualify_limit, worker_id, llm, frontier, ui=st)
 
 # Process References Section
 st.divider()
@@ -148,65 +78,7 @@ with col1:
 with col2:
     if st.button('Process References'):
         with st.spinner('Processing references...'):
-            # Get qualified documents ready for processing
-            query = db.collection('pdf_files')
-            query = query.where('status', '==', 'TextExtracted')
-            query = query.where('qualified', '==', True)  # Only process qualified papers
-            query = query.limit(process_limit)
-            papers = list(query.stream())
-            processed = 0
-        for doc in papers:
-            try:
-                file_data = doc.to_dict()
-                # Download text content
-                text_content = ""
-                with tempfile.NamedTemporaryFile(delete=False, mode='w+') as temp_file:
-                    download_txt_from_storage(file_data['file_id'], temp_file)
-                    temp_file.seek(0)  # Go back to start of file
-                    text_content = temp_file.read()
-                
-                # Extract references from text
-                references = extract_references_from_text(text_content)
-                
-                # Save references to Firestore
-                ref_batch = db.batch()
-                for ref in references:
-                    print(f"Reference: {ref}")
-                    ref_doc = db.collection('references').document()
-                    ref_batch.set(ref_doc, {
-                        'full_reference_text': ref['reference_text'],
-                        'authors': ref['authors'],
-                        'title': ref['title'],
-                        'year': ref['year'],
-                        'source_file': file_data['file_id'],
-                        'status': 'NewReference',
-                        'depth': file_data.get('depth', 0) + 1,  # Increment depth from source paper
-                        'created_timestamp': firestore.SERVER_TIMESTAMP,
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-                ref_batch.commit()
-                
-                # Update file status
-                update_pdf_record(doc.id, {
-                    'status': 'TextProcessed',
-                    'reference_count': len(references),
-                    'updated_timestamp': firestore.SERVER_TIMESTAMP
-                })
-                processed += 1
-            except Exception as e:
-                st.error(f"Error processing references for {file_data.get('file_id', 'unknown file')}: {str(e)}")
-                # Update status to failed
-                update_pdf_record(doc.id, {
-                    'status': 'FailedProcessing',
-                    'error_message': str(e),
-                    'updated_timestamp': firestore.SERVER_TIMESTAMP
-                })
-                continue
-            
-        if processed > 0:
-            st.success(f'Processed references from {processed} document(s).')
-        else:
-            st.info('No documents ready for reference processing.')
+            process_references(process_limit, worker_id, frontier, ui=st)
 
 # Crawl References Section
 st.divider()
@@ -216,260 +88,40 @@ with col1:
 with col2:
     if st.button('Crawl References'):
         with st.spinner('Crawling references...'):
-            # Fetch NewReference records
-            docs = db.collection('references').where('status', '==', 'NewReference').limit(crawl_limit).stream()
-            processed = 0
-        for doc in docs:
-            try:
-                reference_data = doc.to_dict()
-                # Search for papers
-                search_results = search_and_get_paper_links(reference_data['full_reference_text'], st.secrets['GOOGLE_API_KEY'], st.secrets['GOOGLE_CSE_ID'])
-                
-                downloaded_files = []
-            except Exception as e:
-                st.error(f"Error searching for reference {doc.id}: {str(e)}")
-                # Update status to failed
-                db.collection('references').document(doc.id).update({
-                    'status': 'FailedProcessing',
-                    'error_message': str(e),
-                    'updated_timestamp': firestore.SERVER_TIMESTAMP
-                })
-                continue
-            for result in search_results:
-                url = result['url']
-                title = result['title']
-                
-                # Check if URL was already processed
-                existing_docs = db.collection('pdf_files').where('source_url', '==', url).limit(1).stream()
-                if any(existing_docs):
-                    st.info(f'PDF from {url} already exists in database, skipping...')
-                    continue
-                
-                try:
-                    # Download and save PDF with timeout
-                    with st.spinner(f'Downloading PDF from {url}...'):
-                        response = requests.get(url, timeout=120)  # 120 seconds timeout
-                        if response.status_code == 200 and response.headers.get('content-type', '').lower() == 'application/pdf':
-                            # Generate file ID from URL
-                            file_id = f"{hashlib.md5(url.encode()).hexdigest()}.pdf"
-                            
-                            # Save to Firebase Storage
-                            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                                temp_file.write(response.content)
-                                temp_file.seek(0)
-                                upload_pdf_to_storage(temp_file, file_id)
-                            
-                            # Add record to Firestore with source URL and title
-                            doc_ref = db.collection('pdf_files').add({
-                                'file_id': file_id,
-                                'title': title,  # Add title from search results
-                                'status': 'Initial',
-                                'depth': reference_data.get('depth', 0) + 1,  # Use depth from reference
-                                'source_url': url,
-                                'source_reference': doc.id,  # Reference to the source reference document
-                                'created_timestamp': firestore.SERVER_TIMESTAMP,
-                                'updated_timestamp': firestore.SERVER_TIMESTAMP
-                            })
-                            
-                            downloaded_files.append(file_id)
-                            st.success(f'Successfully downloaded and saved PDF: {file_id}')
-                except requests.Timeout:
-                    st.error(f'Timeout downloading PDF from {url} after 120 seconds')
-                    # Update reference record with timeout error
-                    error_time = datetime.datetime.now().isoformat()
-                    db.collection('references').document(doc.id).update({
-                        'failed_downloads': firestore.ArrayUnion([{
-                            'url': url,
-                            'error': 'Download timeout after 120 seconds',
-                            'timestamp': error_time
-                        }]),
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-                    continue
-                except Exception as e:
-                    st.error(f'Error downloading PDF from {url}: {str(e)}')
-                    # Update reference record with error
-                    error_time = datetime.datetime.now().isoformat()
-                    db.collection('references').document(doc.id).update({
-                        'failed_downloads': firestore.ArrayUnion([{
-                            'url': url,
-                            'error': str(e),
-                            'timestamp': error_time
-                        }]),
-                        'updated_timestamp': firestore.SERVER_TIMESTAMP
-                    })
-            
-            # Update reference record
-            db.collection('references').document(doc.id).update({
-                'status': 'ProcessedReference',
-                'search_results': search_results,
-                'downloaded_files': downloaded_files,
-                'updated_timestamp': firestore.SERVER_TIMESTAMP
-            })
-            processed += 1
-        if processed > 0:
-            st.success(f'Crawled {processed} reference(s).')
-        else:
-            st.info('No new references to crawl.')
-
-st.divider()
-
-# Triplet Group A Processing Section
-st.divider()
-col1, col2 = st.columns([1, 1])
-with col1:
-    triplet_limit = st.number_input('Number of files to process', min_value=1, value=1, step=1, key='triplet_limit')
-with col2:
-    if st.button('Triplet Group A'):
-        with st.spinner('Processing triplets...'):
-            # Get qualified papers marked for triplet processing
-            query = db.collection('pdf_files')
-            query = query.where('triplet_group_a', '==', 'ToProcess')
-            query = query.where('qualified', '==', True)
-            query = query.limit(triplet_limit)
-            papers = list(query.stream())
-            processed = 0
-
-            if papers:
-                llm = ChatOpenAI(
-                    openai_api_key=st.secrets['OPENAI_API_KEY'],
-                    model_name=st.secrets['OPENAI_API_MODEL'],
-                    temperature=0
-                )
-
-                for doc in papers:
-                    try:
-                        file_data = doc.to_dict()
-                        st.write(f"Processing triplets for: {file_data.get('title', file_data['file_id'])}")
-                        
-                        # Get the text content
-                        text_content = download_text_from_storage(file_data['file_id'])
-                        
-                        # Generate triplets
-                        triplets = generate_triplet_group_b(text_content, llm)
-                        
-                        # Only proceed if we found triplets
-                        if triplets and triplets.triplets:
-                            # Store each triplet as a separate row
-                            for triplet in triplets.triplets:
-                                db.collection('triplets_group_b').add({
-                                    'pdf_id': doc.id,
-                                    'file_id': file_data['file_id'],
-                                    'title': file_data.get('title', ''),
-                                    'subject': triplet.subject,
-                                    'predicate': triplet.predicate,
-                                    'object': triplet.object,
-                                    'created_timestamp': firestore.SERVER_TIMESTAMP
-                                })
-                            
-                            # Update the original document
-                            update_pdf_record(doc.id, {
-                                'triplet_group_b': 'Processed',
-                                'triplet_count': len(triplets.triplets),
-                                'updated_timestamp': firestore.SERVER_TIMESTAMP
-                            })
-                            
-                            processed += 1
-                        else:
-                            # No triplets found, mark as processed but empty
-                            update_pdf_record(doc.id, {
-                                'triplet_group_b': 'ProcessedEmpty',
-                                'triplet_count': 0,
-                                'updated_timestamp': firestore.SERVER_TIMESTAMP
-                            })
-                        
-                    except Exception as e:
-                        st.error(f"Error processing triplets for {file_data.get('file_id', 'unknown file')}: {str(e)}")
-                        update_pdf_record(doc.id, {
-                            'triplet_group_b': 'Failed',
-                            'triplet_error': str(e),
-                            'updated_timestamp': firestore.SERVER_TIMESTAMP
-                        })
-                        continue
-
-                if processed > 0:
-                    st.success(f'Generated triplets for {processed} document(s).')
-            else:
-                st.info('No qualified documents marked for triplet processing. Documents must be both qualified and have triplet_group_a="ToProcess".')
+            crawl_references(crawl_limit, worker_id, frontier, ui=st)
 
 st.divider()
 
-# Triplet Group B Processing Section
+# One section per triplet group declared in llm_stages.py
+for group in TRIPLET_GROUPS:
+    st.divider()
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        triplet_limit = st.number_input('Number of files to process', min_value=1, value=1, step=1,
+                                        key=f'{group}_limit')
+    with col2:
+        if st.button(STAGES[group].title, key=f'{group}_run'):
+            with st.spinner('Processing triplets...'):
+                llm = get_chat_model(st.secrets['OPENAI_API_MODEL'])
+                generate_triplets(group, triplet_limit, worker_id, llm, ui=st)
+
+# Retry Section
 st.divider()
+st.subheader('Retry Failed Documents')
+st.markdown("""
+Failed documents are retried automatically with exponential backoff: transient errors (timeouts,
+rate limits, server errors) are scheduled for another attempt, which each stage picks up the next time
+it runs once the backoff has passed, while permanent errors (unparseable input) and documents that keep
+failing are moved to **DeadLetter**. **Requeue Due Retries** requeues every stage's due retries at once.
+""")
 col1, col2 = st.columns([1, 1])
 with col1:
-    triplet_limit_b = st.number_input('Number of files to process', min_value=1, value=1, step=1, key='triplet_limit_b')
+    if st.button('Requeue Due Retries'):
+        requeued = {stage: requeue_due(get_db(), stage) for stage in RETRY_STAGES}
+        st.success(f"Requeued {sum(requeued.values())} document(s): " +
+                   ', '.join(f"{stage} {count}" for stage, count in requeued.items() if count))
 with col2:
-    if st.button('Triplet Group B'):
-        with st.spinner('Processing triplets...'):
-            # Get qualified papers marked for triplet processing
-            query = db.collection('pdf_files')
-            query = query.where('triplet_group_b', '==', 'ToProcess')
-            query = query.where('qualified', '==', True)
-            query = query.limit(triplet_limit_b)
-            papers = list(query.stream())
-            processed = 0
-
-            if papers:
-                llm = ChatOpenAI(
-                    openai_api_key=st.secrets['OPENAI_API_KEY'],
-                    model_name=st.secrets['OPENAI_API_MODEL'],
-                    temperature=0
-                )
-
-                for doc in papers:
-                    try:
-                        file_data = doc.to_dict()
-                        st.write(f"Processing triplets for: {file_data.get('title', file_data['file_id'])}")
-                        
-                        # Get the text content
-                        text_content = download_text_from_storage(file_data['file_id'])
-                        
-                        # Generate triplets
-                        triplets = generate_triplet_group_b(text_content, llm)
-                        
-                        # Only proceed if we found triplets
-                        if triplets and triplets.triplets:
-                            # Store each triplet as a separate row
-                            for triplet in triplets.triplets:
-                                db.collection('triplets_group_b').add({
-                                    'pdf_id': doc.id,
-                                    'file_id': file_data['file_id'],
-                                    'title': file_data.get('title', ''),
-                                    'subject': triplet.subject,
-                                    'predicate': triplet.predicate,
-                                    'object': triplet.object,
-                                    'frequency': triplet.frequency,
-                                    'context': triplet.context,
-                                    'created_timestamp': firestore.SERVER_TIMESTAMP
-                                })
-                            
-                            # Update the original document
-                            update_pdf_record(doc.id, {
-                                'triplet_group_b': 'Processed',
-                                'triplet_count': len(triplets.triplets),
-                                'updated_timestamp': firestore.SERVER_TIMESTAMP
-                            })
-                            
-                            processed += 1
-                        else:
-                            # No triplets found, mark as processed but empty
-                            update_pdf_record(doc.id, {
-                                'triplet_group_b': 'ProcessedEmpty',
-                                'triplet_count': 0,
-                                'updated_timestamp': firestore.SERVER_TIMESTAMP
-                            })
-                        
-                    except Exception as e:
-                        st.error(f"Error processing triplets group B for {file_data.get('file_id', 'unknown file')}: {str(e)}")
-                        update_pdf_record(doc.id, {
-                            'triplet_group_b': 'Failed',
-                            'triplet_error': str(e),
-                            'updated_timestamp': firestore.SERVER_TIMESTAMP
-                        })
-                        continue
-
-                if processed > 0:
-                    st.success(f'Generated triplets for {processed} document(s).')
-            else:
-                st.info('No qualified documents marked for triplet processing. Documents must be both qualified and have triplet_group_a="ToProcess".')
+    dead_letter_stage = st.selectbox('Dead-letter stage', options=list(RETRY_STAGES))
+    if st.button('Requeue Dead Letters'):
+        requeued = requeue_dead_letters(get_db(), dead_letter_stage)
+        st.success(f"Requeued {requeued} dead-lettered document(s) for {dead_letter_stage}")
@@ -1,5 +1,5 @@
 import streamlit as st
-from firebase_utils import db
+from firebase_utils import get_db
 
 st.set_page_config(
     page_title="Statistics",
@@ -9,6 +9,7 @@ st.set_page_config(
 st.title('📊 System Statistics')
 
 # Get all files and references
+db = get_db()
 files = list(db.collection('pdf_files').stream())
 references = list(db.collection('references').stream())
 
@@ -17,8 +18,8 @@ total_files = len(files)
 files_by_state = {}
 files_by_qualification = {'Qualified': 0, 'Not Qualified': 0, 'To Process': 0}
 files_by_depth = {}
-files_by_triplet_a = {'ToProcess': 0, 'Processed': 0, 'ProcessedEmpty': 0, 'Failed': 0, 'Not Started': 0}
-files_by_triplet_b = {'ToProcess': 0, 'Processed': 0, 'ProcessedEmpty': 0, 'Failed': 0, 'Not Started': 0}
+files_by_triplet_a = {'ToProcess': 0, 'Processed': 0, 'ProcessedEmpty': 0, 'Failed': 0, 'DeadLetter': 0, 'Not Started': 0}
+files_by_triplet_b = {'ToProcess': 0, 'Processed': 0, 'ProcessedEmpty': 0, 'Failed': 0, 'DeadLetter': 0, 'Not Started': 0}
 max_depth = 0
 
 for file in files:
@@ -40,14 +41,14 @@ for file in files:
     if triplet_status_a is None:
         files_by_triplet_a['Not Started'] += 1
     else:
-        files_by_triplet_a[triplet_status_a] += 1
+        files_by_triplet_a[triplet_status_a] = files_by_triplet_a.get(triplet_status_a, 0) + 1
         
     # Count by triplet_group_b state
     triplet_status_b = data.get('triplet_group_b', None)
     if triplet_status_b is None:
         files_by_triplet_b['Not Started'] += 1
     else:
-        files_by_triplet_b[triplet_status_b] += 1
+        files_by_triplet_b[triplet_status_b] = files_by_triplet_b.get(triplet_status_b, 0) + 1
 
     # Count by depth
     depth = data.get('depth', 0)
@@ -92,13 +93,13 @@ else:
 
 # Display Triplet Statistics
 st.subheader('Files by Triplet Group A Status')
-cols = st.columns(min(len(files_by_triplet_a), 5))
+cols = st.columns(min(len(files_by_triplet_a), 6))
 for i, (state, count) in enumerate(files_by_triplet_a.items()):
     with cols[i % len(cols)]:
         st.metric(state, count)
 
 st.subheader('Files by Triplet Group B Status')
-cols = st.columns(min(len(files_by_triplet_b), 5))
+cols = st.columns(min(len(files_by_triplet_b), 6))
 for i, (state, count) in enumerate(files_by_triplet_b.items()):
     with cols[i % len(cols)]:
         st.metric(state, count)
@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from firebase_utils import db
+from firebase_utils import get_db
 import json
 from datetime import datetime
 
@@ -20,7 +20,7 @@ Export your processed data in various formats:
 
 # Function to get all documents from a collection
 def get_collection_data(collection_name):
-    docs = db.collection(collection_name).stream()
+    docs = get_db().collection(collection_name).stream()
     return [{'id': doc.id, **doc.to_dict()} for doc in docs]
 
 # Download Papers
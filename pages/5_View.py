@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
-import tempfile
-from firebase_utils import db, download_pdf_from_storage, download_txt_from_storage
+from firebase_utils import get_db, download_pdf_as_bytes, download_text_from_storage
+from triplet_store import TripletStore, load_triplet_store
+from crawl_attempts import load_attempts
 from datetime import datetime
 
 st.set_page_config(
@@ -14,13 +15,14 @@ st.title('👀 View Database Contents')
 
 # Function to convert Firestore timestamp to datetime
 def convert_timestamp(timestamp):
-    if timestamp:
-        return timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    return None
+    # Rows without the field come through DataFrame columns as NaN, which is truthy
+    if timestamp is None or pd.isna(timestamp):
+        return None
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
 # Function to get collection data as DataFrame
 def get_collection_df(collection_name):
-    docs = list(db.collection(collection_name).stream())
+    docs = list(get_db().collection(collection_name).stream())
     if not docs:
         return None
     
@@ -101,32 +103,26 @@ with tab1:
                 with download_col1:
                     if st.button("📄 Download PDF", key=f"pdf_{row['id']}"):
                         try:
-                            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                                download_pdf_from_storage(row['file_id'], tmp_file)
-                                with open(tmp_file.name, 'rb') as f:
-                                    st.download_button(
-                                        label="📄 Save PDF",
-                                        data=f,
-                                        file_name=f"{row.get('title', row['file_id'])}.pdf",
-                                        mime='application/pdf',
-                                        key=f"save_pdf_{row['id']}"
-                                    )
+                            st.download_button(
+                                label="📄 Save PDF",
+                                data=download_pdf_as_bytes(row['file_id']),
+                                file_name=f"{row.get('title', row['file_id'])}.pdf",
+                                mime='application/pdf',
+                                key=f"save_pdf_{row['id']}"
+                            )
                         except Exception as e:
                             st.error(f"Error downloading PDF: {str(e)}")
                 
                 with download_col2:
                     if row.get('txt_file_location') and st.button("📝 Download TXT", key=f"txt_{row['id']}"):
                         try:
-                            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                                download_txt_from_storage(row['file_id'], tmp_file)
-                                with open(tmp_file.name, 'rb') as f:
-                                    st.download_button(
-                                        label="📝 Save TXT",
-                                        data=f,
-                                        file_name=f"{row.get('title', row['file_id'])}.txt",
-                                        mime='text/plain',
-                                        key=f"save_txt_{row['id']}"
-                                    )
+                            st.download_button(
+                                label="📝 Save TXT",
+                                data=download_text_from_storage(row['file_id']),
+                                file_name=f"{row.get('title', row['file_id'])}.txt",
+                                mime='text/plain',
+                                key=f"save_txt_{row['id']}"
+                            )
                         except Exception as e:
                             st.error(f"Error downloading TXT: {str(e)}")
     else:
@@ -177,98 +173,119 @@ with tab2:
             hide_index=False
         )
         st.caption(f"Showing {len(filtered_df)} of {len(refs_df)} references")
+
+        # Candidates and failed downloads live in each reference's crawl_attempts subcollection
+        ref_id = st.selectbox("Show Crawl Attempts for", options=[''] + filtered_df['id'].tolist())
+        if ref_id:
+            attempts = load_attempts(get_db(), ref_id)
+            if not attempts:
+                st.info("This reference hasn't been crawled yet")
+            for i, attempt in enumerate(attempts):
+                with st.expander(f"Attempt {i + 1}: {attempt.get('created_timestamp', '')}", expanded=i == len(attempts) - 1):
+                    if attempt.get('error'):
+                        st.error(attempt['error'])
+                    for label, key in [('Resolved from identifiers', 'resolved_results'),
+                                       ('Search results', 'search_results'),
+                                       ('Failed downloads', 'failed_downloads')]:
+                        if attempt.get(key):
+                            st.write(f"{label}:")
+                            st.dataframe(pd.DataFrame(attempt[key]), use_container_width=True, hide_index=True)
+                    if attempt.get('downloaded_files'):
+                        st.write(f"Downloaded: {', '.join(attempt['downloaded_files'])}")
     else:
         st.info("No references found in the database")
 
 # Add triplets tab content
-with tab3:
-    st.header("Triplets Group A")
-    triplets_df = get_collection_df('triplets_group_a')
-    if triplets_df is not None:
-        # Reorder columns to show important ones first
-        cols = ['id', 'title', 'file_id', 'subject', 'predicate', 'object',
-                'created_timestamp']
-        cols = [col for col in cols if col in triplets_df.columns] + \
-               [col for col in triplets_df.columns if col not in cols]
-        triplets_df = triplets_df[cols]
-        
-        # Add filters
-        st.subheader("Filters")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            title_filter = st.multiselect(
-                "Filter by Paper Title",
-                options=sorted(triplets_df['title'].unique()),
-                default=[]
-            )
-        with col2:
-            subject_search = st.text_input("Search in Subject", "")
-        with col3:
-            object_search = st.text_input("Search in Object", "")
-        
-        # Apply filters
-        filtered_df = triplets_df
-        if title_filter:
-            filtered_df = filtered_df[filtered_df['title'].isin(title_filter)]
-        if subject_search:
-            filtered_df = filtered_df[filtered_df['subject'].str.contains(subject_search, case=False, na=False)]
-        if object_search:
-            filtered_df = filtered_df[filtered_df['object'].str.contains(object_search, case=False, na=False)]
-        
-        # Show dataframe with row numbers
-        st.dataframe(
-            filtered_df,
-            use_container_width=True,
-            hide_index=False
+@st.cache_resource
+def get_triplet_store(collection_name):
+    """Shared store per collection, kept with its indexes across reruns and sessions"""
+    return TripletStore()
+
+def show_triplets(collection_name, cols, key):
+    # Only triplets written since the last run are read
+    store = load_triplet_store(get_db(), collection_name, get_triplet_store(collection_name))
+    if not len(store):
+        st.info("No triplets found in the database")
+        return
+
+    # Map paper titles to file IDs so the paper index can be used
+    titles = {}
+    for file_id, triplet_ids in store.by_paper.items():
+        row = store.triplets[next(iter(triplet_ids))]
+        titles.setdefault(row.get('title') or file_id, []).append(file_id)
+
+    # Add filters
+    st.subheader("Filters")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        title_filter = st.multiselect(
+            "Filter by Paper Title",
+            options=sorted(titles),
+            default=[],
+            key=f"title_filter_{key}"
+        )
+    with col2:
+        subject_search = st.text_input("Search in Subject", "", key=f"subject_search_{key}")
+    with col3:
+        predicate_filter = st.multiselect(
+            "Filter by Predicate",
+            options=sorted(store.by_predicate),
+            default=[],
+            key=f"predicate_filter_{key}"
         )
-        st.caption(f"Showing {len(filtered_df)} of {len(triplets_df)} triplets")
+    with col4:
+        object_search = st.text_input("Search in Object", "", key=f"object_search_{key}")
+
+    # Resolve filters to index keys; search text only scans entity names
+    criteria = {}
+    if title_filter:
+        criteria['paper'] = [file_id for title in title_filter for file_id in titles[title]]
+    if subject_search:
+        criteria['subject'] = store.match_entities(subject_search)
+    if predicate_filter:
+        criteria['predicate'] = predicate_filter
+    if object_search:
+        criteria['object'] = store.match_entities(object_search)
+    rows = store.query(**criteria)
+
+    if rows:
+        filtered_df = pd.DataFrame(rows)
+        filtered_df['subject_entity'] = filtered_df['subject_id'].map(store.labels)
+        filtered_df['object_entity'] = filtered_df['object_id'].map(store.labels)
+        for column in filtered_df.columns:
+            if 'timestamp' in column.lower():
+                filtered_df[column] = filtered_df[column].map(convert_timestamp)
+        # Reorder columns to show important ones first
+        cols = [col for col in cols if col in filtered_df.columns] + \
+               [col for col in filtered_df.columns if col not in cols]
+        filtered_df = filtered_df[cols]
     else:
-        st.info("No triplets found in the database")
+        filtered_df = pd.DataFrame(columns=cols)
+
+    # Show dataframe with row numbers
+    st.dataframe(
+        filtered_df,
+        use_container_width=True,
+        hide_index=False
+    )
+    st.caption(f"Showing {len(filtered_df)} of {len(store)} triplets")
+
+with tab3:
+    st.header("Triplets Group A")
+    show_triplets('triplets_group_a',
+                  ['id', 'title', 'file_id', 'subject', 'predicate', 'object',
+                   'subject_entity', 'object_entity', 'created_timestamp'],
+                  key='a')
 
 with tab4:
     st.header("Triplets Group B")
-    triplets_df = get_collection_df('triplets_group_b')
-    if triplets_df is not None:
-        # Reorder columns to show important ones first
-        cols = ['id', 'title', 'file_id', 'subject', 'predicate', 'object',
-                'frequency', 'context', 'created_timestamp']
-        cols = [col for col in cols if col in triplets_df.columns] + \
-               [col for col in triplets_df.columns if col not in cols]
-        triplets_df = triplets_df[cols]
-        
-        # Add filters
-        st.subheader("Filters")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            title_filter = st.multiselect(
-                "Filter by Paper Title",
-                options=sorted(triplets_df['title'].unique()),
-                default=[]
-            )
-        with col2:
-            subject_search = st.text_input("Search in Subject", "", key="subject_search_b")
-        with col3:
-            object_search = st.text_input("Search in Object", "", key="object_search_b")
-        
-        # Apply filters
-        filtered_df = triplets_df
-        if title_filter:
-            filtered_df = filtered_df[filtered_df['title'].isin(title_filter)]
-        if subject_search:
-            filtered_df = filtered_df[filtered_df['subject'].str.contains(subject_search, case=False, na=False)]
-        if object_search:
-            filtered_df = filtered_df[filtered_df['object'].str.contains(object_search, case=False, na=False)]
-        
-        # Show dataframe with row numbers
-        st.dataframe(
-            filtered_df,
-            use_container_width=True,
-            hide_index=False
-        )
-        st.caption(f"Showing {len(filtered_df)} of {len(triplets_df)} triplets")
-    else:
-        st.info("No triplets found in the database")
+    show_triplets('triplets_group_b',
+                  ['id', 'title', 'file_id', 'subject', 'predicate', 'object',
+                   'subject_entity', 'object_entity', 'frequency', 'context',
+                   'created_timestamp'],
+                  key='b')
 
 # Add refresh button at the bottom
 if st.button("🔄 Refresh Data"):
+    get_triplet_store.clear()
     st.rerun()
@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from firebase_utils import db, update_pdf_record
+from firebase_utils import get_db, update_pdf_record
 from datetime import datetime
 from firebase_admin import firestore
 
@@ -20,7 +20,7 @@ def convert_timestamp(timestamp):
 
 # Function to get collection data as DataFrame
 def get_collection_df(collection_name):
-    docs = list(db.collection(collection_name).stream())
+    docs = list(get_db().collection(collection_name).stream())
     if not docs:
         return None
     
@@ -56,10 +56,11 @@ with tab1:
             # Create form for editing
             with st.form(key=f"edit_file_{row['id']}"):
                 # Status dropdown
+                status_options = ['Initial', 'TextExtracted', 'TextProcessed', 'Duplicate', 'FailedProcessing', 'DeadLetter']
                 new_status = st.selectbox(
                     "Status",
-                    options=['Initial', 'TextExtracted', 'TextProcessed'],
-                    index=['Initial', 'TextExtracted', 'TextProcessed'].index(row['status'])
+                    options=status_options,
+                    index=status_options.index(row['status']) if row['status'] in status_options else 0
                 )
                 
                 # Depth input
@@ -115,10 +116,11 @@ with tab2:
             # Create form for editing
             with st.form(key=f"edit_ref_{ref_id}"):
                 # Status dropdown
+                status_options = ['NewReference', 'ProcessedReference', 'FailedProcessing', 'DeadLetter']
                 new_status = st.selectbox(
                     "Status",
-                    options=['NewReference', 'ProcessedReference'],
-                    index=['NewReference', 'ProcessedReference'].index(row['status'])
+                    options=status_options,
+                    index=status_options.index(row['status']) if row['status'] in status_options else 0
                 )
                 
                 # Reference text input
@@ -158,7 +160,7 @@ with tab2:
                     }
                     
                     try:
-                        db.collection('references').document(ref_id).update(updates)
+                        get_db().collection('references').document(ref_id).update(updates)
                         st.success("Changes saved successfully!")
                         st.rerun()  # Refresh the page
                     except Exception as e:
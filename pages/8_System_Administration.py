@@ -1,18 +1,142 @@
 import streamlit as st
-from firebase_utils import add_missing_field
+from firebase_utils import get_db, add_missing_field
+from work_leases import reclaim_expired_leases
+from prequalify import load_prequalifier, train_prequalifier, prequalify_report
+from near_duplicates import index_existing_papers, move_legacy_bands
+from crawl_attempts import move_legacy_fields
+from text_segments import compact_texts
+from llm_stages import STAGES, TRIPLET_GROUPS
+
+# Stages that claim documents, by collection
+LEASED_STAGES = {
+    'pdf_files': ['extract', 'qualify', 'references', *TRIPLET_GROUPS],
+    'references': ['crawl'],
+}
+
+def run_migration(collection_name, field_name, default_value, dry_run, restart, partition_count, max_workers):
+    status = st.empty()
+
+    def progress(scanned, missing):
+        verb = 'would be updated' if dry_run else 'updated'
+        status.write(f"Scanned {scanned} documents, {missing} {verb}")
+
+    try:
+        with st.spinner(f"{'Counting' if dry_run else 'Migrating'} '{field_name}' on {collection_name}..."):
+            totals = add_missing_field(
+                collection_name, field_name, default_value,
+                partition_count=partition_count,
+                max_workers=max_workers,
+                dry_run=dry_run,
+                restart=restart,
+                progress=progress
+            )
+    except Exception as e:
+        st.error(f"Migration interrupted: {str(e)}. Run it again to resume from the last checkpoint.")
+        return
+
+    if dry_run:
+        st.info(f"Dry run: {totals['missing']} of {totals['scanned']} documents are missing '{field_name}'")
+    else:
+        resumed = ', resumed from the last checkpoint' if totals['resumed'] else ''
+        st.success(f"Successfully added '{field_name}' where missing "
+                   f"({totals['updated']} updated, {totals['scanned']} scanned{resumed})")
 
 def main():
     st.title("System Administration")
-    
+
     st.subheader("Database Management")
-    
-    if st.button("Add Triplet_GroupA"):
-        add_missing_field('pdf_files', 'triplet_group_a', 'ToProcess')
-        st.success("Successfully added 'triplet_group_a' field where missing")
-    
-    if st.button("Add Triplet_GroupB"):
-        add_missing_field('pdf_files', 'triplet_group_b', 'ToProcess')
-        st.success("Successfully added 'triplet_group_b' field where missing")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        dry_run = st.checkbox("Dry run (count only)", value=False)
+    with col2:
+        restart = st.checkbox("Ignore checkpoint", value=False,
+                              help="Start over instead of resuming an interrupted migration")
+    with col3:
+        partition_count = st.number_input("Partitions", min_value=1, value=8, step=1)
+    with col4:
+        max_workers = st.number_input("Workers", min_value=1, value=8, step=1)
+
+    for group in TRIPLET_GROUPS:
+        if st.button(f"Add {STAGES[group].title}", key=f'add_{group}'):
+            run_migration('pdf_files', group, 'ToProcess', dry_run, restart, partition_count, max_workers)
+
+    if st.button("Add Depth", help="Give papers without a crawl depth depth 1, so reference extraction picks them up"):
+        run_migration('pdf_files', 'depth', 1, dry_run, restart, partition_count, max_workers)
+
+    if st.button("Add Qualified", help="Queue papers extracted before qualification was batched"):
+        run_migration('pdf_files', 'qualified', None, dry_run, restart, partition_count, max_workers)
+
+    if st.button("Index Near-Duplicates", help="Sign extracted papers so new copies of them are detected"):
+        status = st.empty()
+        with st.spinner("Indexing extracted papers..."):
+            totals = index_existing_papers(
+                get_db(), progress=lambda indexed, duplicates: status.write(f"Indexed {indexed} papers, {duplicates} near-duplicates"))
+        st.success(f"Indexed {totals['indexed']} papers; {totals['duplicates']} are near-duplicates of another paper")
+
+    if st.button("Move Near-Duplicate Bands", help="Move band membership from arrays on the band documents, "
+                                                   "which grow without bound, into one document per paper"):
+        status = st.empty()
+        with st.spinner("Moving near-duplicate bands..."):
+            totals = move_legacy_bands(
+                get_db(), progress=lambda bands, papers: status.write(f"Moved {bands} bands, {papers} papers"))
+        st.success(f"Moved {totals['papers']} papers in {totals['bands']} bands")
+
+    if st.button("Move Crawl Logs Off References",
+                 help="Move search results and failed downloads of references crawled before crawl attempts "
+                      "were logged separately into their crawl_attempts subcollection"):
+        status = st.empty()
+        with st.spinner("Moving crawl logs..."):
+            totals = move_legacy_fields(
+                get_db(), progress=lambda scanned, moved: status.write(f"Scanned {scanned} references, {moved} moved"))
+        st.success(f"Moved the crawl logs of {totals['moved']} of {totals['scanned']} references")
+
+    if st.button("Add Text Segment", help="Queue papers extracted before text segments for packing"):
+        run_migration('pdf_files', 'text_segment', None, dry_run, restart, partition_count, max_workers)
+
+    if st.button("Compact Texts", help="Pack the texts of papers extracted since the last compaction into "
+                                       "text segments, which the batch stages read in one request each"):
+        status = st.empty()
+        with st.spinner("Packing extracted texts..."):
+            totals = compact_texts(
+                get_db(), progress=lambda papers, segments: status.write(f"Packed {papers} papers into {segments} segments"))
+        st.success(f"Packed {totals['papers']} papers into {totals['segments']} segments "
+                   f"({totals['errors']} texts could not be read)")
+
+    st.subheader("Work Leases")
+    st.write("Processing stages lease the documents they claim. Leases left behind by a closed "
+             "session expire on their own; this clears them from the records.")
+    if st.button("Reclaim Expired Leases"):
+        reclaimed = 0
+        for collection_name, stages in LEASED_STAGES.items():
+            for stage in stages:
+                reclaimed += reclaim_expired_leases(get_db(), collection_name, stage)
+        st.success(f"Reclaimed {reclaimed} expired lease(s)")
+
+    st.subheader("Pre-qualification Model")
+    st.write("A local model trained on past LLM qualifications accepts or rejects obvious papers "
+             "without an LLM call. Retrain it as more papers are qualified.")
+    model = load_prequalifier()
+    if model is None:
+        st.info("No model trained yet; every paper is sent to the LLM.")
+    else:
+        report = model.report
+        st.write(f"Trained {model.trained_at} on {report['papers']} papers: "
+                 f"{report['coverage']:.0%} decided locally in cross-validation, accept precision "
+                 f"{report['accept_precision'] or 0:.1%}, reject precision {report['reject_precision'] or 0:.1%}")
+    if st.button("Retrain Pre-qualifier"):
+        try:
+            with st.spinner("Training on LLM-qualified papers..."):
+                model = train_prequalifier(get_db())
+            st.success(f"Trained on {model.report['papers']} papers; "
+                       f"{model.report['coverage']:.0%} would be decided without the LLM")
+        except ValueError as e:
+            st.warning(str(e))
+    if st.button("Check Precision on Audited Papers"):
+        for side, counts in prequalify_report(get_db()).items():
+            precision = f"{counts['precision']:.1%}" if counts['precision'] is not None else 'n/a'
+            st.write(f"{side.capitalize()}: {counts['agreed']} of {counts['papers']} audited papers "
+                     f"agreed with the LLM ({precision})")
 
 if __name__ == "__main__":
     main()
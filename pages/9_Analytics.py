@@ -0,0 +1,96 @@
+import streamlit as st
+import pandas as pd
+import altair as alt
+from firebase_utils import get_db
+from triplet_analytics import GROUPS, TripletMatrix, load_triplet_matrix
+
+st.set_page_config(
+    page_title="Triplet Analytics",
+    page_icon="🧮",
+    layout="wide"
+)
+
+st.title('🧮 Triplet Analytics')
+
+st.markdown("""
+Aggregates over Group B triplets, using the controlled vocabulary of marketing cues,
+customer traits and behavioral outcomes. Counts are kept in memory and only new
+triplets are read on refresh.
+""")
+
+@st.cache_resource
+def get_triplet_matrix():
+    """Shared matrix, built once per server process"""
+    return TripletMatrix()
+
+def heatmap(values, row_group, col_group, title):
+    """Render a 2-D array labelled by two vocabulary groups as a heatmap"""
+    df = pd.DataFrame(values, index=GROUPS[row_group], columns=GROUPS[col_group])
+    long_df = df.reset_index(names=row_group).melt(id_vars=row_group, var_name=col_group, value_name='value')
+    chart = alt.Chart(long_df, title=title).mark_rect().encode(
+        x=alt.X(f'{col_group}:N', sort=GROUPS[col_group]),
+        y=alt.Y(f'{row_group}:N', sort=GROUPS[row_group]),
+        color=alt.Color('value:Q', scale=alt.Scale(scheme='blues')),
+        tooltip=[row_group, col_group, 'value']
+    )
+    text = chart.mark_text().encode(text='value:Q', color=alt.value('black'))
+    st.altair_chart(chart + text, use_container_width=True)
+
+matrix = load_triplet_matrix(get_db(), get_triplet_matrix())
+
+if not matrix.papers:
+    if matrix.skipped:
+        st.info(f"{matrix.skipped} Group B triplets found, but none have both subject and object "
+                "in the controlled vocabulary")
+    else:
+        st.info("No Group B triplets found in the database")
+    st.stop()
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.metric('Papers', len(matrix.papers))
+with col2:
+    st.metric('Triplets in Vocabulary', int(matrix.counts.sum()))
+with col3:
+    st.metric('Triplets outside Vocabulary', matrix.skipped)
+
+# Filters
+st.subheader("Filters")
+col1, col2, col3 = st.columns(3)
+with col1:
+    pair = st.selectbox(
+        "Axes",
+        options=[('Cue', 'Trait'), ('Cue', 'Behavior'), ('Trait', 'Behavior')],
+        format_func=lambda p: f"{p[0]} × {p[1]}"
+    )
+with col2:
+    depth_filter = st.multiselect("Filter by Depth", options=sorted(matrix.depths), default=[])
+with col3:
+    predicate_filter = st.multiselect("Filter by Predicate", options=sorted(matrix.predicates), default=[])
+measure = st.radio("Measure", options=['count', 'frequency'], horizontal=True,
+                   help="count: number of triplets; frequency: sum of the per-triplet frequency reported by the LLM")
+
+row_group, col_group = pair
+heatmap(
+    matrix.matrix(row_group, col_group,
+                  predicate=predicate_filter or None,
+                  depth=depth_filter or None,
+                  measure=measure),
+    row_group, col_group,
+    f"{row_group} → {col_group} ({measure})"
+)
+
+st.subheader("Co-occurrence")
+st.caption("Number of papers in which both entities appear in any triplet")
+heatmap(matrix.cooccurrence(row_group, col_group), row_group, col_group,
+        f"{row_group} / {col_group} papers")
+
+st.subheader("Triplets by Depth")
+totals = matrix.by_depth(measure=measure)
+depth_df = pd.DataFrame({'depth': matrix.depths, measure: totals}).sort_values('depth')
+st.bar_chart(depth_df, x='depth', y=measure)
+
+# Add refresh button at the bottom
+if st.button("🔄 Rebuild from Scratch"):
+    get_triplet_matrix.clear()
+    st.rerun()
@@ -0,0 +1,114 @@
+import re
+from rate_limiter import get_rate_limiter, error_status_code
+from pipeline_metrics import metrics
+
+# Fast path for the crawl: many reference strings already carry a DOI, an
+# arXiv ID or a direct PDF link. Those are turned into candidate PDF URLs
+# here (arXiv directly, DOIs through OpenAlex's open-access locations) so the
+# crawl only spends a web search on references that don't resolve.
+
+# Override in the optional [resolver] section of secrets.toml
+DEFAULT_RESOLVER_CONFIG = {
+    'enabled': True,
+    'arxiv_url': 'https://arxiv.org',
+    'doi_lookup_url': 'https://api.openalex.org/works/doi:',  # + DOI; answers in OpenAlex's format
+    'email': '',  # Sent to OpenAlex as mailto=, which gets its faster "polite pool"
+    'timeout': 15,
+}
+
+# DOIs as printed in references, bare or as https://doi.org/... links
+_DOI = re.compile(r'\b(10\.\d{4,9}/[^\s"<>]+)', re.IGNORECASE)
+# New-style (2007 onwards) and old-style arXiv IDs, with or without an arXiv: prefix or an arxiv.org link
+_ARXIV = re.compile(r'(?:arxiv:\s*|arxiv\.org/(?:abs|pdf)/)(\d{4}\.\d{4,5}(?:v\d+)?|[a-z\-]+(?:\.[A-Z]{2})?/\d{7}(?:v\d+)?)',
+                    re.IGNORECASE)
+_PDF_URL = re.compile(r'https?://[^\s"<>]+?\.pdf\b', re.IGNORECASE)
+# Punctuation that ends the sentence rather than the identifier
+_TRAILING = '.,;:)]}>\'"'
+
+def load_resolver_config() -> dict:
+    """Resolver settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_RESOLVER_CONFIG)
+    try:
+        import streamlit as st
+        if 'resolver' in st.secrets:
+            config.update(dict(st.secrets['resolver']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def find_identifiers(text: str) -> dict:
+    """DOI, arXiv ID and direct PDF links found in a reference string.
+
+    Returns:
+        dict: 'doi' and 'arxiv' (str or None) and 'pdf_urls' (list)
+    """
+    pdf_urls = [match.rstrip(_TRAILING) for match in _PDF_URL.findall(text)]
+    arxiv = _ARXIV.search(text)
+    doi = _DOI.search(text)
+    doi = doi.group(1).rstrip(_TRAILING) if doi else None
+    if doi and doi.lower().endswith('.pdf'):
+        # Part of a PDF link that happens to contain a DOI
+        doi = None
+    return {
+        'doi': doi,
+        'arxiv': arxiv.group(1).rstrip(_TRAILING) if arxiv else None,
+        'pdf_urls': list(dict.fromkeys(pdf_urls)),
+    }
+
+def _doi_pdf_urls(doi: str, config: dict) -> list:
+    """Open-access PDF links for a DOI, best location first"""
+    from clients import get_http_client
+
+    params = {'mailto': config['email']} if config.get('email') else None
+
+    def lookup():
+        response = get_http_client().get(f"{config['doi_lookup_url']}{doi}", params=params,
+                                          timeout=float(config['timeout']))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    work = get_rate_limiter().call('openalex', lookup)
+    if not work:
+        return []
+    locations = [work.get('best_oa_location') or {}] + (work.get('oa_locations') or [])
+    urls = [location.get('pdf_url') for location in locations if location.get('pdf_url')]
+    return list(dict.fromkeys(urls))
+
+def resolve_reference(reference_text: str, config: dict = None) -> list:
+    """Candidate PDF URLs for a reference, built from the identifiers in its text.
+
+    Direct PDF links come first, then the arXiv PDF, then open-access copies
+    of the DOI. A failed DOI lookup only leaves those out; the crawl falls
+    back to search when nothing here can be downloaded.
+
+    Args:
+        reference_text (str): The reference as extracted from its paper
+        config (dict): Settings (default from secrets.toml)
+
+    Returns:
+        list[dict]: 'url', 'title' (empty) and 'source' of each candidate; empty
+            if the reference has no usable identifier
+    """
+    config = config or load_resolver_config()
+    if not config['enabled']:
+        return []
+    identifiers = find_identifiers(reference_text)
+    candidates = [(url, 'pdf_url') for url in identifiers['pdf_urls']]
+    if identifiers['arxiv']:
+        candidates.append((f"{config['arxiv_url'].rstrip('/')}/pdf/{identifiers['arxiv']}", 'arxiv'))
+    if identifiers['doi']:
+        try:
+            candidates += [(url, 'doi') for url in _doi_pdf_urls(identifiers['doi'], config)]
+        except Exception as e:
+            print(f"Could not look up DOI {identifiers['doi']} (status {error_status_code(e)}): {e}")
+
+    results, seen = [], set()
+    for url, source in candidates:
+        if url not in seen:
+            seen.add(url)
+            results.append({'url': url, 'title': '', 'source': source})
+    metrics.add('resolver_hits_total' if results else 'resolver_misses_total')
+    return results
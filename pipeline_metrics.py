@@ -0,0 +1,196 @@
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stage the current thread is working on, so LLM, search and storage calls
+# made deep inside a stage are attributed to it
+_current_stage = contextvars.ContextVar('current_stage', default='other')
+
+COUNTERS = {
+    'documents_total': 'Documents processed',
+    'errors_total': 'Documents that failed',
+    'llm_requests_total': 'LLM requests',
+    'llm_prompt_tokens_total': 'LLM prompt tokens',
+    'llm_completion_tokens_total': 'LLM completion tokens',
+    'search_calls_total': 'Search API calls',
+    'bytes_downloaded_total': 'Bytes downloaded',
+    'bytes_uploaded_total': 'Bytes uploaded',
+}
+
+class PipelineMetrics:
+    """In-process counters and per-document timings, labelled by stage.
+
+    Counters are cumulative since the process started. Per-document wall
+    times are kept for the last `window_seconds` to compute rolling
+    throughput and latency percentiles.
+    """
+
+    def __init__(self, window_seconds: int = 3600):
+        self.window_seconds = window_seconds
+        self.started = time.time()
+        self.counters = {}
+        self.documents = deque()
+        self.lock = threading.Lock()
+
+    def add(self, name: str, amount: float = 1, stage: str = None):
+        stage = stage or _current_stage.get()
+        with self.lock:
+            self.counters[(name, stage)] = self.counters.get((name, stage), 0) + amount
+
+    def observe_document(self, stage: str, seconds: float, ok: bool = True, error_class: str = None):
+        now = time.time()
+        with self.lock:
+            self.documents.append((now, stage, seconds, ok))
+            while self.documents and self.documents[0][0] < now - self.window_seconds:
+                self.documents.popleft()
+        self.add('documents_total', 1, stage)
+        if not ok:
+            self.add('errors_total', 1, stage)
+            if error_class:
+                self.add(f'errors_{error_class}_total', 1, stage)
+
+    def stages(self) -> list:
+        with self.lock:
+            return sorted({stage for _, stage in self.counters})
+
+    def recent_documents(self, stage: str = None, window_seconds: int = None) -> list:
+        """(timestamp, stage, seconds, ok) for documents finished within the window"""
+        since = time.time() - (window_seconds or self.window_seconds)
+        with self.lock:
+            return [d for d in self.documents if d[0] >= since and (stage is None or d[1] == stage)]
+
+    def latency_percentiles(self, stage: str, window_seconds: int = None, percentiles=(50, 95, 99)) -> dict:
+        durations = sorted(d[2] for d in self.recent_documents(stage, window_seconds))
+        if not durations:
+            return {p: None for p in percentiles}
+        return {p: durations[min(len(durations) - 1, int(len(durations) * p / 100))] for p in percentiles}
+
+    def throughput(self, stage: str, window_seconds: int = 300) -> float:
+        """Documents per minute over the window"""
+        return len(self.recent_documents(stage, window_seconds)) * 60 / window_seconds
+
+    def snapshot(self) -> dict:
+        """All metrics as a JSON-serializable dict"""
+        stages = {}
+        with self.lock:
+            counters = dict(self.counters)
+        for (name, stage), value in counters.items():
+            stages.setdefault(stage, {})[name] = value
+        for stage, values in stages.items():
+            values['latency_seconds'] = {f'p{p}': v for p, v in self.latency_percentiles(stage).items()}
+            values['documents_per_minute_5m'] = self.throughput(stage)
+        return {'started': self.started, 'window_seconds': self.window_seconds, 'stages': stages}
+
+    def prometheus_text(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            counters = dict(self.counters)
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f'reference_crawler_{name}'
+            lines.append(f'# HELP {metric} {COUNTERS.get(name, name.replace("_", " "))}')
+            lines.append(f'# TYPE {metric} counter')
+            for (counter, stage), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{metric}{{stage="{stage}"}} {value}')
+        metric = 'reference_crawler_document_seconds'
+        lines.append(f'# HELP {metric} Per-document wall time over the rolling window')
+        lines.append(f'# TYPE {metric} summary')
+        for stage in self.stages():
+            for p, value in self.latency_percentiles(stage).items():
+                if value is not None:
+                    lines.append(f'{metric}{{stage="{stage}",quantile="{p / 100}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = PipelineMetrics()
+
+class DocumentTimer:
+    """Times one document through a stage and attributes nested calls to it.
+
+    Create at the start of the work, then call finish() on success,
+    finish(error=e) on failure or cancel() if the document was handed back
+    unprocessed.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = time.perf_counter()
+        self._token = _current_stage.set(stage)
+
+    def finish(self, error=None):
+        seconds = time.perf_counter() - self.started
+        error_class = None
+        if error is not None:
+            from retry_queue import classify_error
+            error_class = classify_error(error)
+        metrics.observe_document(self.stage, seconds, ok=error is None, error_class=error_class)
+        self._reset()
+        return seconds
+
+    def cancel(self):
+        """Stop timing without counting the document"""
+        self._reset()
+
+    def _reset(self):
+        try:
+            _current_stage.reset(self._token)
+        except ValueError:
+            # finish() called from a different context than the constructor
+            pass
+
+def record_llm_usage(message):
+    """Count an LLM request and its prompt/completion tokens from an AIMessage"""
+    metrics.add('llm_requests_total')
+    usage = getattr(message, 'usage_metadata', None) or {}
+    if not usage:
+        usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+    metrics.add('llm_prompt_tokens_total', usage.get('input_tokens', usage.get('prompt_tokens', 0)))
+    metrics.add('llm_completion_tokens_total', usage.get('output_tokens', usage.get('completion_tokens', 0)))
+
+def record_bytes(downloaded: int = 0, uploaded: int = 0):
+    if downloaded:
+        metrics.add('bytes_downloaded_total', downloaded)
+    if uploaded:
+        metrics.add('bytes_uploaded_total', uploaded)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.prometheus_text(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int):
+    """Serve /metrics (Prometheus) and /metrics.json from a background thread, once per process"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(('', port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+def maybe_start_metrics_server():
+    """Start the metrics endpoint if METRICS_PORT is set in secrets.toml"""
+    import streamlit as st
+
+    if 'METRICS_PORT' in st.secrets:
+        try:
+            start_metrics_server(int(st.secrets['METRICS_PORT']))
+        except OSError as e:
+            print(f"Could not start metrics server: {e}")
@@ -0,0 +1,766 @@
+import asyncio
+import datetime
+import hashlib
+import io
+import queue
+import time
+import httpx
+from concurrent.futures import wait
+from contextlib import contextmanager
+from firebase_admin import firestore
+from firebase_utils import (
+    get_db, open_pdf_from_storage, update_pdf_record,
+    upload_txt_to_storage, upload_pdf_to_storage, download_text_from_storage
+)
+from main import extract_text_from_pdf, extract_references_from_text, get_llm
+from search_providers import search_papers
+from paper_resolver import resolve_reference
+from candidate_ranking import rank_candidates, pdf_matches_title, title_similarity
+from host_health import get_host_health, host_of
+from crawl_attempts import record_attempt
+from text_segments import load_texts
+from clients import get_http_client, get_event_loop
+from qualify_paper import qualify_paper_batch, QUALIFY_BATCH_SIZE
+from prequalify import load_prequalify_config, load_prequalifier, is_audited
+from near_duplicates import check_near_duplicate, load_near_duplicate_config
+from llm_stages import STAGES
+from triplet_store import normalize_entity
+from crawl_frontier import citation_key
+from prompt_budget import prompt_text_tokens
+from work_leases import claim_documents, release_lease
+from retry_queue import failure_updates, reset_retry, requeue_due
+from pipeline_metrics import DocumentTimer, record_bytes, metrics
+
+# Papers per triplet stage run whose LLM calls are in flight at once
+TRIPLET_CONCURRENCY = 8
+
+# The Processing page runs these stages with ui=st; outside Streamlit
+# (e.g. the benchmark) messages go to ConsoleUI instead.
+
+class ConsoleUI:
+    """Prints the messages a stage would show on the Processing page"""
+
+    def __init__(self, verbose: bool = True):
+        self.verbose = verbose
+
+    def write(self, message):
+        if self.verbose:
+            print(message)
+
+    info = success = warning = write
+
+    def error(self, message):
+        print(f"ERROR: {message}")
+
+    @contextmanager
+    def spinner(self, text):
+        self.write(text)
+        yield
+
+    def progress(self, value):
+        return self
+
+class _QueuedUI:
+    """Holds messages from coroutines on the shared event loop for the calling thread to show"""
+
+    def __init__(self, ui):
+        self.ui = ui
+        self.messages = queue.SimpleQueue()
+
+    def __getattr__(self, name):
+        return lambda message: self.messages.put((name, message))
+
+    def show(self):
+        while True:
+            try:
+                name, message = self.messages.get_nowait()
+            except queue.Empty:
+                return
+            getattr(self.ui, name)(message)
+
+def _run_on_event_loop(coroutine, ui):
+    """Run coroutine(ui) on the shared event loop (see clients.get_event_loop) and return its result.
+
+    Streamlit only shows messages sent from the script's own thread, so the
+    coroutine's messages are passed back and shown here while it runs.
+    """
+    messages = _QueuedUI(ui)
+    future = asyncio.run_coroutine_threadsafe(coroutine(messages), get_event_loop())
+    while not future.done():
+        wait([future], timeout=0.1)
+        messages.show()
+    messages.show()
+    return future.result()
+
+def _requeue_retries(db, stage: str, ui):
+    """Return the stage's failed documents whose backoff has passed to its queue"""
+    try:
+        requeued = requeue_due(db, stage)
+    except Exception as e:
+        ui.warning(f"Could not requeue {stage} retries: {str(e)}")
+        return
+    if requeued:
+        ui.info(f'Requeued {requeued} failed {stage} document(s) for another attempt.')
+
+def _lease_lost(batch, remaining, ui):
+    """Stop a stage whose lease on a document ran out and was taken over by another worker"""
+    ui.warning(f'Another worker took over {len(batch.lost)} {batch.stage} document(s) whose lease ran out; '
+               f'stopping and releasing the rest of this batch.')
+    batch.stop(remaining)
+
+def extract_text(limit: int, worker_id: str, ui=ConsoleUI()) -> int:
+    """Extract text from PDFs with 'Initial' status.
+
+    Near-duplicates of an already extracted paper (e.g. a preprint and its
+    published version) are marked 'Duplicate' with duplicate_of pointing at
+    the canonical copy, so the later stages skip them.
+
+    Returns:
+        int: Number of PDFs processed
+    """
+    db = get_db()
+    _requeue_retries(db, 'extract', ui)
+    # Fetch initial records and claim them so other workers skip them
+    query = db.collection('pdf_files').where('status', '==', 'Initial')
+    docs = claim_documents(db, lambda count: list(query.limit(count).stream()), 'extract', limit, worker_id,
+                           eligible=lambda data: data.get('status') == 'Initial')
+    near_duplicate_config = load_near_duplicate_config()
+    processed = 0
+    for i, doc in enumerate(docs):
+        if not docs.keep_alive(docs.docs[i:]):
+            _lease_lost(docs, docs.docs[i:], ui)
+            break
+        timer = DocumentTimer('extract')
+        try:
+            file_data = doc.to_dict()
+            # Download PDF from Firebase Storage into memory
+            with open_pdf_from_storage(file_data['file_id']) as pdf_file:
+                # Extract text from PDF
+                text_content = extract_text_from_pdf(pdf_file)
+                # Save extracted text to Firebase Storage
+                txt_url = upload_txt_to_storage(text_content, file_data['file_id'])
+                try:
+                    duplicate_updates = check_near_duplicate(db, doc.id, text_content, near_duplicate_config)
+                except Exception as e:
+                    ui.warning(f"Near-duplicate check failed for {file_data['file_id']}: {str(e)}")
+                    duplicate_updates = {}
+                if duplicate_updates.get('duplicate_of'):
+                    ui.info(f"{file_data['file_id']} is a near-duplicate of {duplicate_updates['duplicate_of']} "
+                            f"(similarity {duplicate_updates['duplicate_similarity']:.2f}), skipping later stages")
+                    status_updates = {'status': 'Duplicate'}
+                else:
+                    status_updates = {
+                        'status': 'TextExtracted',
+                        'qualified': None,  # Queues the paper for qualification
+                        'text_segment': None,  # and for packing into a text segment
+                    }
+                # Update Firestore record
+                update_pdf_record(doc.id, {
+                    **status_updates,
+                    **duplicate_updates,
+                    'txt_file_location': txt_url,
+                    'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                    **reset_retry('extract'),
+                    **release_lease('extract')
+                })
+                processed += 1
+                timer.finish()
+        except Exception as e:
+            timer.finish(error=e)
+            ui.error(f"Error processing {file_data.get('file_id', 'unknown file')}: {str(e)}")
+            # Update status to failed
+            update_pdf_record(doc.id, {
+                **failure_updates('extract', doc.to_dict(), e, retry_value='Initial'),
+                'error_message': str(e),
+                'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                **release_lease('extract')
+            })
+            continue
+    if processed > 0:
+        ui.success(f'Extracted text from {processed} PDF(s) successfully.')
+    else:
+        ui.info('No new PDFs to process.')
+    return processed
+
+def qualify_papers(limit: int, worker_id: str, llm, frontier, ui=ConsoleUI(),
+                   batch_size: int = QUALIFY_BATCH_SIZE) -> int:
+    """Qualify extracted papers that haven't been qualified yet.
+
+    A trained pre-qualifier (see prequalify.py) decides confidently scored
+    papers locally; the rest are sent to the LLM batch_size at a time (see
+    qualify_paper_batch).
+
+    Returns:
+        int: Number of papers qualified
+    """
+    db = get_db()
+    _requeue_retries(db, 'qualify', ui)
+
+    # Get papers that haven't been qualified yet: status TextExtracted or
+    # TextProcessed and qualified=None (set by text extraction)
+    def unqualified(doc_data):
+        return doc_data.get('status') in ['TextExtracted', 'TextProcessed'] and doc_data.get('qualified') is None
+
+    query = db.collection('pdf_files')
+    query = query.where('status', 'in', ['TextExtracted', 'TextProcessed'])
+    query = query.where('qualified', '==', None)
+    papers = claim_documents(db, lambda count: list(query.limit(count).stream()), 'qualify', limit, worker_id,
+                             eligible=unqualified)
+
+    ui.write(f"Found {len(papers)} unqualified papers")
+
+    if not papers:
+        ui.info('No papers ready for qualification.')
+        return 0
+
+    queued = []
+    for doc in papers:
+        depth = doc.to_dict().get('depth', 1)
+        if not frontier.has_budget(depth, llm_tokens=1):
+            ui.warning(f"LLM token budget for depth {depth} is used up, skipping")
+            papers.release([doc])
+            continue
+        queued.append(doc)
+
+    prequalify_config = load_prequalify_config()
+    prequalifier = load_prequalifier(prequalify_config)
+
+    processed = 0
+    progress_bar = ui.progress(0)
+    for start in range(0, len(queued), batch_size):
+        if not papers.keep_alive(queued[start:]):
+            _lease_lost(papers, queued[start:], ui)
+            break
+        processed += _qualify_batch(queued[start:start + batch_size], llm, frontier, ui, batch_size,
+                                    prequalifier, prequalify_config['audit_fraction'])
+        progress_bar.progress(min(start + batch_size, len(queued)) / len(queued))
+
+    ui.success(f'Qualified {processed} paper(s).')
+    return processed
+
+def _qualify_failed(doc, e, ui):
+    doc_data = doc.to_dict()
+    ui.error(f"Error qualifying paper {doc_data['file_id']}: {str(e)}")
+    # Update status to failed
+    update_pdf_record(doc.id, {
+        **failure_updates('qualify', doc_data, e, retry_value=doc_data['status']),
+        'error_message': str(e),
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+        **release_lease('qualify')
+    })
+
+def _qualify_batch(docs, llm, frontier, ui, batch_size, prequalifier=None, audit_fraction=0.0) -> int:
+    """Qualify claimed papers in one batched request; returns the number qualified"""
+    timers = [(doc, DocumentTimer('qualify')) for doc in docs]
+    for doc in docs:
+        doc_data = doc.to_dict()
+        ui.write(f"Qualifying paper: {doc_data.get('title', doc_data['file_id'])}")
+    # Get the extracted texts, from text segments where the papers have been packed
+    texts, errors = load_texts(docs)
+
+    # Let the local model settle the obvious cases; audited papers go to the
+    # LLM anyway so its precision can be measured
+    results, assessments = {}, {}
+    if prequalifier is not None:
+        for doc_id, text in texts.items():
+            decision, score = prequalifier.decide(text)
+            assessments[doc_id] = {'decision': decision, 'score': score, 'model': prequalifier.trained_at}
+            if decision is not None and not is_audited(doc_id, audit_fraction):
+                results[doc_id] = decision
+                metrics.add('prequalify_decisions_total')
+    llm_texts = {doc_id: text for doc_id, text in texts.items() if doc_id not in results}
+
+    if llm_texts:
+        try:
+            # Qualify the papers
+            results.update(qualify_paper_batch(llm_texts, llm, batch_size))
+        except Exception as e:
+            # Not a parse error (those are split and retried); schedule the papers for a retry
+            errors.update({doc_id: e for doc_id in llm_texts})
+
+    processed = 0
+    # Finish the timers in reverse so the metrics stage context unwinds cleanly
+    for doc, timer in reversed(timers):
+        error = errors.get(doc.id)
+        if error is None:
+            try:
+                if doc.id in llm_texts:
+                    frontier.charge(doc.to_dict().get('depth', 1), llm_tokens=prompt_text_tokens(llm, 'qualify', texts[doc.id]))
+                # Update the paper's qualification status
+                updates = {
+                    'qualified': results[doc.id],
+                    'qualification_source': 'llm' if doc.id in llm_texts else 'prequalify',
+                    'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                    **reset_retry('qualify'),
+                    **release_lease('qualify')
+                }
+                if doc.id in assessments:
+                    updates['prequalify'] = assessments[doc.id]
+                update_pdf_record(doc.id, updates)
+                processed += 1
+            except Exception as e:
+                error = e
+        timer.finish(error=error)
+        if error is not None:
+            _qualify_failed(doc, error, ui)
+    return processed
+
+def process_references(limit: int, worker_id: str, frontier, ui=ConsoleUI(), llm=None) -> int:
+    """Extract and save the references of qualified papers, shallowest depth first.
+
+    Returns:
+        int: Number of papers processed
+    """
+    db = get_db()
+    _requeue_retries(db, 'references', ui)
+    # Get qualified documents ready for processing, shallowest depth first
+    papers = claim_documents(db, frontier.next_papers_for_references, 'references', limit, worker_id,
+                             eligible=lambda data: data.get('status') == 'TextExtracted' and data.get('qualified') is True)
+    processed = 0
+    for i, doc in enumerate(papers):
+        if not papers.keep_alive(papers.docs[i:]):
+            _lease_lost(papers, papers.docs[i:], ui)
+            break
+        timer = DocumentTimer('references')
+        try:
+            file_data = doc.to_dict()
+            # Download text content
+            text_content = download_text_from_storage(file_data['file_id'])
+
+            # Extract references from text
+            references = extract_references_from_text(text_content, llm)
+            frontier.charge(file_data.get('depth', 1), llm_tokens=prompt_text_tokens(llm or get_llm(), 'references', text_content))
+
+            save_references(db, doc.id, file_data, references)
+            processed += 1
+            timer.finish()
+        except Exception as e:
+            timer.finish(error=e)
+            ui.error(f"Error processing references for {file_data.get('file_id', 'unknown file')}: {str(e)}")
+            # Update status to failed
+            update_pdf_record(doc.id, {
+                **failure_updates('references', doc.to_dict(), e, retry_value='TextExtracted'),
+                'error_message': str(e),
+                'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                **release_lease('references')
+            })
+            continue
+
+    if processed > 0:
+        ui.success(f'Processed references from {processed} document(s).')
+    else:
+        ui.info('No documents ready for reference processing.')
+    return processed
+
+# References saved per batch; each one also updates its citations document
+REFERENCE_CHUNK = 200
+
+def save_references(db, doc_id: str, file_data: dict, references: list):
+    """Store a paper's extracted references, note its citations and mark it TextProcessed"""
+    # Save references to Firestore, two writes each, in batches within the 500 write limit
+    for start in range(0, len(references), REFERENCE_CHUNK):
+        ref_batch = db.batch()
+        for ref in references[start:start + REFERENCE_CHUNK]:
+            key = citation_key(ref['title'], ref['year'])
+            ref_doc = db.collection('references').document()
+            ref_batch.set(ref_doc, {
+                'full_reference_text': ref['reference_text'],
+                'authors': ref['authors'],
+                'title': ref['title'],
+                'year': ref['year'],
+                'citation_key': key,
+                'source_file': file_data['file_id'],
+                'status': 'NewReference',
+                'depth': file_data.get('depth', 1) + 1,  # Increment depth from source paper
+                'created_timestamp': firestore.SERVER_TIMESTAMP,
+                'updated_timestamp': firestore.SERVER_TIMESTAMP
+            })
+            # Track which qualified papers cite this work, to prioritize the crawl
+            if key:
+                ref_batch.set(db.collection('citations').document(key), {
+                    'title': ref['title'],
+                    'cited_by': firestore.ArrayUnion([file_data['file_id']]),
+                    'updated_timestamp': firestore.SERVER_TIMESTAMP
+                }, merge=True)
+        ref_batch.commit()
+
+    # Update file status
+    update_pdf_record(doc_id, {
+        'status': 'TextProcessed',
+        'reference_count': len(references),
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+        **reset_retry('references'),
+        **release_lease('references')
+    })
+
+def crawl_references(limit: int, worker_id: str, frontier, ui=ConsoleUI(), search=search_papers,
+                     resolve=resolve_reference) -> int:
+    """Search for and download the papers behind new references.
+
+    References whose DOI, arXiv ID or PDF link resolves to a downloadable
+    PDF skip the search (and its budget) altogether.
+
+    Args:
+        search (callable): Takes the reference text and returns [{'url', 'title'}]
+        resolve (callable): Takes the reference text and returns candidate [{'url', 'title'}]
+            from its identifiers
+
+    Returns:
+        int: Number of references crawled
+    """
+    db = get_db()
+    _requeue_retries(db, 'crawl', ui)
+    # Fetch NewReference records, breadth-first and most cited first
+    docs = claim_documents(db, frontier.next_references, 'crawl', limit, worker_id,
+                           eligible=lambda data: data.get('status') == 'NewReference')
+    processed = 0
+    for i, doc in enumerate(docs):
+        if not docs.keep_alive(docs.docs[i:]):
+            _lease_lost(docs, docs.docs[i:], ui)
+            break
+        reference_data = doc.to_dict()
+        timer = DocumentTimer('crawl')
+        try:
+            outcome, error = _crawl_reference(db, doc, reference_data, frontier, ui, search, resolve)
+        except Exception as e:
+            timer.finish(error=e)
+            ui.error(f"Error crawling reference {doc.id}: {str(e)}")
+            # Update status to failed
+            doc.reference.update({
+                **failure_updates('crawl', reference_data, e, retry_value='NewReference'),
+                'error_message': str(e),
+                'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                **release_lease('crawl')
+            })
+            continue
+        if outcome in CRAWL_BUDGETS:
+            # Not a result for this reference: hand it and the rest back for when there is budget again
+            timer.cancel()
+            ui.warning(f"{CRAWL_BUDGETS[outcome]} budget for depth {reference_data.get('depth', 1)} is used up, "
+                       f"skipping remaining references")
+            docs.release(docs.docs[i:])
+            break
+        if outcome == 'failed':
+            timer.finish(error=error)
+            continue
+        processed += 1
+        timer.finish()
+    if processed > 0:
+        ui.success(f'Crawled {processed} reference(s).')
+    else:
+        ui.info('No new references to crawl.')
+    return processed
+
+# Outcomes of _crawl_reference when a depth budget stops the crawl, and the budget's name
+CRAWL_BUDGETS = {'out_of_papers': 'Paper', 'out_of_searches': 'Search'}
+
+def _crawl_reference(db, doc, reference_data: dict, frontier, ui, search, resolve) -> tuple:
+    """Resolve, search for and download one claimed reference.
+
+    Returns:
+        tuple: The outcome, 'crawled' once the reference is marked processed,
+            'failed' if the search failed (already recorded for a retry) or a
+            CRAWL_BUDGETS key if a budget ran out before anything was
+            downloaded (nothing recorded); and the search error, if any
+    """
+    depth = reference_data.get('depth', 1)
+    resolved_results = resolve(reference_data['full_reference_text'])
+    downloaded_files, found, failed_downloads, out_of_papers = _download_results(
+        db, doc, resolved_results, depth, frontier, ui, reference_data.get('title', ''))
+    search_results = []
+    if out_of_papers and not found:
+        return 'out_of_papers', None
+    if found:
+        metrics.add('resolver_downloads_total')
+    else:
+        if not frontier.has_budget(depth, search_queries=1):
+            return 'out_of_searches', None
+        try:
+            # Search for papers
+            search_results = search(reference_data['full_reference_text'])
+            frontier.charge(depth, search_queries=1)
+        except Exception as e:
+            ui.error(f"Error searching for reference {doc.id}: {str(e)}")
+            # Update status to failed, logging what the resolver tried
+            batch = db.batch()
+            batch.update(doc.reference, {
+                **record_attempt(batch, doc.reference, resolved_results, [], failed_downloads, downloaded_files,
+                                 error=str(e)),
+                **failure_updates('crawl', reference_data, e, retry_value='NewReference'),
+                'error_message': str(e),
+                'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                **release_lease('crawl')
+            })
+            batch.commit()
+            return 'failed', e
+        searched_files, found, search_failures, out_of_papers = _download_results(
+            db, doc, search_results, depth, frontier, ui, reference_data.get('title', ''))
+        downloaded_files += searched_files
+        failed_downloads += search_failures
+        if out_of_papers and not found:
+            # Rather than marking the reference processed without a download; the search is repeated later
+            return 'out_of_papers', None
+
+    # Update reference record; the candidates and failures go to its crawl_attempts log
+    batch = db.batch()
+    batch.update(doc.reference, {
+        **record_attempt(batch, doc.reference, resolved_results, search_results, failed_downloads,
+                         downloaded_files),
+        'status': 'ProcessedReference',
+        'downloaded_files': downloaded_files,
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+        **reset_retry('crawl'),
+        **release_lease('crawl')
+    })
+    batch.commit()
+    return 'crawled', None
+
+def _download_results(db, doc, results: list, depth: int, frontier, ui, reference_title: str = '') -> tuple:
+    """Download the cited paper from a reference's candidate URLs.
+
+    Candidates are ranked (see candidate_ranking.py) and downloaded best
+    first; the first PDF whose first page carries the reference's title is
+    kept and the rest are skipped. If no PDF verifies, the best-ranked one
+    that downloaded is kept instead. With fetch_all_candidates set in
+    [crawl], every PDF is kept as before.
+
+    Hosts whose circuit breaker is open are skipped, and each download's
+    timeout follows its host's latency (see host_health.py).
+
+    Returns:
+        tuple: File IDs downloaded, whether any candidate was downloaded or
+            is already in the database, the failed downloads, and whether the
+            depth's paper budget ran out before every candidate was tried
+    """
+    fetch_all = bool(frontier.config.get('fetch_all_candidates'))
+    health = get_host_health()
+    threshold = float(frontier.config.get('title_match_threshold', 0.6))
+    downloaded_files = []
+    failed_downloads = []
+    found = False
+    out_of_papers = False
+    unverified = None
+    ranked = results if fetch_all else rank_candidates(results, reference_title)
+    for rank, result in enumerate(ranked):
+        if found and not fetch_all:
+            metrics.add('crawl_candidates_skipped_total', len(ranked) - rank)
+            break
+        url = result['url']
+        title = result['title'] or reference_title
+
+        # Check if URL was already processed
+        existing_docs = db.collection('pdf_files').where('source_url', '==', url).limit(1).stream()
+        if any(existing_docs):
+            ui.info(f'PDF from {url} already exists in database, skipping...')
+            found = True
+            continue
+        if not frontier.has_budget(depth, papers=1):
+            ui.warning(f"Paper budget for depth {depth} is used up, not downloading {url}")
+            out_of_papers = True
+            break
+        if not health.allow(url):
+            ui.info(f'Skipping {url}: {host_of(url)} has been failing, see the host health table')
+            metrics.add('crawl_hosts_skipped_total')
+            continue
+
+        timeout = health.timeout(url)
+        try:
+            # Download and save PDF with the host's timeout
+            with ui.spinner(f'Downloading PDF from {url}...'):
+                started = time.monotonic()
+                response = get_http_client().get(url, timeout=timeout)
+                record_bytes(downloaded=len(response.content))
+                if response.status_code >= 500:
+                    health.record_failure(url, f'HTTP {response.status_code}')
+                else:
+                    health.record_success(url, time.monotonic() - started)
+                if response.status_code == 200 and response.headers.get('content-type', '').lower() == 'application/pdf':
+                    if not fetch_all and reference_title:
+                        matches = pdf_matches_title(response.content, reference_title, threshold)
+                        if matches is None:
+                            # No text on the first page; trust the candidate's own title
+                            matches = title_similarity(result['title'], reference_title) >= threshold
+                        if not matches:
+                            ui.info(f'PDF from {url} does not look like "{reference_title}", trying the next result...')
+                            metrics.add('crawl_unverified_pdfs_total')
+                            unverified = unverified or (url, title, response.content)
+                            continue
+                    downloaded_files.append(_save_pdf(db, doc, url, title, response.content, depth, frontier, ui))
+                    found = True
+        except httpx.TimeoutException:
+            health.record_failure(url, 'Timeout')
+            ui.error(f'Timeout downloading PDF from {url} after {timeout.read:.0f} seconds')
+            failed_downloads.append({
+                'url': url,
+                'error': f'Download timeout after {timeout.read:.0f} seconds',
+                'timestamp': datetime.datetime.now().isoformat()
+            })
+            continue
+        except Exception as e:
+            if isinstance(e, httpx.TransportError):
+                health.record_failure(url, e)
+            ui.error(f'Error downloading PDF from {url}: {str(e)}')
+            failed_downloads.append({
+                'url': url,
+                'error': str(e),
+                'timestamp': datetime.datetime.now().isoformat()
+            })
+    if not found and unverified:
+        url, title, content = unverified
+        downloaded_files.append(_save_pdf(db, doc, url, title, content, depth, frontier, ui))
+        found = True
+    return downloaded_files, found, failed_downloads, out_of_papers
+
+def _save_pdf(db, doc, url: str, title: str, content: bytes, depth: int, frontier, ui) -> str:
+    """Store a downloaded PDF and add its pdf_files record; returns the file ID"""
+    # Generate file ID from URL
+    file_id = f"{hashlib.md5(url.encode()).hexdigest()}.pdf"
+
+    # Save to Firebase Storage straight from the downloaded content
+    upload_pdf_to_storage(io.BytesIO(content), file_id)
+
+    # Add record to Firestore with source URL and title
+    db.collection('pdf_files').add({
+        'file_id': file_id,
+        'title': title,  # Title from the search result or the reference
+        'status': 'Initial',
+        'depth': depth,  # The reference already sits one level below its source paper
+        'source_url': url,
+        'source_reference': doc.id,  # Reference to the source reference document
+        'created_timestamp': firestore.SERVER_TIMESTAMP,
+        'updated_timestamp': firestore.SERVER_TIMESTAMP
+    })
+
+    frontier.charge(depth, papers=1)
+    ui.success(f'Successfully downloaded and saved PDF: {file_id}')
+    return file_id
+
+def generate_triplets(group: str, limit: int, worker_id: str, llm, ui=ConsoleUI(),
+                      concurrency: int = TRIPLET_CONCURRENCY) -> int:
+    """Generate triplets of a group (see TRIPLET_GROUPS) for qualified papers marked ToProcess.
+
+    The claimed papers' texts are loaded up front, from text segments where
+    they have been packed. Up to `concurrency` papers then wait on the LLM
+    at once: each paper runs as its own task, the group's LLMStage is
+    awaited and the triplets are saved as soon as they arrive. A failing
+    paper is marked failed without affecting the others. The papers run on
+    the process's shared event loop, where the cached chat model's async
+    connections live; blocking Firestore and Storage calls run in worker
+    threads, and messages are shown from the calling thread, which
+    Streamlit requires.
+
+    Returns:
+        int: Number of papers with triplets
+    """
+    stage = STAGES[group]
+    db = get_db()
+    _requeue_retries(db, group, ui)
+    # Get qualified papers marked for triplet processing
+    query = db.collection('pdf_files')
+    query = query.where(group, '==', 'ToProcess')
+    query = query.where('qualified', '==', True)
+    papers = claim_documents(db, lambda count: list(query.limit(count).stream()), group, limit, worker_id,
+                             eligible=lambda data: data.get(group) == 'ToProcess' and data.get('qualified') is True)
+
+    if not papers:
+        ui.info(f'No qualified documents marked for triplet processing. Documents must be both qualified and have {group}="ToProcess".')
+        return 0
+
+    # Papers not finished yet, whose leases keep_alive() renews
+    pending = {doc.id: doc for doc in papers}
+
+    async def process(doc, semaphore, ui) -> bool:
+        async with semaphore:
+            if not await asyncio.to_thread(papers.keep_alive, list(pending.values())):
+                if pending.pop(doc.id, None) is not None and doc.reference.path not in papers.lost:
+                    papers.release([doc])
+                return False
+            timer = DocumentTimer(group)
+            file_data = doc.to_dict()
+            try:
+                ui.write(f"Processing triplets for: {file_data.get('title', file_data['file_id'])}")
+
+                if doc.id in text_errors:
+                    raise text_errors[doc.id]
+                text_content = texts[doc.id]
+
+                # Generate triplets
+                triplets = await stage.arun(text_content, llm)
+                if doc.reference.path in papers.lost:
+                    # The lease ran out during the LLM call and another worker has the paper now
+                    timer.finish()
+                    return False
+                found = await asyncio.to_thread(save_triplets, db, group, doc.id, file_data, triplets)
+                pending.pop(doc.id, None)
+                timer.finish()
+                return found
+            except Exception as e:
+                timer.finish(error=e)
+                ui.error(f"Error processing {stage.title} for {file_data.get('file_id', 'unknown file')}: {str(e)}")
+                await asyncio.to_thread(update_pdf_record, doc.id, {
+                    **failure_updates(group, file_data, e, retry_value='ToProcess'),
+                    'triplet_error': str(e),
+                    'updated_timestamp': firestore.SERVER_TIMESTAMP,
+                    **release_lease(group)
+                })
+                pending.pop(doc.id, None)
+                return False
+
+    async def run(ui):
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        return await asyncio.gather(*(process(doc, semaphore, ui) for doc in papers))
+
+    # Get the text content of every claimed paper
+    texts, text_errors = load_texts(list(papers))
+
+    processed = sum(_run_on_event_loop(run, ui))
+    if papers.lost:
+        ui.warning(f'Another worker took over {len(papers.lost)} paper(s) whose lease ran out; stopped early.')
+    if processed > 0:
+        ui.success(f'Generated triplets for {processed} document(s).')
+    return processed
+
+def triplet_group_a(limit: int, worker_id: str, llm, ui=ConsoleUI(),
+                    concurrency: int = TRIPLET_CONCURRENCY) -> int:
+    """Generate Group A triplets (see generate_triplets)"""
+    return generate_triplets('triplet_group_a', limit, worker_id, llm, ui, concurrency)
+
+def triplet_group_b(limit: int, worker_id: str, llm, ui=ConsoleUI(),
+                    concurrency: int = TRIPLET_CONCURRENCY) -> int:
+    """Generate Group B triplets (see generate_triplets)"""
+    return generate_triplets('triplet_group_b', limit, worker_id, llm, ui, concurrency)
+
+def save_triplets(db, group: str, doc_id: str, file_data: dict, triplets) -> bool:
+    """Store a paper's triplets in the group's collection and mark it processed; returns whether any were found"""
+    # Only proceed if we found triplets
+    if triplets and triplets.triplets:
+        # Store each triplet as a separate row, with every field of the group's schema
+        for triplet in triplets.triplets:
+            db.collection(STAGES[group].output_collection).add({
+                'pdf_id': doc_id,
+                'file_id': file_data['file_id'],
+                'title': file_data.get('title', ''),
+                **triplet.model_dump(),
+                'subject_id': normalize_entity(triplet.subject),
+                'object_id': normalize_entity(triplet.object),
+                'created_timestamp': firestore.SERVER_TIMESTAMP
+            })
+
+        # Update the original document
+        update_pdf_record(doc_id, {
+            group: 'Processed',
+            'triplet_count': len(triplets.triplets),
+            'updated_timestamp': firestore.SERVER_TIMESTAMP,
+            **reset_retry(group),
+            **release_lease(group)
+        })
+        return True
+    # No triplets found, mark as processed but empty
+    update_pdf_record(doc_id, {
+        group: 'ProcessedEmpty',
+        'triplet_count': 0,
+        'updated_timestamp': firestore.SERVER_TIMESTAMP,
+        **reset_retry(group),
+        **release_lease(group)
+    })
+    return False
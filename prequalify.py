@@ -0,0 +1,359 @@
+import argparse
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+
+# Local first pass for paper qualification: a TF-IDF logistic regression
+# trained on the LLM's past decisions in pdf_files. Papers it scores
+# confidently are accepted or rejected without an LLM call; the uncertain
+# middle band still goes to qualify_paper. Retrain with:
+#
+#   python -m prequalify train
+#   python -m prequalify report
+
+# Where the trained model is kept in Firebase Storage
+MODEL_PATH = 'models/prequalify.json'
+
+# Override in the optional [prequalify] section of secrets.toml
+DEFAULT_PREQUALIFY_CONFIG = {
+    'enabled': True,
+    # Cross-validated precision local accepts and rejects must reach
+    'target_precision': 0.97,
+    # Share of confident papers still sent to the LLM, to keep measuring precision
+    'audit_fraction': 0.05,
+    # Fewer LLM-labelled papers than this (or than a tenth of it in either class) won't train
+    'min_labels': 60,
+    'max_features': 5000,
+    # Characters read from the start of each paper
+    'text_chars': 20000,
+    # How long a loaded model is used before checking Storage for a newer one
+    'refresh_seconds': 600,
+}
+
+FOLDS = 5
+
+_WORD = re.compile(r"[a-z][a-z\-]{2,}")
+_STOPWORDS = set("""
+the and for are but not you all any can had her was one our out has him his how its may new now old see two
+who did get let say she too use that with have this will your from they know want been good much some time very
+when come here just like long make many more only over such take than them well were what also into most other
+their there these which would about after could first those where while should through between each both same
+""".split())
+
+def load_prequalify_config() -> dict:
+    """Pre-qualifier settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_PREQUALIFY_CONFIG)
+    try:
+        import streamlit as st
+        if 'prequalify' in st.secrets:
+            config.update(dict(st.secrets['prequalify']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def tokenize(text: str) -> list:
+    """Lowercase words and adjacent word pairs, without stopwords"""
+    words = [word.strip('-') for word in _WORD.findall(text.lower())]
+    words = [word for word in words if len(word) > 2 and word not in _STOPWORDS]
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+def _sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+def _fit_logistic(X: np.ndarray, y: np.ndarray, l2: float = 1e-3, iterations: int = 300,
+                  learning_rate: float = 2.0):
+    """Class-balanced L2 logistic regression by gradient descent on row-normalized features"""
+    n = len(y)
+    positives = max(int(y.sum()), 1)
+    negatives = max(n - int(y.sum()), 1)
+    sample_weight = np.where(y == 1, n / (2 * positives), n / (2 * negatives))
+    weights = np.zeros(X.shape[1])
+    bias = 0.0
+    for _ in range(iterations):
+        error = (_sigmoid(X @ weights + bias) - y) * sample_weight
+        weights -= learning_rate * (X.T @ error / n + l2 * weights)
+        bias -= learning_rate * error.mean()
+    return weights, bias
+
+def _threshold(scores: np.ndarray, labels: np.ndarray, target: float, accept: bool):
+    """Loosest cut-off whose decisions agree with the labels at least `target` of the time.
+
+    For accepts this is the lowest score t such that papers scoring >= t are
+    relevant with precision >= target; for rejects, the highest t such that
+    papers scoring <= t are irrelevant with precision >= target. None if no
+    cut-off is precise enough.
+    """
+    order = np.argsort(-scores if accept else scores, kind='stable')
+    correct = labels[order] if accept else 1 - labels[order]
+    precision = np.cumsum(correct) / np.arange(1, len(order) + 1)
+    ok = np.nonzero(precision >= target)[0]
+    if not len(ok):
+        return None
+    return float(scores[order][ok[-1]])
+
+def _decision_stats(scores, labels, accept_threshold, reject_threshold) -> dict:
+    accepted = scores >= accept_threshold if accept_threshold is not None else np.zeros(len(scores), bool)
+    rejected = scores <= reject_threshold if reject_threshold is not None else np.zeros(len(scores), bool)
+
+    def precision(mask, label):
+        return float((labels[mask] == label).mean()) if mask.any() else None
+
+    return {
+        'papers': int(len(labels)),
+        'accepted': int(accepted.sum()),
+        'accept_precision': precision(accepted, 1),
+        'rejected': int(rejected.sum()),
+        'reject_precision': precision(rejected, 0),
+        'coverage': float((accepted | rejected).mean()) if len(labels) else 0.0,
+    }
+
+class Prequalifier:
+    """TF-IDF logistic regression over paper text with accept/reject cut-offs.
+
+    Scores at or above accept_threshold are qualified and scores at or
+    below reject_threshold are rejected without the LLM; anything between
+    (or either side whose cut-off is None) is left to the LLM.
+    """
+
+    def __init__(self, vocabulary: dict, idf, weights, bias: float, accept_threshold=None,
+                 reject_threshold=None, text_chars: int = 20000, report: dict = None, trained_at: str = ''):
+        self.vocabulary = vocabulary
+        self.idf = np.asarray(idf, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.text_chars = text_chars
+        self.report = report or {}
+        self.trained_at = trained_at
+
+    @staticmethod
+    def _vectorize(texts: list, vocabulary: dict, idf: np.ndarray, text_chars: int) -> np.ndarray:
+        X = np.zeros((len(texts), len(vocabulary)), dtype=float)
+        for row, text in enumerate(texts):
+            for term, count in Counter(tokenize(text[:text_chars])).items():
+                column = vocabulary.get(term)
+                if column is not None:
+                    X[row, column] = 1 + math.log(count)
+        X *= idf
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return X / np.where(norms > 0, norms, 1)
+
+    @classmethod
+    def _fit(cls, texts: list, labels: np.ndarray, max_features: int, text_chars: int):
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(tokenize(text[:text_chars])))
+        # Terms seen in at least two papers, most common first
+        terms = [term for term, df in document_frequency.most_common() if df >= 2][:max_features]
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        idf = np.array([math.log((1 + len(texts)) / (1 + document_frequency[term])) + 1 for term in terms])
+        weights, bias = _fit_logistic(cls._vectorize(texts, vocabulary, idf, text_chars), labels)
+        return vocabulary, idf, weights, bias
+
+    @classmethod
+    def train(cls, texts: list, labels: list, config: dict = None) -> 'Prequalifier':
+        """Train on paper texts and the LLM's qualified decisions.
+
+        Cut-offs are picked from cross-validated scores so that local
+        decisions agree with the LLM at the configured target precision;
+        the final model is then fitted on all papers.
+
+        Args:
+            texts (list): Paper texts
+            labels (list): The LLM's qualified decision for each text
+            config (dict): Settings (see DEFAULT_PREQUALIFY_CONFIG)
+
+        Returns:
+            Prequalifier: The trained model, with its cross-validation report
+        """
+        config = {**DEFAULT_PREQUALIFY_CONFIG, **(config or {})}
+        y = np.array([1 if label else 0 for label in labels])
+        minimum = int(config['min_labels'])
+        if len(y) < minimum or min(y.sum(), len(y) - y.sum()) < max(minimum // 10, 2):
+            raise ValueError(f"Need at least {minimum} LLM-qualified papers with both outcomes to train "
+                             f"(have {int(y.sum())} relevant, {int(len(y) - y.sum())} not relevant)")
+
+        # Out-of-fold scores for every paper
+        folds = np.random.default_rng(0).permutation(len(y)) % FOLDS
+        scores = np.zeros(len(y))
+        for fold in range(FOLDS):
+            train, test = folds != fold, folds == fold
+            vocabulary, idf, weights, bias = cls._fit([texts[i] for i in np.nonzero(train)[0]], y[train],
+                                                      int(config['max_features']), int(config['text_chars']))
+            X = cls._vectorize([texts[i] for i in np.nonzero(test)[0]], vocabulary, idf, int(config['text_chars']))
+            scores[test] = _sigmoid(X @ weights + bias)
+
+        target = float(config['target_precision'])
+        accept_threshold = _threshold(scores, y, target, accept=True)
+        reject_threshold = _threshold(scores, y, target, accept=False)
+        if accept_threshold is not None and reject_threshold is not None and reject_threshold >= accept_threshold:
+            # Too noisy to separate; leave every paper to the LLM
+            accept_threshold = reject_threshold = None
+
+        report = _decision_stats(scores, y, accept_threshold, reject_threshold)
+        report.update(relevant=int(y.sum()), target_precision=target)
+        vocabulary, idf, weights, bias = cls._fit(texts, y, int(config['max_features']), int(config['text_chars']))
+        return cls(vocabulary, idf, weights, bias, accept_threshold, reject_threshold, int(config['text_chars']),
+                   report, datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+    def score(self, text: str) -> float:
+        """Probability that the LLM would qualify the paper"""
+        X = self._vectorize([text], self.vocabulary, self.idf, self.text_chars)
+        return float(_sigmoid(X @ self.weights + self.bias)[0])
+
+    def decide(self, text: str):
+        """(True, False or None if uncertain, score) for a paper's text"""
+        score = self.score(text)
+        if self.accept_threshold is not None and score >= self.accept_threshold:
+            return True, score
+        if self.reject_threshold is not None and score <= self.reject_threshold:
+            return False, score
+        return None, score
+
+    def to_dict(self) -> dict:
+        return {
+            'terms': sorted(self.vocabulary, key=self.vocabulary.get),
+            'idf': self.idf.tolist(),
+            'weights': self.weights.tolist(),
+            'bias': self.bias,
+            'accept_threshold': self.accept_threshold,
+            'reject_threshold': self.reject_threshold,
+            'text_chars': self.text_chars,
+            'report': self.report,
+            'trained_at': self.trained_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Prequalifier':
+        return cls({term: i for i, term in enumerate(data['terms'])}, data['idf'], data['weights'], data['bias'],
+                   data.get('accept_threshold'), data.get('reject_threshold'), data.get('text_chars', 20000),
+                   data.get('report'), data.get('trained_at', ''))
+
+def is_audited(doc_id: str, audit_fraction: float) -> bool:
+    """Whether a confidently scored paper is sent to the LLM anyway (stable per paper)"""
+    return zlib.crc32(doc_id.encode()) % 10000 < audit_fraction * 10000
+
+# Loaded model, shared by every session in the process
+_loaded = {'model': None, 'at': 0.0}
+_load_lock = threading.Lock()
+
+def save_prequalifier(model: Prequalifier):
+    """Store a trained model in Firebase Storage and use it in this process"""
+    from firebase_utils import get_bucket
+
+    get_bucket().blob(MODEL_PATH).upload_from_string(json.dumps(model.to_dict()), content_type='application/json')
+    with _load_lock:
+        _loaded.update(model=model, at=time.monotonic())
+
+def load_prequalifier(config: dict = None):
+    """The trained model from Firebase Storage, or None if disabled or not trained yet.
+
+    The model is kept in memory and checked for updates every
+    refresh_seconds, so retraining from another process is picked up.
+    """
+    from firebase_utils import get_bucket
+
+    config = config or load_prequalify_config()
+    if not config['enabled']:
+        return None
+    with _load_lock:
+        if _loaded['at'] and time.monotonic() - _loaded['at'] < float(config['refresh_seconds']):
+            return _loaded['model']
+        model = None
+        try:
+            blob = get_bucket().blob(MODEL_PATH)
+            if blob.exists():
+                model = Prequalifier.from_dict(json.loads(blob.download_as_text()))
+        except Exception as e:
+            print(f"Could not load the pre-qualifier, sending every paper to the LLM: {e}")
+        _loaded.update(model=model, at=time.monotonic())
+        return model
+
+def _llm_labelled(db) -> list:
+    """pdf_files the LLM has qualified (papers decided locally aren't training data)"""
+    docs = db.collection('pdf_files').where('qualified', 'in', [True, False]).stream()
+    return [doc for doc in docs if doc.to_dict().get('qualification_source', 'llm') == 'llm']
+
+def train_prequalifier(db, config: dict = None, max_workers: int = 8) -> Prequalifier:
+    """Train a model on every LLM-qualified paper in pdf_files and save it.
+
+    Args:
+        db: Firestore client
+        config (dict): Settings (default from secrets.toml)
+        max_workers (int): Concurrent text downloads
+
+    Returns:
+        Prequalifier: The saved model; its report has the cross-validated precision
+    """
+    from firebase_utils import download_text_from_storage
+
+    config = config or load_prequalify_config()
+    docs = _llm_labelled(db)
+
+    def fetch(doc):
+        try:
+            return download_text_from_storage(doc.to_dict()['file_id'])[:int(config['text_chars'])]
+        except Exception as e:
+            print(f"Skipping {doc.id}, no text: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        texts = list(pool.map(fetch, docs))
+    labelled = [(text, doc.to_dict()['qualified']) for doc, text in zip(docs, texts) if text]
+    model = Prequalifier.train([text for text, _ in labelled], [label for _, label in labelled], config)
+    save_prequalifier(model)
+    return model
+
+def prequalify_report(db) -> dict:
+    """Precision of the model's confident decisions against the LLM's, on audited papers.
+
+    Returns:
+        dict: For 'accept' and 'reject', the audited papers and how many the LLM agreed with
+    """
+    report = {'accept': {'papers': 0, 'agreed': 0}, 'reject': {'papers': 0, 'agreed': 0}}
+    for doc in _llm_labelled(db):
+        data = doc.to_dict()
+        decision = (data.get('prequalify') or {}).get('decision')
+        if decision is None:
+            continue
+        counts = report['accept' if decision else 'reject']
+        counts['papers'] += 1
+        counts['agreed'] += int(data['qualified'] == decision)
+    for counts in report.values():
+        counts['precision'] = counts['agreed'] / counts['papers'] if counts['papers'] else None
+    return report
+
+def _percent(value) -> str:
+    return f'{value:.1%}' if value is not None else 'n/a'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m prequalify',
+                                     description='Train or check the local pre-qualification model.')
+    parser.add_argument('command', choices=['train', 'report'],
+                        help='train on LLM decisions in pdf_files, or report precision on audited papers')
+    args = parser.parse_args(argv)
+
+    from firebase_utils import get_db
+
+    if args.command == 'train':
+        report = train_prequalifier(get_db()).report
+        print(f"Trained on {report['papers']} papers ({report['relevant']} relevant)")
+        print(f"Cross-validated: accepts {report['accepted']} at {_percent(report['accept_precision'])} precision, "
+              f"rejects {report['rejected']} at {_percent(report['reject_precision'])} precision; "
+              f"{report['coverage']:.0%} of papers decided without the LLM")
+    else:
+        for side, counts in prequalify_report(get_db()).items():
+            print(f"{side}: {counts['agreed']} of {counts['papers']} audited papers agreed with the LLM "
+                  f"({_percent(counts['precision'])})")
+
+if __name__ == '__main__':
+    main()
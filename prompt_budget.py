@@ -0,0 +1,211 @@
+import re
+from functools import lru_cache
+from rate_limiter import estimate_tokens
+
+# Context window and maximum output tokens per model, matched by longest prefix.
+# Add models in the [prompt_budget.context_windows] section of secrets.toml.
+MODEL_LIMITS = {
+    'gpt-5': (400000, 128000),
+    'gpt-4.1': (1047576, 32768),
+    'gpt-4o': (128000, 16384),
+    'gpt-4-turbo': (128000, 4096),
+    'gpt-4-0125-preview': (128000, 4096),
+    'gpt-4-1106-preview': (128000, 4096),
+    'gpt-4-32k': (32768, 4096),
+    'gpt-4': (8192, 4096),
+    'gpt-3.5-turbo': (16385, 4096),
+    'o1': (200000, 100000),
+    'o3': (200000, 100000),
+    'o4-mini': (200000, 100000),
+}
+DEFAULT_MODEL_LIMITS = (8192, 4096)
+
+# Per prompt: output tokens to leave room for, an optional cap on the paper
+# text (qualification only needs the opening of a paper), and which part of
+# the text to keep when it doesn't fit
+DEFAULT_PROMPT_BUDGETS = {
+    'qualify': {'output_tokens': 500, 'max_text_tokens': 1000, 'keep': 'head'},
+    'triplets': {'output_tokens': 4096, 'max_text_tokens': 0, 'keep': 'head'},
+    'references': {'output_tokens': 4096, 'max_text_tokens': 0, 'keep': 'references'},
+}
+
+# Slack for message framing and tokenizer differences
+SAFETY_MARGIN_TOKENS = 256
+
+_REFERENCE_HEADING = re.compile(r'^\s*(references|bibliography|works cited|literature cited)\s*:?\s*$',
+                                re.IGNORECASE | re.MULTILINE)
+
+def _secrets_section(name: str) -> dict:
+    try:
+        import streamlit as st
+        if name in st.secrets:
+            return {key: value for key, value in st.secrets[name].items()}
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return {}
+
+@lru_cache(maxsize=None)
+def load_prompt_budgets() -> dict:
+    """Prompt budgets and model limits, with overrides from secrets.toml if present.
+
+    Example:
+        [prompt_budget]
+        qualify_text_tokens = 2000
+        triplets_output_tokens = 8000
+
+        [prompt_budget.context_windows]
+        "my-fine-tuned-model" = 32768
+    """
+    overrides = _secrets_section('prompt_budget')
+    budgets = {task: dict(values) for task, values in DEFAULT_PROMPT_BUDGETS.items()}
+    for task, values in budgets.items():
+        if f'{task}_output_tokens' in overrides:
+            values['output_tokens'] = int(overrides[f'{task}_output_tokens'])
+        if f'{task}_text_tokens' in overrides:
+            values['max_text_tokens'] = int(overrides[f'{task}_text_tokens'])
+    context_windows = {model: int(tokens) for model, tokens in dict(overrides.get('context_windows', {})).items()}
+    return {'tasks': budgets, 'context_windows': context_windows}
+
+def model_name(llm) -> str:
+    """Model name of a LangChain chat model, or '' if unknown"""
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or ''
+
+def model_limits(model: str) -> tuple:
+    """(context window, maximum output tokens) for a model name"""
+    context_windows = load_prompt_budgets()['context_windows']
+    if model in context_windows:
+        return context_windows[model], DEFAULT_MODEL_LIMITS[1]
+    matches = [prefix for prefix in MODEL_LIMITS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_MODEL_LIMITS
+    return MODEL_LIMITS[max(matches, key=len)]
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """The model's tiktoken encoding, or None if it can't be loaded (e.g. offline)"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        print(f"No tokenizer for {model or 'unknown model'}, estimating tokens: {e}")
+        return None
+
+def count_tokens(text: str, model: str = '') -> int:
+    """Tokens in text for the model's tokenizer (estimated if it isn't available)"""
+    encoding = _encoding(model) if model else None
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _truncate(text: str, max_tokens: int, model: str, keep: str) -> str:
+    if max_tokens <= 0:
+        return ''
+    encoding = _encoding(model) if model else None
+    if encoding is None:
+        # estimate_tokens counts about 4 characters per token
+        chars = max_tokens * 4
+        return text[:chars] if keep == 'head' else text[-chars:]
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens] if keep == 'head' else tokens[-max_tokens:])
+
+def fit_text(text: str, max_tokens: int, model: str = '', keep: str = 'head') -> str:
+    """Cut text to at most max_tokens tokens.
+
+    Args:
+        text (str): Text to fit
+        max_tokens (int): Token budget for the text
+        model (str): Model whose tokenizer counts the tokens
+        keep (str): 'head' keeps the start, 'tail' the end, and 'references'
+            keeps the reference list (the end of the paper, or the start of
+            the list if the list alone is too long)
+
+    Returns:
+        str: The text, or the part of it that fits
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    if keep == 'references':
+        headings = list(_REFERENCE_HEADING.finditer(text))
+        if headings and count_tokens(text[headings[-1].start():], model) > max_tokens:
+            return _truncate(text[headings[-1].start():], max_tokens, model, 'head')
+        keep = 'tail'
+    return _truncate(text, max_tokens, model, keep)
+
+def text_budget(llm, task: str, template_tokens: int = 0) -> int:
+    """Tokens of paper text a task's prompt can hold on the llm's model"""
+    budget = load_prompt_budgets()['tasks'][task]
+    context_window, max_output = model_limits(model_name(llm))
+    available = context_window - template_tokens - min(budget['output_tokens'], max_output) - SAFETY_MARGIN_TOKENS
+    if budget['max_text_tokens']:
+        available = min(available, budget['max_text_tokens'])
+    return max(available, 0)
+
+def output_tokens(llm, task: str) -> int:
+    """Output tokens reserved for a task on the llm's model"""
+    return min(load_prompt_budgets()['tasks'][task]['output_tokens'], model_limits(model_name(llm))[1])
+
+def build_prompt(llm, task: str, before: str, text: str, after: str = '', template_tokens: int = None) -> str:
+    """before + text + after, with the text cut to what the model's context allows.
+
+    Args:
+        llm: Chat model the prompt is for (its model name picks the limits)
+        task (str): One of 'qualify', 'triplets' or 'references'
+        before (str): Instructions preceding the paper text
+        text (str): Paper text
+        after (str): Anything following the text, e.g. format instructions
+        template_tokens (int): Tokens of before + after, if already counted
+
+    Returns:
+        str: The full prompt
+    """
+    model = model_name(llm)
+    if template_tokens is None:
+        template_tokens = count_tokens(before + after, model)
+    budget = text_budget(llm, task, template_tokens)
+    keep = load_prompt_budgets()['tasks'][task]['keep']
+    return before + fit_text(text, budget, model, keep) + after
+
+def batch_size_limit(llm, task: str) -> int:
+    """Most texts one request can hold while leaving each its output tokens"""
+    return max(1, model_limits(model_name(llm))[1] // load_prompt_budgets()['tasks'][task]['output_tokens'])
+
+def batch_output_tokens(llm, task: str, count: int) -> int:
+    """Output tokens reserved for a request covering `count` texts"""
+    return min(load_prompt_budgets()['tasks'][task]['output_tokens'] * count, model_limits(model_name(llm))[1])
+
+def build_batch_prompt(llm, task: str, before: str, texts: dict, after: str = '') -> str:
+    """Like build_prompt, for several texts sharing one request.
+
+    After reserving output tokens for every text, each gets an equal share
+    of the remaining context (still capped at the task's max_text_tokens)
+    and is introduced by a `=== Paper <key> ===` header.
+
+    Args:
+        llm: Chat model the prompt is for
+        task (str): One of the tasks in DEFAULT_PROMPT_BUDGETS
+        before (str): Instructions preceding the texts
+        texts (dict): Text by key; keys are shown to the model
+        after (str): Anything following the texts, e.g. format instructions
+
+    Returns:
+        str: The full prompt
+    """
+    model = model_name(llm)
+    budget = load_prompt_budgets()['tasks'][task]
+    context_window = model_limits(model)[0]
+    headers = {key: f"\n=== Paper {key} ===\n" for key in texts}
+    template_tokens = count_tokens(before + after + ''.join(headers.values()), model)
+    available = context_window - template_tokens - batch_output_tokens(llm, task, len(texts)) - SAFETY_MARGIN_TOKENS
+    share = max(available // max(len(texts), 1), 0)
+    if budget['max_text_tokens']:
+        share = min(share, budget['max_text_tokens'])
+    return before + ''.join(headers[key] + fit_text(text, share, model, budget['keep'])
+                            for key, text in texts.items()) + after
+
+def prompt_text_tokens(llm, task: str, text: str) -> int:
+    """Approximate tokens of `text` a task's prompt will include, for budgeting"""
+    return min(count_tokens(text, model_name(llm)), text_budget(llm, task))
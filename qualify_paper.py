@@ -1,50 +1,84 @@
-from langchain_openai import ChatOpenAI
-from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
-from typing import List
-
-class PaperQualification(BaseModel):
-    is_relevant: bool = Field(description="Whether the paper is relevant to consumer behavior and persuasion")
-    topics_found: List[str] = Field(description="List of relevant topics found in the paper")
-    confidence: float = Field(description="Confidence score between 0 and 1")
-    reasoning: str = Field(description="Brief explanation of why the paper is or isn't relevant")
-
-def qualify_paper(text: str, llm: ChatOpenAI) -> bool:
+from typing import TYPE_CHECKING
+from prompt_budget import batch_size_limit
+from llm_stages import QUALIFY, QUALIFY_BATCH, PaperQualification
+
+if TYPE_CHECKING:
+    # Only for type hints; LangChain is imported when a prompt is first built
+    from langchain_openai import ChatOpenAI
+
+# Papers packed into one batched qualification request (fewer if the model's
+# output limit can't hold that many answers)
+QUALIFY_BATCH_SIZE = 8
+
+def _is_qualified(qualification: PaperQualification) -> bool:
+    # Consider it relevant if confidence is high enough and it's marked as relevant
+    return qualification.is_relevant and qualification.confidence >= 0.7
+
+def qualify_paper(text: str, llm: 'ChatOpenAI') -> bool:
     """Qualify a paper by checking if it deals with topics of consumer behavior and persuasion.
-    
+
     Args:
         text (str): The text content of the paper
         llm (ChatOpenAI): The language model to use for analysis
-        
+
     Returns:
-        bool: True if the paper is relevant, False otherwise
+        bool: True if the paper is relevant, False otherwise (including when
+            the LLM's answer can't be parsed)
     """
-    # Create parser for structured output
-    parser = PydanticOutputParser(pydantic_object=PaperQualification)
-    
-    # Create prompt template
-    prompt = f"""Analyze the following academic paper text and determine if it's relevant to consumer behavior and persuasion.
-Focus on topics like:
-- Consumer decision making
-- Persuasion techniques
-- Marketing influence
-- Social media influence
-- Behavioral economics
-- Consumer psychology
-
-Text of the paper:
-{text[:2000]}...
-
-{parser.get_format_instructions()}
-"""
-    
-    # Get structured response from LLM
-    result = llm.invoke(prompt)
+    qualification = QUALIFY.run(text, llm)
+    return qualification is not None and _is_qualified(qualification)
+
+def qualify_paper_batch(papers: dict, llm: 'ChatOpenAI', batch_size: int = QUALIFY_BATCH_SIZE) -> dict:
+    """Qualify several papers, packing up to batch_size excerpts into each request.
+
+    The instructions and format instructions are sent once per request
+    instead of once per paper. A batch whose response can't be parsed, or
+    that leaves papers out, is split in half and retried; a single paper
+    falls back to qualify_paper. Other errors (rate limits, timeouts,
+    outages) are raised, so the papers go through the retry queue instead
+    of being split into ever more requests.
+
+    Args:
+        papers (dict): Text content by paper ID
+        llm (ChatOpenAI): The language model to use for analysis
+        batch_size (int): Most papers per request
+
+    Returns:
+        dict: True if the paper is relevant, False otherwise, by paper ID
+    """
+    batch_size = max(1, min(batch_size, batch_size_limit(llm, 'qualify')))
+    paper_ids = list(papers)
+    results = {}
+    for start in range(0, len(paper_ids), batch_size):
+        results.update(_qualify_batch({paper_id: papers[paper_id]
+                                       for paper_id in paper_ids[start:start + batch_size]}, llm))
+    return results
+
+def _qualify_batch(papers: dict, llm: 'ChatOpenAI') -> dict:
+    from langchain_core.exceptions import OutputParserException
+    from pydantic import ValidationError
+
+    if len(papers) == 1:
+        paper_id, text = next(iter(papers.items()))
+        return {paper_id: qualify_paper(text, llm)}
+
+    # Short positional keys are harder for the model to garble than document IDs
+    keys = {f'P{i + 1}': paper_id for i, paper_id in enumerate(papers)}
+
     try:
-        qualification = parser.parse(result.content)
-        # Consider it relevant if confidence is high enough and it's marked as relevant
-        return qualification.is_relevant and qualification.confidence >= 0.7
-    except Exception as e:
-        print(f"Error parsing LLM response: {e}")
-        # Default to False if we can't parse the response
-        return False    
\ No newline at end of file
+        batch = QUALIFY_BATCH.run_batch({key: papers[paper_id] for key, paper_id in keys.items()}, llm)
+        qualifications = {q.paper_id.strip(): q for q in batch.papers}
+    except (OutputParserException, ValidationError) as e:
+        print(f"Error parsing batched LLM response for {len(papers)} papers, splitting: {e}")
+        paper_ids = list(papers)
+        half = len(paper_ids) // 2
+        results = _qualify_batch({paper_id: papers[paper_id] for paper_id in paper_ids[:half]}, llm)
+        results.update(_qualify_batch({paper_id: papers[paper_id] for paper_id in paper_ids[half:]}, llm))
+        return results
+
+    results = {paper_id: _is_qualified(qualifications[key]) for key, paper_id in keys.items() if key in qualifications}
+    missing = {paper_id: papers[paper_id] for paper_id in papers if paper_id not in results}
+    if missing:
+        print(f"Batched LLM response left out {len(missing)} of {len(papers)} papers, retrying them")
+        results.update(qualify_paper_batch(missing, llm, max(1, len(missing) // 2)))
+    return results
@@ -0,0 +1,294 @@
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pipeline_metrics import record_llm_usage, metrics
+
+# Default quotas per provider; override in the [rate_limits.<provider>] sections of secrets.toml
+DEFAULT_RATE_LIMITS = {
+    'openai': {'requests_per_minute': 500, 'tokens_per_minute': 200000},
+    'google_cse': {'requests_per_minute': 100, 'tokens_per_minute': 0},
+    'tavily': {'requests_per_minute': 100, 'tokens_per_minute': 0},
+    'serpstack': {'requests_per_minute': 60, 'tokens_per_minute': 0},
+    'brave': {'requests_per_minute': 60, 'tokens_per_minute': 0},
+    'openalex': {'requests_per_minute': 600, 'tokens_per_minute': 0},
+}
+
+RETRYABLE_STATUS_CODES = {429, 503}
+
+# Output tokens reserved per LLM request, on top of the prompt
+DEFAULT_COMPLETION_TOKENS = 1000
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def load_rate_limits() -> dict:
+    """Provider quotas, with overrides from secrets.toml if present"""
+    limits = {provider: dict(values) for provider, values in DEFAULT_RATE_LIMITS.items()}
+    try:
+        import streamlit as st
+        if 'rate_limits' in st.secrets:
+            for provider, values in st.secrets['rate_limits'].items():
+                limits.setdefault(provider, {}).update(dict(values))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return limits
+
+def _response(exc):
+    response = getattr(exc, 'response', None)
+    # requests.Response is falsy for error statuses, so compare with None
+    return response if response is not None else getattr(exc, 'resp', None)
+
+def error_status_code(exc):
+    """HTTP status of an OpenAI, httpx, requests or googleapiclient error, if any"""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        response = _response(exc)
+        status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+def _retry_after(exc):
+    """Seconds to wait from a Retry-After (or retry-after-ms) header, if present"""
+    response = _response(exc)
+    headers = getattr(response, 'headers', None) or (response if isinstance(response, dict) else None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def is_rate_limited(exc) -> bool:
+    """Whether an exception asks for less traffic (429, 503 or an OpenAI RateLimitError)"""
+    return error_status_code(exc) in RETRYABLE_STATUS_CODES or type(exc).__name__ == 'RateLimitError'
+
+def is_retryable(exc) -> bool:
+    """Whether an exception is a rate limit or temporary unavailability"""
+    return is_rate_limited(exc) or type(exc).__name__ in ('APITimeoutError', 'APIConnectionError')
+
+class RateLimiter:
+    """Token buckets for requests/minute and tokens/minute per provider.
+
+    Bucket state lives in a small SQLite file, so every thread and every
+    worker process on the machine draws from the same quota. On a 429 or 503
+    the provider is paused for everyone (honoring Retry-After) and its rate is
+    halved, once per pause however many callers hit it, then recovers a
+    little with each success. Timeouts and connection errors are retried by
+    the caller alone and leave the rate as it is.
+    """
+
+    def __init__(self, limits: dict = None, path: str = None):
+        self.limits = limits if limits is not None else load_rate_limits()
+        self.path = path or os.path.join(tempfile.gettempdir(), 'reference_crawler_rate_limits.sqlite')
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS providers '
+                         '(name TEXT PRIMARY KEY, blocked_until REAL, rate_factor REAL)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(self._local.conn)
+
+    def _provider_state(self, conn, provider):
+        row = conn.execute('SELECT blocked_until, rate_factor FROM providers WHERE name = ?',
+                           (provider,)).fetchone()
+        return row if row else (0.0, 1.0)
+
+    def _try_acquire(self, provider: str, tokens: int) -> float:
+        """Take one request and `tokens` tokens if available; else return seconds to wait"""
+        limits = self.limits.get(provider, {})
+        now = time.time()
+        with self._connection() as conn:
+            blocked_until, factor = self._provider_state(conn, provider)
+            if blocked_until > now:
+                return blocked_until - now
+
+            wanted = [('requests', limits.get('requests_per_minute', 0), 1),
+                      ('tokens', limits.get('tokens_per_minute', 0), tokens)]
+            levels = {}
+            wait = 0.0
+            for kind, per_minute, amount in wanted:
+                if not per_minute or not amount:
+                    continue
+                capacity = per_minute * factor
+                rate = capacity / 60
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE name = ?',
+                                   (f'{provider}:{kind}',)).fetchone()
+                level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                # A request bigger than the whole bucket only has to wait for a full bucket
+                amount = min(amount, capacity)
+                levels[kind] = (level, amount)
+                if level < amount:
+                    wait = max(wait, (amount - level) / rate)
+
+            for kind, (level, amount) in levels.items():
+                if not wait:
+                    level -= amount
+                conn.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                             (f'{provider}:{kind}', level, now))
+            return wait
+
+    def acquire(self, provider: str, tokens: int = 0):
+        """Block until one request and `tokens` tokens can be spent with the provider"""
+        while True:
+            wait = self._try_acquire(provider, tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def backoff(self, provider: str, delay: float):
+        """Pause all callers of a provider for `delay` seconds and halve its rate.
+
+        Concurrent callers hit by the same burst of 429s back off while the
+        first one's pause is still on; they may extend the pause but don't
+        halve the rate again.
+        """
+        now = time.time()
+        with self._connection() as conn:
+            blocked_until, factor = self._provider_state(conn, provider)
+            if blocked_until <= now:
+                factor = max(factor / 2, 0.05)
+            conn.execute('INSERT OR REPLACE INTO providers (name, blocked_until, rate_factor) VALUES (?, ?, ?)',
+                         (provider, max(blocked_until, now + delay), factor))
+
+    def blocked_for(self, provider: str) -> float:
+        """Seconds until a provider paused by backoff() takes requests again (0 if it isn't paused)"""
+        with self._connection() as conn:
+            blocked_until, _ = self._provider_state(conn, provider)
+        return max(blocked_until - time.time(), 0.0)
+
+    def recover(self, provider: str):
+        """Grow the rate back toward the full quota after a success"""
+        with self._connection() as conn:
+            blocked_until, factor = self._provider_state(conn, provider)
+            if factor < 1.0:
+                conn.execute('INSERT OR REPLACE INTO providers (name, blocked_until, rate_factor) VALUES (?, ?, ?)',
+                             (provider, blocked_until, min(factor + 0.05, 1.0)))
+
+    def call(self, provider: str, fn, tokens: int = 0, max_retries: int = 5, base_delay: float = 2.0):
+        """Call fn() within the provider's quota, retrying on 429/503, timeouts and connection errors.
+
+        Args:
+            provider (str): Key into the rate limits, e.g. 'openai' or 'google_cse'
+            fn (callable): The request to make
+            tokens (int): Estimated tokens the request will consume
+            max_retries (int): Retries on retryable errors before giving up
+            base_delay (float): First backoff delay in seconds when there is no Retry-After
+
+        Returns:
+            The result of fn()
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(provider, tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if attempt == max_retries or not is_retryable(e):
+                    raise
+                wait = self._back_off_after(provider, e, attempt, base_delay)
+                if wait:
+                    time.sleep(wait)
+                continue
+            self.recover(provider)
+            return result
+
+    async def acquire_async(self, provider: str, tokens: int = 0):
+        """Like acquire, but waits with asyncio.sleep so other coroutines keep running"""
+        while True:
+            # SQLite may wait up to 30s for another process's lock, so keep it off the event loop
+            wait = await asyncio.to_thread(self._try_acquire, provider, tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def call_async(self, provider: str, fn, tokens: int = 0, max_retries: int = 5, base_delay: float = 2.0):
+        """Like call, for fn returning an awaitable (e.g. lambda: llm.ainvoke(prompt))"""
+        for attempt in range(max_retries + 1):
+            await self.acquire_async(provider, tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                if attempt == max_retries or not is_retryable(e):
+                    raise
+                wait = await asyncio.to_thread(self._back_off_after, provider, e, attempt, base_delay)
+                if wait:
+                    await asyncio.sleep(wait)
+                continue
+            await asyncio.to_thread(self.recover, provider)
+            return result
+
+    def _back_off_after(self, provider: str, e, attempt: int, base_delay: float) -> float:
+        """Back off after a retryable error; returns the seconds the caller itself should wait.
+
+        Rate limits pause the whole provider (the next acquire waits it out);
+        timeouts and connection errors only delay this caller's retry.
+        """
+        delay = _retry_after(e)
+        if delay is None:
+            delay = base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if is_rate_limited(e):
+            metrics.add('rate_limit_backoffs_total')
+            self.backoff(provider, delay)
+            return 0.0
+        metrics.add('request_retries_total')
+        return delay
+
+class _Transaction:
+    """Exclusive SQLite transaction, so bucket updates are atomic across processes"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide RateLimiter"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
+
+def use_rate_limiter(limiter: RateLimiter):
+    """Replace the process-wide RateLimiter, e.g. with unlimited quotas for the benchmark"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = limiter
+
+def invoke_llm(llm, prompt, completion_tokens: int = DEFAULT_COMPLETION_TOKENS):
+    """llm.invoke(prompt) within the shared OpenAI quota"""
+    tokens = estimate_tokens(str(prompt)) + completion_tokens
+    result = get_rate_limiter().call('openai', lambda: llm.invoke(prompt), tokens=tokens)
+    record_llm_usage(result)
+    return result
+
+async def ainvoke_llm(llm, prompt, completion_tokens: int = DEFAULT_COMPLETION_TOKENS):
+    """await llm.ainvoke(prompt) within the shared OpenAI quota"""
+    tokens = estimate_tokens(str(prompt)) + completion_tokens
+    result = await get_rate_limiter().call_async('openai', lambda: llm.ainvoke(prompt), tokens=tokens)
+    record_llm_usage(result)
+    return result
@@ -0,0 +1,138 @@
+import random
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from rate_limiter import is_retryable, error_status_code
+from llm_stages import TRIPLET_GROUPS
+
+DEAD_LETTER_STATUS = 'DeadLetter'
+MAX_ATTEMPTS = 5
+BASE_DELAY_SECONDS = 60
+MAX_DELAY_SECONDS = 6 * 60 * 60
+
+# Stages that can fail and be retried: collection, status field, value set on failure
+RETRY_STAGES = {
+    'extract': ('pdf_files', 'status', 'FailedProcessing'),
+    'qualify': ('pdf_files', 'status', 'FailedProcessing'),
+    'references': ('pdf_files', 'status', 'FailedProcessing'),
+    'crawl': ('references', 'status', 'FailedProcessing'),
+    **{group: ('pdf_files', group, 'Failed') for group in TRIPLET_GROUPS},
+}
+
+# Exceptions that mean the input itself is bad and retrying won't help. KeyError
+# and TypeError are left out: they are usually bugs in the pipeline, and a
+# fixed bug should get the document through on a later attempt.
+_PERMANENT_ERRORS = ('OutputParserException', 'ValidationError', 'JSONDecodeError',
+                     'PdfReadError', 'PdfStreamError', 'NotFound')
+
+def classify_error(exc) -> str:
+    """Classify an exception as 'transient' (worth retrying) or 'permanent'"""
+    if is_retryable(exc):
+        return 'transient'
+    status = error_status_code(exc)
+    if status is not None:
+        return 'transient' if status >= 500 or status == 408 else 'permanent'
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & set(_PERMANENT_ERRORS):
+        return 'permanent'
+    if isinstance(exc, (TimeoutError, ConnectionError)) or names & {'Timeout', 'TimeoutException', 'ConnectionError',
+                                                                     'NetworkError', 'ServiceUnavailable',
+                                                                     'DeadlineExceeded', 'TooManyRequests'}:
+        return 'transient'
+    # Unknown errors get the benefit of the doubt, bounded by MAX_ATTEMPTS
+    return 'transient'
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter, in seconds"""
+    return random.uniform(0, min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * (2 ** attempts)))
+
+def failure_updates(stage: str, data: dict, exc, retry_value: str, max_attempts: int = MAX_ATTEMPTS) -> dict:
+    """Update fields recording a failed stage attempt.
+
+    Transient failures are marked failed and scheduled for another attempt
+    after an exponential backoff; permanent failures, and documents that have
+    used up their attempts, move to the DeadLetter state.
+
+    Args:
+        stage (str): Stage name, one of RETRY_STAGES
+        data (dict): Current document data (for the attempt counter)
+        exc (Exception): The error that stopped the stage
+        retry_value (str): Value of the stage's status field to restore on retry
+        max_attempts (int): Attempts before dead-lettering
+
+    Returns:
+        dict: Fields to merge into the document update
+    """
+    _, status_field, failed_value = RETRY_STAGES[stage]
+    attempts = ((data.get('retry') or {}).get(stage) or {}).get('attempts', 0) + 1
+    error_class = classify_error(exc)
+    dead = error_class == 'permanent' or attempts >= max_attempts
+    next_retry_at = None if dead else datetime.now(timezone.utc) + timedelta(seconds=backoff_delay(attempts))
+    return {
+        status_field: DEAD_LETTER_STATUS if dead else failed_value,
+        f'retry.{stage}': {
+            'attempts': attempts,
+            'error_class': error_class,
+            'error_type': type(exc).__name__,
+            'retry_value': retry_value,
+            'next_retry_at': next_retry_at,
+            'dead': dead,
+        },
+    }
+
+def reset_retry(stage: str) -> dict:
+    """Update fields that clear a stage's attempt count; merge into the stage's update on success"""
+    return {f'retry.{stage}': firestore.DELETE_FIELD}
+
+def requeue_due(db, stage: str, limit: int = 500) -> int:
+    """Put documents whose retry time has come back into their stage's queue.
+
+    Each stage calls this before claiming work, so retries happen on their
+    own once their backoff has passed.
+
+    Returns:
+        int: Number of documents requeued
+    """
+    collection_name, status_field, failed_value = RETRY_STAGES[stage]
+    now = datetime.now(timezone.utc)
+    query = db.collection(collection_name).where(f'retry.{stage}.next_retry_at', '<=', now).limit(limit)
+    batch = db.batch()
+    requeued = 0
+    for doc in query.stream():
+        data = doc.to_dict()
+        # Documents someone fixed by hand in the meantime just drop their retry time,
+        # so they don't keep filling this query
+        if data.get(status_field) != failed_value:
+            batch.update(doc.reference, {f'retry.{stage}.next_retry_at': None})
+            continue
+        batch.update(doc.reference, {
+            status_field: data['retry'][stage]['retry_value'],
+            f'retry.{stage}.next_retry_at': None,
+            'updated_timestamp': firestore.SERVER_TIMESTAMP
+        })
+        requeued += 1
+    batch.commit()
+    return requeued
+
+def requeue_dead_letters(db, stage: str, limit: int = 500) -> int:
+    """Give dead-lettered documents a fresh set of attempts.
+
+    Returns:
+        int: Number of documents requeued
+    """
+    collection_name, status_field, _ = RETRY_STAGES[stage]
+    query = db.collection(collection_name).where(status_field, '==', DEAD_LETTER_STATUS).limit(limit)
+    batch = db.batch()
+    requeued = 0
+    for doc in query.stream():
+        retry = (doc.to_dict().get('retry') or {}).get(stage)
+        # The dead letter may belong to another stage sharing the status field
+        if not retry or not retry.get('dead'):
+            continue
+        batch.update(doc.reference, {
+            status_field: retry['retry_value'],
+            f'retry.{stage}': firestore.DELETE_FIELD,
+            'updated_timestamp': firestore.SERVER_TIMESTAMP
+        })
+        requeued += 1
+    batch.commit()
+    return requeued
@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, urlunsplit
+from rate_limiter import get_rate_limiter, error_status_code
+from pipeline_metrics import metrics
+
+# Federated paper search for the crawl. Google Custom Search, Tavily,
+# Serpstack and Brave are registered below; each search goes to the first
+# available provider in the configured order. If it hasn't answered by its
+# usual (percentile) latency, the next provider is asked too and whichever
+# answers first wins, merged with any other answer already in. Rate limits
+# (429) are waited out and retried through the shared rate limiter; a
+# provider that reports its quota used up is paused for every worker and the
+# search moves on to the next one.
+
+# Override in the optional [search] section of secrets.toml
+DEFAULT_SEARCH_CONFIG = {
+    'providers': ['google_cse', 'tavily', 'serpstack', 'brave'],
+    'results': 5,
+    'hedge_percentile': 90,         # latency of the first provider after which a second is asked
+    'hedge_min_samples': 20,        # latencies needed before the percentile is trusted
+    'hedge_default_seconds': 3.0,   # hedge delay until then
+    'hedge_min_seconds': 0.5,
+    'quota_cooldown_seconds': 3600,
+    'max_retries': 2,               # retries on rate limits, timeouts and connection errors
+    'max_wait_seconds': 60,         # a provider paused for longer than this is skipped
+}
+
+# Recent latencies kept per provider
+LATENCY_WINDOW = 200
+
+# Serpstack reports errors in a 200 response: usage limit reached, rate limit reached
+_SERPSTACK_QUOTA_CODE = 104
+_SERPSTACK_RATE_LIMIT_CODE = 106
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='search')
+
+class QuotaExceeded(Exception):
+    """A search provider has used up its quota"""
+
+    status_code = 402
+
+class RateLimited(Exception):
+    """A search provider asked for less traffic in a successful response"""
+
+    status_code = 429
+
+def load_search_config() -> dict:
+    """Search settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_SEARCH_CONFIG)
+    try:
+        import streamlit as st
+        if 'search' in st.secrets:
+            config.update(dict(st.secrets['search']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def _secrets(names) -> dict:
+    """The given secrets, or None if any is missing"""
+    try:
+        import streamlit as st
+        values = {name: st.secrets[name] for name in names}
+    except Exception:
+        return None
+    return values if all(values.values()) else None
+
+def is_quota_error(exc) -> bool:
+    """Whether an error means the provider's quota is used up.
+
+    A bare 429 is only a rate limit, which the rate limiter waits out.
+    """
+    if isinstance(exc, QuotaExceeded):
+        return True
+    status = error_status_code(exc)
+    # 402 Payment Required, and Tavily's 432 for a plan's used-up credits
+    if status in (402, 432):
+        return True
+    # Google returns 403 for a used-up daily quota
+    return status == 403 and any(reason in str(exc) for reason in ('dailyLimitExceeded', 'quotaExceeded'))
+
+class SearchProvider:
+    """A search API that can look up a paper's PDF.
+
+    Args:
+        name (str): Provider name, also its key in the rate limits
+        search (callable): search(paper_info, secrets, count) -> [{'url', 'title'}]
+        secrets (list): secrets.toml keys the provider needs; it's only used when all are set
+    """
+
+    def __init__(self, name: str, search, secrets: list):
+        self.name = name
+        self.search = search
+        self.secrets = secrets
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        return _secrets(self.secrets)
+
+    def hedge_delay(self, config: dict) -> float:
+        """Seconds to wait for this provider before also asking the next one"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < int(config['hedge_min_samples']):
+            return float(config['hedge_default_seconds'])
+        index = min(len(latencies) - 1, int(len(latencies) * float(config['hedge_percentile']) / 100))
+        return max(latencies[index], float(config['hedge_min_seconds']))
+
+    def __call__(self, paper_info: str, credentials: dict, count: int, max_retries: int = 2) -> list:
+        """Search within the provider's rate limit, recording the latency"""
+        metrics.add(f'search_requests_{self.name}_total')
+        started = time.monotonic()
+        # Rate limits are retried after the shared backoff; quota errors go straight
+        # back to the caller, which moves on to another provider
+        results = get_rate_limiter().call(self.name, lambda: self.search(paper_info, credentials, count),
+                                          max_retries=max_retries)
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return results
+
+def _google_cse(paper_info: str, credentials: dict, count: int) -> list:
+    from google_search_api import google_cse_results
+
+    return google_cse_results(paper_info, credentials['GOOGLE_API_KEY'], credentials['GOOGLE_CSE_ID'], count)
+
+def _get_json(url: str, **kwargs) -> dict:
+    from clients import get_http_client
+
+    response = get_http_client().request(kwargs.pop('method', 'GET'), url, timeout=30, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+def _tavily(paper_info: str, credentials: dict, count: int) -> list:
+    data = _get_json('https://api.tavily.com/search', method='POST',
+                     headers={'Authorization': f"Bearer {credentials['TAVILY_API_KEY']}"},
+                     json={'query': f"{paper_info} pdf", 'max_results': count, 'search_depth': 'basic'})
+    return [{'url': result['url'], 'title': result.get('title', '')} for result in data.get('results', [])]
+
+def _serpstack(paper_info: str, credentials: dict, count: int) -> list:
+    data = _get_json('https://api.serpstack.com/search',
+                     params={'access_key': credentials['SERP_API_KEY'], 'query': f"{paper_info} filetype:pdf", 'num': count})
+    if data.get('success') is False:
+        error = data.get('error') or {}
+        message = f"Serpstack error {error.get('code')}: {error.get('info', error.get('type', ''))}"
+        if error.get('code') == _SERPSTACK_QUOTA_CODE:
+            raise QuotaExceeded(message)
+        raise RateLimited(message) if error.get('code') == _SERPSTACK_RATE_LIMIT_CODE else RuntimeError(message)
+    return [{'url': result['url'], 'title': result.get('title', '')} for result in data.get('organic_results', [])]
+
+def _brave(paper_info: str, credentials: dict, count: int) -> list:
+    data = _get_json('https://api.search.brave.com/res/v1/web/search',
+                     headers={'X-Subscription-Token': credentials['BRAVE_API_KEY'], 'Accept': 'application/json'},
+                     params={'q': f"{paper_info} filetype:pdf", 'count': count})
+    return [{'url': result['url'], 'title': result.get('title', '')}
+            for result in (data.get('web') or {}).get('results', [])]
+
+PROVIDERS = {provider.name: provider for provider in [
+    SearchProvider('google_cse', _google_cse, ['GOOGLE_API_KEY', 'GOOGLE_CSE_ID']),
+    SearchProvider('tavily', _tavily, ['TAVILY_API_KEY']),
+    SearchProvider('serpstack', _serpstack, ['SERP_API_KEY']),
+    SearchProvider('brave', _brave, ['BRAVE_API_KEY']),
+]}
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/', parts.query, ''))
+
+def merge_results(answers: list) -> list:
+    """Results of several providers, best provider first, without repeated URLs"""
+    merged, seen = [], set()
+    for results in answers:
+        for result in results:
+            key = _normalize_url(result['url'])
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append({'url': result['url'], 'title': result.get('title', '').replace(' PDF', '').strip()})
+    return merged
+
+def available_providers(config: dict = None, providers: dict = None) -> list:
+    """Configured providers in order, with their credentials, leaving out those paused for quota.
+
+    Shorter pauses, after a rate limit, are waited out by the rate limiter.
+    """
+    config = config or load_search_config()
+    providers = providers or PROVIDERS
+    limiter = get_rate_limiter()
+    available = []
+    for name in config['providers']:
+        provider = providers.get(name)
+        credentials = provider.credentials() if provider else None
+        if credentials is not None and limiter.blocked_for(name) <= float(config['max_wait_seconds']):
+            available.append((provider, credentials))
+    return available
+
+def search_papers(paper_info: str, config: dict = None, providers: dict = None) -> list:
+    """Search for a paper's PDF across the configured providers.
+
+    Args:
+        paper_info (str): The reference text to search for
+        config (dict): Settings (default from secrets.toml)
+        providers (dict): SearchProviders by name (default PROVIDERS)
+
+    Returns:
+        list[dict]: 'url' and 'title' of each result, without repeated URLs
+
+    Raises:
+        The last provider's error if none of them could answer
+    """
+    config = config or load_search_config()
+    queue = available_providers(config, providers)
+    if not queue:
+        raise RuntimeError('No search provider is configured and within its quota')
+    print(f"Searching for {paper_info}\n***********\n\n\n")
+    metrics.add('search_calls_total')
+    count = int(config['results'])
+
+    pending = {}
+    order = {}
+    answers, errors = [], []
+
+    def ask_next():
+        provider, credentials = queue.pop(0)
+        future = _executor.submit(provider, paper_info, credentials, count, int(config['max_retries']))
+        pending[future] = provider
+        order[provider.name] = len(order)
+        return provider
+
+    hedge_at = time.monotonic() + ask_next().hedge_delay(config)
+    hedged = False
+    while pending and not answers:
+        timeout = max(hedge_at - time.monotonic(), 0) if queue and not hedged else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # The first provider is slower than usual; ask the next one as well
+            metrics.add('search_hedges_total')
+            ask_next()
+            hedged = True
+            continue
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                answers.append((order[provider.name], future.result()))
+            except Exception as e:
+                errors.append(e)
+                if is_quota_error(e):
+                    print(f"{provider.name} is out of quota, pausing it for {config['quota_cooldown_seconds']}s")
+                    get_rate_limiter().backoff(provider.name, float(config['quota_cooldown_seconds']))
+                else:
+                    print(f"Search with {provider.name} failed: {e}")
+                if queue and not pending:
+                    metrics.add('search_failovers_total')
+                    ask_next()
+
+    # Take in any other answer that has already arrived; slower ones are left to finish on their own
+    for future, provider in pending.items():
+        if future.done() and future.exception() is None:
+            answers.append((order[provider.name], future.result()))
+    if not answers:
+        raise errors[-1]
+    return merge_results([results for _, results in sorted(answers, key=lambda answer: answer[0])])
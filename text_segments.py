@@ -0,0 +1,257 @@
+import argparse
+import io
+import json
+import mmap
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from firebase_admin import firestore
+from pipeline_metrics import metrics, record_bytes
+
+# Optional packed storage for extracted texts. Compaction appends the texts
+# of many papers into one segment object (text_segments/<id>.seg) with an
+# offset index (text_segments/<id>.json: paper ID -> byte range), and
+# points each paper at its range in its `text_segment` field. Batch stages
+# then load the texts of a whole run with one Storage request per segment,
+# either a ranged read covering the papers they need or, when they need a
+# good share of it, the whole segment, kept on local disk and memory-mapped
+# for later runs. Papers not compacted yet are read from txt_files as before.
+#
+#   python -m text_segments compact --limit 20000
+
+# Override in the optional [text_segments] section of secrets.toml
+DEFAULT_SEGMENT_CONFIG = {
+    'segment_bytes': 64 * 1024 * 1024,       # a new segment is started past this size
+    'local_directory': 'text_segments',      # local copies of whole segments
+    'local_cache_bytes': 2 * 1024 * 1024 * 1024,
+    'whole_segment_fraction': 0.25,          # share of a segment needed before it's fetched whole
+}
+
+SEGMENTS_COLLECTION = 'text_segments'
+
+# Concurrent reads of papers that aren't in a segment
+DOWNLOAD_WORKERS = 8
+
+# Papers whose texts compaction reads at a time
+COMPACT_CHUNK = 200
+
+def load_segment_config() -> dict:
+    """Text segment settings, with overrides from secrets.toml if present"""
+    config = dict(DEFAULT_SEGMENT_CONFIG)
+    try:
+        import streamlit as st
+        if 'text_segments' in st.secrets:
+            config.update(dict(st.secrets['text_segments']))
+    except Exception:
+        # Running outside Streamlit or without secrets.toml
+        pass
+    return config
+
+def _blob(segment_id: str, suffix: str):
+    from firebase_utils import get_bucket
+
+    return get_bucket().blob(f'{SEGMENTS_COLLECTION}/{segment_id}.{suffix}')
+
+def _local_path(segment_id: str, config: dict) -> str:
+    return os.path.join(config['local_directory'], f'{segment_id}.seg')
+
+def _fetch_segment(segment_id: str, config: dict) -> str:
+    """Local copy of a whole segment, downloaded if it isn't there yet"""
+    path = _local_path(segment_id, config)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    os.makedirs(config['local_directory'], exist_ok=True)
+    # Download next to the final path and rename, so readers never see half a segment
+    fd, partial = tempfile.mkstemp(dir=config['local_directory'], suffix='.partial')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _blob(segment_id, 'seg').download_to_file(f)
+            record_bytes(downloaded=f.tell())
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+    metrics.add('text_segment_downloads_total')
+    _evict(config, keep=path)
+    return path
+
+def _evict(config: dict, keep: str):
+    """Remove the least recently used local segments beyond local_cache_bytes"""
+    directory = config['local_directory']
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.seg')]
+    files.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(path) for path in files)
+    for path in files:
+        if path == keep:
+            continue
+        if total <= int(config['local_cache_bytes']):
+            break
+        total -= os.path.getsize(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _read_segment(segment_id: str, ranges: dict, config: dict) -> dict:
+    """Texts of the papers in `ranges` (paper ID -> (offset, length)) from one segment"""
+    start = min(offset for offset, _ in ranges.values())
+    end = max(offset + length for offset, length in ranges.values())
+    wanted = sum(length for _, length in ranges.values())
+    local = os.path.exists(_local_path(segment_id, config))
+    segment_bytes = int(config['segment_bytes'])
+    if local or wanted >= float(config['whole_segment_fraction']) * segment_bytes:
+        with open(_fetch_segment(segment_id, config), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return {paper_id: data[offset:offset + length].decode('utf-8')
+                    for paper_id, (offset, length) in ranges.items()}
+    # One ranged read covering every paper needed (Storage ranges include the end byte)
+    data = _blob(segment_id, 'seg').download_as_bytes(start=start, end=end - 1)
+    record_bytes(downloaded=len(data))
+    metrics.add('text_segment_range_reads_total')
+    return {paper_id: data[offset - start:offset - start + length].decode('utf-8')
+            for paper_id, (offset, length) in ranges.items()}
+
+def load_texts(docs, config: dict = None) -> tuple:
+    """Extracted texts of several papers, read segment by segment where compacted.
+
+    Args:
+        docs (list): pdf_files DocumentSnapshots
+        config (dict): Settings (default from secrets.toml)
+
+    Returns:
+        tuple: Texts by document ID, and the errors of papers that couldn't be read
+    """
+    from firebase_utils import download_text_from_storage
+
+    config = config or load_segment_config()
+    by_segment, loose = {}, []
+    for doc in docs:
+        pointer = doc.to_dict().get('text_segment')
+        if pointer:
+            by_segment.setdefault(pointer['id'], {})[doc.id] = (pointer['offset'], pointer['length'])
+        else:
+            loose.append(doc)
+
+    texts, errors = {}, {}
+    for segment_id, ranges in by_segment.items():
+        try:
+            texts.update(_read_segment(segment_id, ranges, config))
+        except Exception as e:
+            print(f"Could not read text segment {segment_id}, reading its papers one by one: {e}")
+            loose.extend(doc for doc in docs if doc.id in ranges)
+
+    def download(doc):
+        try:
+            return doc.id, download_text_from_storage(doc.to_dict()['file_id']), None
+        except Exception as e:
+            return doc.id, None, e
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        for doc_id, text, error in pool.map(download, loose):
+            if error is None:
+                texts[doc_id] = text
+            else:
+                errors[doc_id] = error
+    return texts, errors
+
+def _write_segment(db, papers: list) -> str:
+    """Upload one segment and its index and point its papers at it; returns the segment ID"""
+    segment_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    data = io.BytesIO()
+    index = {}
+    for doc, text in papers:
+        encoded = text.encode('utf-8')
+        index[doc.id] = {'file_id': doc.to_dict()['file_id'], 'offset': data.tell(), 'length': len(encoded)}
+        data.write(encoded)
+    size = data.tell()
+    data.seek(0)
+    _blob(segment_id, 'seg').upload_from_file(data, content_type='application/octet-stream')
+    _blob(segment_id, 'json').upload_from_string(json.dumps(index), content_type='application/json')
+    record_bytes(uploaded=size)
+    db.collection(SEGMENTS_COLLECTION).document(segment_id).set({
+        'papers': len(index),
+        'bytes': size,
+        'created_timestamp': firestore.SERVER_TIMESTAMP
+    })
+    # Point the papers at their ranges only once the segment is in place
+    for start in range(0, len(papers), 400):
+        batch = db.batch()
+        for doc, _ in papers[start:start + 400]:
+            entry = index[doc.id]
+            batch.update(doc.reference, {'text_segment': {'id': segment_id, 'offset': entry['offset'],
+                                                          'length': entry['length']}})
+        batch.commit()
+    return segment_id
+
+def compact_texts(db, limit: int = 5000, config: dict = None, progress=None) -> dict:
+    """Pack the texts of papers extracted since the last compaction into segments.
+
+    The extract stage sets `text_segment` to None, which queues a paper
+    here; the individual txt_files objects are kept. Queued papers that
+    have no text yet (queued by the admin page's migration) are taken off
+    the queue, and the extract stage queues them again.
+
+    Args:
+        db: Firestore client
+        limit (int): Most papers packed in this run
+        config (dict): Settings (default from secrets.toml)
+        progress (callable): Called as progress(packed, segments) after each segment
+
+    Returns:
+        dict: 'papers' packed, 'segments' written and 'errors' (papers whose text couldn't be read)
+    """
+    config = config or load_segment_config()
+    docs = list(db.collection('pdf_files').where('text_segment', '==', None).limit(limit).stream())
+    totals = {'papers': 0, 'segments': 0, 'errors': 0}
+    pending, pending_bytes = [], 0
+
+    not_extracted = [doc for doc in docs if not doc.to_dict().get('txt_file_location')]
+    for start in range(0, len(not_extracted), 400):
+        batch = db.batch()
+        for doc in not_extracted[start:start + 400]:
+            batch.update(doc.reference, {'text_segment': firestore.DELETE_FIELD})
+        batch.commit()
+    docs = [doc for doc in docs if doc.to_dict().get('txt_file_location')]
+
+    def flush():
+        _write_segment(db, pending)
+        totals['papers'] += len(pending)
+        totals['segments'] += 1
+        if progress is not None:
+            progress(totals['papers'], totals['segments'])
+
+    # Read the texts a chunk at a time, so only about a segment's worth is held in memory
+    for start in range(0, len(docs), COMPACT_CHUNK):
+        chunk = docs[start:start + COMPACT_CHUNK]
+        texts, errors = load_texts(chunk, config)
+        totals['errors'] += len(errors)
+        for doc in chunk:
+            if doc.id not in texts:
+                continue
+            pending.append((doc, texts[doc.id]))
+            pending_bytes += len(texts[doc.id].encode('utf-8'))
+            if pending_bytes >= int(config['segment_bytes']):
+                flush()
+                pending, pending_bytes = [], 0
+    if pending:
+        flush()
+    return totals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m text_segments',
+                                     description='Pack extracted texts into segments for the batch stages.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('compact', help='pack the texts of papers extracted since the last run')
+    command.add_argument('--limit', type=int, default=5000, help='most papers packed')
+    args = parser.parse_args(argv)
+
+    from firebase_utils import get_db
+
+    print(compact_texts(get_db(), args.limit,
+                        progress=lambda papers, segments: print(f"Packed {papers} papers into {segments} segments")))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import threading
+import numpy as np
+from controlled_vocabulary import MARKETING_CUES, CUSTOMER_TRAITS, BEHAVIORAL_OUTCOMES, VOCABULARY
+from triplet_store import normalize_entity, normalize_predicate
+
+# Named vocabulary groups that can be used as heatmap axes
+GROUPS = {
+    'Cue': MARKETING_CUES,
+    'Trait': CUSTOMER_TRAITS,
+    'Behavior': BEHAVIORAL_OUTCOMES,
+}
+
+def _parse_frequency(value) -> int:
+    """Group B frequency comes back from the LLM as free text; default to 1"""
+    try:
+        return max(int(float(str(value).strip())), 1)
+    except (TypeError, ValueError):
+        return 1
+
+class TripletMatrix:
+    """Dense count tensors over the Group B controlled vocabulary.
+
+    counts[s, p, o, d] is the number of triplets with subject s, predicate p,
+    object o found in papers at depth d, and frequency[s, p, o, d] sums the
+    per-triplet frequency reported by the LLM. Subjects and objects share the
+    vocabulary axis; predicates and depths grow as new values are seen.
+    A paper × entity incidence matrix backs co-occurrence queries.
+    """
+
+    def __init__(self):
+        self.entities = [normalize_entity(term) for term in VOCABULARY]
+        self.entity_labels = list(VOCABULARY)
+        self.entity_index = {entity_id: i for i, entity_id in enumerate(self.entities)}
+        self.predicates = []
+        self.predicate_index = {}
+        self.depths = []
+        self.depth_index = {}
+        self.papers = {}
+        n = len(self.entities)
+        self.counts = np.zeros((n, 0, n, 0), dtype=np.int64)
+        self.frequency = np.zeros((n, 0, n, 0), dtype=np.int64)
+        self.incidence = np.zeros((0, n), dtype=np.int64)
+        self.skipped = 0
+        self.last_timestamp = None
+        # IDs of the loaded triplets created at last_timestamp, which the next load reads again
+        self.last_ids = set()
+        # Guards incremental updates when the matrix is shared between sessions
+        self.lock = threading.Lock()
+
+    def _grow(self, axis: int, size: int):
+        pad = [(0, 0)] * 4
+        pad[axis] = (0, size - self.counts.shape[axis])
+        self.counts = np.pad(self.counts, pad)
+        self.frequency = np.pad(self.frequency, pad)
+
+    def _predicate(self, predicate: str) -> int:
+        key = normalize_predicate(predicate)
+        if key not in self.predicate_index:
+            self.predicate_index[key] = len(self.predicates)
+            self.predicates.append(key)
+            # Grow in blocks so a stream of new predicates doesn't copy every time
+            if len(self.predicates) > self.counts.shape[1]:
+                self._grow(1, max(2 * self.counts.shape[1], 8))
+        return self.predicate_index[key]
+
+    def _depth(self, depth: int) -> int:
+        depth = int(depth or 0)
+        if depth not in self.depth_index:
+            self.depth_index[depth] = len(self.depths)
+            self.depths.append(depth)
+            if len(self.depths) > self.counts.shape[3]:
+                self._grow(3, max(2 * self.counts.shape[3], 4))
+        return self.depth_index[depth]
+
+    def _paper(self, file_id: str) -> int:
+        if file_id not in self.papers:
+            self.papers[file_id] = len(self.papers)
+            if len(self.papers) > self.incidence.shape[0]:
+                rows = max(2 * self.incidence.shape[0], 64) - self.incidence.shape[0]
+                self.incidence = np.pad(self.incidence, [(0, rows), (0, 0)])
+        return self.papers[file_id]
+
+    def add(self, triplet: dict, depth: int, sign: int = 1):
+        """Add a triplet document (or remove it with sign=-1).
+
+        Triplets whose subject or object falls outside the controlled
+        vocabulary are counted in `skipped` and otherwise ignored.
+
+        Args:
+            triplet (dict): Triplet document with subject, predicate, object and file_id
+            depth (int): Crawl depth of the paper the triplet came from
+            sign (int): 1 to add, -1 to remove
+        """
+        s = self.entity_index.get(triplet.get('subject_id') or normalize_entity(triplet.get('subject', '')))
+        o = self.entity_index.get(triplet.get('object_id') or normalize_entity(triplet.get('object', '')))
+        if s is None or o is None:
+            self.skipped += sign
+            return
+        p = self._predicate(triplet.get('predicate', ''))
+        d = self._depth(depth)
+        self.counts[s, p, o, d] += sign
+        self.frequency[s, p, o, d] += sign * _parse_frequency(triplet.get('frequency', 1))
+        paper = self._paper(triplet.get('file_id', ''))
+        self.incidence[paper, s] += sign
+        self.incidence[paper, o] += sign
+
+    def _trimmed(self, measure: str):
+        # Drop the unused capacity on the growable axes
+        tensor = self.frequency if measure == 'frequency' else self.counts
+        return tensor[:, :len(self.predicates), :, :len(self.depths)]
+
+    def slice(self, subject=None, predicate=None, object=None, depth=None, measure='count'):
+        """Sub-tensor for the given subject/predicate/object/depth values.
+
+        Each argument may be None (keep the whole axis), a single value or a
+        list of values. Axes are never dropped, so the result is always 4-D.
+
+        Returns:
+            np.ndarray: View or copy of the count or frequency tensor
+        """
+        tensor = self._trimmed(measure)
+        selectors = [
+            (subject, lambda v: self.entity_index.get(normalize_entity(v))),
+            (predicate, lambda v: self.predicate_index.get(normalize_predicate(v))),
+            (object, lambda v: self.entity_index.get(normalize_entity(v))),
+            (depth, lambda v: self.depth_index.get(int(v))),
+        ]
+        for axis, (values, lookup) in enumerate(selectors):
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            indexes = [i for i in (lookup(v) for v in values) if i is not None]
+            tensor = np.take(tensor, indexes, axis=axis)
+        return tensor
+
+    def matrix(self, row_group: str, col_group: str, predicate=None, depth=None, measure='count'):
+        """Subject × object matrix between two vocabulary groups.
+
+        For example matrix('Cue', 'Behavior') counts how often each marketing
+        cue is linked to each behavioral outcome, summed over predicates and
+        depths unless those are given.
+
+        Returns:
+            np.ndarray: Array of shape (len(GROUPS[row_group]), len(GROUPS[col_group]))
+        """
+        tensor = self.slice(subject=GROUPS[row_group], predicate=predicate,
+                            object=GROUPS[col_group], depth=depth, measure=measure)
+        return tensor.sum(axis=(1, 3))
+
+    def by_depth(self, subject=None, object=None, measure='count'):
+        """Totals per depth for a subject/object pair (or any, if None)"""
+        return self.slice(subject=subject, object=object, measure=measure).sum(axis=(0, 1, 2))
+
+    def cooccurrence(self, row_group: str, col_group: str):
+        """Number of papers in which entities of two groups both appear.
+
+        Returns:
+            np.ndarray: Array of shape (len(GROUPS[row_group]), len(GROUPS[col_group]))
+        """
+        present = (self.incidence[:len(self.papers)] > 0).astype(np.int64)
+        rows = [self.entity_index[normalize_entity(term)] for term in GROUPS[row_group]]
+        cols = [self.entity_index[normalize_entity(term)] for term in GROUPS[col_group]]
+        return present[:, rows].T @ present[:, cols]
+
+def _fetch_depths(db, file_ids) -> dict:
+    """Look up paper depths for a set of file IDs, 30 at a time (Firestore 'in' limit)"""
+    depths = {}
+    file_ids = list(file_ids)
+    for start in range(0, len(file_ids), 30):
+        query = db.collection('pdf_files').where('file_id', 'in', file_ids[start:start + 30])
+        for doc in query.stream():
+            data = doc.to_dict()
+            depths[data['file_id']] = data.get('depth', 0)
+    return depths
+
+def load_triplet_matrix(db, matrix: TripletMatrix = None, collection_name: str = 'triplets_group_b') -> TripletMatrix:
+    """Build or incrementally update a TripletMatrix from Firestore.
+
+    When an existing matrix is passed, only triplets created at or after the
+    newest one it has already seen are read. Triplets sharing that timestamp
+    are read again (a later commit can carry the same server timestamp) and
+    the ones already loaded are skipped by document ID.
+
+    Args:
+        db: Firestore client
+        matrix (TripletMatrix): Matrix to update, or None to build a new one
+        collection_name (str): Triplet collection to read
+
+    Returns:
+        TripletMatrix: The updated matrix
+    """
+    if matrix is None:
+        matrix = TripletMatrix()
+
+    with matrix.lock:
+        query = db.collection(collection_name)
+        if matrix.last_timestamp is not None:
+            query = query.where('created_timestamp', '>=', matrix.last_timestamp)
+        triplets = [(doc.id, doc.to_dict()) for doc in query.stream() if doc.id not in matrix.last_ids]
+        if not triplets:
+            return matrix
+
+        depths = _fetch_depths(db, {t.get('file_id', '') for _, t in triplets})
+        for doc_id, triplet in triplets:
+            matrix.add(triplet, depths.get(triplet.get('file_id', ''), 0))
+            created = triplet.get('created_timestamp')
+            if created is None:
+                continue
+            if matrix.last_timestamp is None or created > matrix.last_timestamp:
+                matrix.last_timestamp = created
+                matrix.last_ids = {doc_id}
+            elif created == matrix.last_timestamp:
+                matrix.last_ids.add(doc_id)
+    return matrix
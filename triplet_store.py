@@ -0,0 +1,238 @@
+import re
+import threading
+from controlled_vocabulary import VOCABULARY, ENTITY_ALIASES
+
+# Words ending in s that aren't plurals, or are the same in the singular
+_NOT_PLURAL = {
+    'alias', 'analytics', 'atlas', 'bias', 'canvas', 'economics', 'ethics', 'gas', 'linguistics', 'means',
+    'mathematics', 'news', 'physics', 'politics', 'series', 'species', 'statistics', 'various',
+}
+
+def _fold_token(token: str) -> str:
+    """Fold a simple English plural to its singular form"""
+    if token in _NOT_PLURAL:
+        return token
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    # biases, processes, approaches, boxes
+    if len(token) > 4 and token.endswith('es') and (token[:-2] in _NOT_PLURAL
+                                                     or token[:-2].endswith(('ss', 'sh', 'ch', 'x'))):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+def _entity_key(name: str) -> str:
+    """Case, whitespace, punctuation and plural folded key for an entity name"""
+    name = re.sub(r"[^\w\s-]", ' ', str(name).lower())
+    return ' '.join(_fold_token(token) for token in name.split())
+
+def _entity_id(key: str) -> str:
+    return re.sub(r'[\s-]+', '_', key)
+
+# Canonical labels for the controlled vocabulary and its aliases, keyed by folded name
+_CANONICAL = {_entity_key(term): term for term in VOCABULARY}
+_CANONICAL.update({_entity_key(alias): term for alias, term in ENTITY_ALIASES.items()})
+
+def normalize_entity(name: str) -> str:
+    """Map a free-text subject or object to a stable entity ID.
+
+    Names are folded for case, whitespace and plurals, and aliased onto the
+    Group B controlled vocabulary where possible, so "Scarcity messages" and
+    "scarcity message" both become "scarcity_message".
+
+    Args:
+        name (str): Subject or object text as produced by the LLM
+
+    Returns:
+        str: Entity ID
+    """
+    key = _entity_key(name)
+    if key in _CANONICAL:
+        key = _entity_key(_CANONICAL[key])
+    return _entity_id(key)
+
+# Vocabulary labels keyed by entity ID
+_VOCABULARY_LABELS = {normalize_entity(term): term for term in VOCABULARY}
+
+def normalize_predicate(predicate: str) -> str:
+    """Map a predicate to an ID, folding case and whitespace only"""
+    return _entity_id(' '.join(str(predicate).lower().split()))
+
+class TripletStore:
+    """In-memory triplet store with inverted indexes.
+
+    Each triplet is stored once by document ID and indexed by subject entity,
+    predicate, object entity and paper, so lookups intersect posting sets
+    instead of scanning every row.
+    """
+
+    def __init__(self):
+        self.triplets = {}
+        self.labels = {}
+        self.by_subject = {}
+        self.by_predicate = {}
+        self.by_object = {}
+        self.by_paper = {}
+        self.last_timestamp = None
+        # IDs of the loaded triplets created at last_timestamp, which the next load reads again
+        self.last_ids = set()
+        # Guards incremental updates when the store is shared between sessions
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.triplets)
+
+    def _label(self, entity_id: str, name: str):
+        # Prefer the controlled vocabulary label, else the first spelling seen
+        if entity_id in _VOCABULARY_LABELS:
+            self.labels[entity_id] = _VOCABULARY_LABELS[entity_id]
+        else:
+            self.labels.setdefault(entity_id, name)
+
+    def add(self, triplet_id: str, triplet: dict):
+        """Add or replace a triplet document.
+
+        Args:
+            triplet_id (str): Firestore document ID of the triplet
+            triplet (dict): Triplet document with subject, predicate, object and file_id
+        """
+        if triplet_id in self.triplets:
+            self.remove(triplet_id)
+
+        row = dict(triplet)
+        row['id'] = triplet_id
+        row['subject_id'] = row.get('subject_id') or normalize_entity(row.get('subject', ''))
+        row['object_id'] = row.get('object_id') or normalize_entity(row.get('object', ''))
+        row['predicate_id'] = normalize_predicate(row.get('predicate', ''))
+        self.triplets[triplet_id] = row
+
+        self._label(row['subject_id'], row.get('subject', ''))
+        self._label(row['object_id'], row.get('object', ''))
+        self.by_subject.setdefault(row['subject_id'], set()).add(triplet_id)
+        self.by_predicate.setdefault(row['predicate_id'], set()).add(triplet_id)
+        self.by_object.setdefault(row['object_id'], set()).add(triplet_id)
+        self.by_paper.setdefault(row.get('file_id', ''), set()).add(triplet_id)
+
+    def remove(self, triplet_id: str):
+        row = self.triplets.pop(triplet_id, None)
+        if row is None:
+            return
+        for index, key in ((self.by_subject, row['subject_id']),
+                           (self.by_predicate, row['predicate_id']),
+                           (self.by_object, row['object_id']),
+                           (self.by_paper, row.get('file_id', ''))):
+            postings = index.get(key)
+            if postings is not None:
+                postings.discard(triplet_id)
+                if not postings:
+                    del index[key]
+
+    def match_entities(self, text: str) -> list:
+        """Entity IDs whose label or ID contains the search text.
+
+        Only the entity vocabulary is scanned, never the triplet rows.
+        """
+        if not text:
+            return []
+        needle = text.lower().strip()
+        folded = normalize_entity(text)
+        return [entity_id for entity_id, label in self.labels.items()
+                if needle in label.lower() or folded in entity_id]
+
+    def query(self, subject=None, predicate=None, object=None, paper=None) -> list:
+        """Find triplets matching all the given criteria.
+
+        Each criterion may be a single value or a list of values (matched as
+        OR). Subjects and objects are normalized, so query("Scarcity Messages")
+        and query("scarcity message") return the same triplets.
+
+        Args:
+            subject: Subject name(s) or entity ID(s)
+            predicate: Predicate(s)
+            object: Object name(s) or entity ID(s)
+            paper: file_id(s) of the source papers
+
+        Returns:
+            list[dict]: Matching triplet rows
+        """
+        criteria = [
+            (self.by_subject, subject, normalize_entity),
+            (self.by_predicate, predicate, normalize_predicate),
+            (self.by_object, object, normalize_entity),
+            (self.by_paper, paper, str),
+        ]
+        postings = []
+        for index, values, normalize in criteria:
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            matched = set()
+            for value in values:
+                matched |= index.get(normalize(value), set())
+            postings.append(matched)
+
+        if not postings:
+            return list(self.triplets.values())
+
+        # Intersect starting from the smallest posting set
+        postings.sort(key=len)
+        result = set(postings[0])
+        for other in postings[1:]:
+            result &= other
+            if not result:
+                break
+        return [self.triplets[triplet_id] for triplet_id in result]
+
+    def objects_of(self, subject, predicate=None) -> dict:
+        """Objects linked from a subject, with counts.
+
+        For example objects_of("Scarcity Message") lists every behavior or
+        trait the cue influences.
+
+        Returns:
+            dict: Object label -> number of supporting triplets
+        """
+        counts = {}
+        for row in self.query(subject=subject, predicate=predicate):
+            label = self.labels.get(row['object_id'], row['object_id'])
+            counts[label] = counts.get(label, 0) + 1
+        return counts
+
+def load_triplet_store(db, collection_name: str, store: TripletStore = None) -> TripletStore:
+    """Build or incrementally update a TripletStore from a Firestore triplet collection
+
+    When an existing store is passed, only triplets created at or after the
+    newest one it has already seen are read, skipping those already loaded
+    at that timestamp, as load_triplet_matrix does.
+
+    Args:
+        db: Firestore client
+        collection_name (str): Either 'triplets_group_a' or 'triplets_group_b'
+        store (TripletStore): Store to update, or None to build a new one
+
+    Returns:
+        TripletStore: Store indexed over every triplet in the collection
+    """
+    if store is None:
+        store = TripletStore()
+
+    with store.lock:
+        query = db.collection(collection_name)
+        if store.last_timestamp is not None:
+            query = query.where('created_timestamp', '>=', store.last_timestamp)
+        for doc in query.stream():
+            if doc.id in store.last_ids:
+                continue
+            triplet = doc.to_dict()
+            store.add(doc.id, triplet)
+            created = triplet.get('created_timestamp')
+            if created is None:
+                continue
+            if store.last_timestamp is None or created > store.last_timestamp:
+                store.last_timestamp = created
+                store.last_ids = {doc.id}
+            elif created == store.last_timestamp:
+                store.last_ids.add(doc.id)
+    return store
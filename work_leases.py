@@ -0,0 +1,218 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+
+DEFAULT_LEASE_SECONDS = 600
+
+# Stages read this many times more candidates than they want to claim,
+# since some will already be leased by other workers; if that isn't enough,
+# claim_documents keeps reading wider pages until it is
+CLAIM_OVERFETCH = 3
+
+def new_worker_id() -> str:
+    """Unique ID for a worker (one per browser session or process)"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def lease_field(stage: str) -> str:
+    return f'leases.{stage}'
+
+def release_lease(stage: str) -> dict:
+    """Update fields that drop a stage's lease; merge into the stage's final update"""
+    return {lease_field(stage): firestore.DELETE_FIELD}
+
+def _lease_expired(data: dict, stage: str, now) -> bool:
+    lease = (data.get('leases') or {}).get(stage)
+    return not lease or lease['expires'] <= now
+
+class LeaseBatch:
+    """Documents claimed by one worker for one stage.
+
+    Iterate to get the claimed DocumentSnapshots. Call keep_alive() with
+    the documents not finished yet before working on each one; it renews
+    their leases once half the lease time has passed, and returns False if
+    another worker has taken a lease over. The stage must then stop: the
+    lost documents belong to the other worker, and stop() gives back the
+    rest. keep_alive() may be called from several threads at once; only one
+    of them renews.
+    """
+
+    def __init__(self, db, docs, stage, worker_id, lease_seconds):
+        self.db = db
+        self.docs = docs
+        self.stage = stage
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = set()
+        self._renewed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def keep_alive(self, remaining=None) -> bool:
+        """Renew the leases on `remaining` (default: every claimed document) if due.
+
+        Finished documents have already given their lease up, so pass only
+        the ones still to be processed.
+
+        Returns:
+            bool: False if a lease was lost; the lost paths are in `lost`
+        """
+        with self._lock:
+            if self.lost:
+                return False
+            if time.monotonic() - self._renewed < self.lease_seconds / 2:
+                return True
+            remaining = self.docs if remaining is None else list(remaining)
+            lost = renew_leases(self.db, [doc.reference for doc in remaining],
+                                self.stage, self.worker_id, self.lease_seconds)
+            self._renewed = time.monotonic()
+            self.lost.update(ref.path for ref in lost)
+            return not lost
+
+    def stop(self, remaining):
+        """Give back the leases still held on `remaining` after keep_alive() returned False"""
+        self.release([doc for doc in remaining if doc.reference.path not in self.lost])
+
+    def release(self, docs):
+        """Give back leases on documents this worker won't process after all"""
+        if not docs:
+            return
+        batch = self.db.batch()
+        for doc in docs:
+            batch.update(doc.reference, release_lease(self.stage))
+        batch.commit()
+
+def claim_documents(db, candidates, stage: str, limit: int, worker_id: str,
+                    lease_seconds: int = DEFAULT_LEASE_SECONDS, eligible=None) -> LeaseBatch:
+    """Atomically claim up to `limit` of the candidate documents for a stage.
+
+    Candidates come from the stage's usual query. Those whose snapshot
+    already shows another worker's unexpired lease are passed over; the
+    rest are claimed in a transaction that re-reads each one, checks it
+    with `eligible` (so documents another worker finished in the meantime
+    are skipped) and, if it still has no unexpired lease for the stage,
+    marks it with `leases.<stage> = {owner, expires}`. Expired leases are
+    reclaimed the same way.
+
+    Given a function instead of a list, candidates are read a page at a
+    time, CLAIM_OVERFETCH times `limit` first and twice as many each time
+    after, until `limit` documents are claimed or the query runs dry. With
+    many workers on a stage the first candidates are mostly leased, and
+    this keeps a worker from coming back empty-handed while work remains.
+
+    Args:
+        db: Firestore client
+        candidates (list or callable): DocumentSnapshots in priority order, or
+            a function returning the first `count` of them
+        stage (str): Stage name, e.g. 'extract' or 'crawl'
+        limit (int): Maximum number of documents to claim
+        worker_id (str): ID of the claiming worker
+        lease_seconds (int): How long the claim lasts before others may reclaim it
+        eligible (callable): Predicate on the fresh document data
+
+    Returns:
+        LeaseBatch: The claimed documents, in candidate order
+    """
+    if not callable(candidates):
+        docs = _claim(db, list(candidates), stage, limit, worker_id, lease_seconds, eligible)
+        return LeaseBatch(db, docs, stage, worker_id, lease_seconds)
+
+    claimed, tried = [], set()
+    count = max(limit, 1) * CLAIM_OVERFETCH
+    while len(claimed) < limit:
+        page = list(candidates(count))
+        new = [doc for doc in page if doc.reference.path not in tried]
+        tried.update(doc.reference.path for doc in new)
+        claimed += _claim(db, new, stage, limit - len(claimed), worker_id, lease_seconds, eligible)
+        if len(page) < count:
+            break
+        count *= 2
+    return LeaseBatch(db, claimed, stage, worker_id, lease_seconds)
+
+def _claim(db, candidates: list, stage: str, limit: int, worker_id: str, lease_seconds: int, eligible) -> list:
+    """Claim up to `limit` of the candidates in one transaction"""
+    now = datetime.now(timezone.utc)
+    # Skip documents the query already shows leased, without spending transaction reads on them
+    refs = [doc.reference for doc in candidates if _lease_expired(doc.to_dict() or {}, stage, now)]
+    if not refs or limit <= 0:
+        return []
+
+    @firestore.transactional
+    def claim(transaction):
+        now = datetime.now(timezone.utc)
+        snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all(refs)}
+        claimed = []
+        for ref in refs:
+            snapshot = snapshots.get(ref.path)
+            if snapshot is None or not snapshot.exists:
+                continue
+            data = snapshot.to_dict()
+            if eligible is not None and not eligible(data):
+                continue
+            if not _lease_expired(data, stage, now):
+                continue
+            transaction.update(ref, {lease_field(stage): {
+                'owner': worker_id,
+                'expires': now + timedelta(seconds=lease_seconds),
+                'claimed_timestamp': firestore.SERVER_TIMESTAMP,
+            }})
+            claimed.append(snapshot)
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    return claim(db.transaction())
+
+def renew_leases(db, refs, stage: str, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> list:
+    """Extend this worker's leases.
+
+    Returns:
+        list: References whose lease is no longer held by this worker
+    """
+    if not refs:
+        return []
+
+    @firestore.transactional
+    def renew(transaction):
+        now = datetime.now(timezone.utc)
+        lost = []
+        for snapshot in transaction.get_all(refs):
+            lease = ((snapshot.to_dict() or {}).get('leases') or {}).get(stage)
+            if not lease or lease.get('owner') != worker_id:
+                lost.append(snapshot.reference)
+                continue
+            transaction.update(snapshot.reference, {
+                f'{lease_field(stage)}.expires': now + timedelta(seconds=lease_seconds)
+            })
+        return lost
+
+    return renew(db.transaction())
+
+def reclaim_expired_leases(db, collection_name: str, stage: str) -> int:
+    """Drop expired leases for a stage so the documents show as unclaimed.
+
+    Claiming already ignores expired leases; this just cleans them up.
+
+    Returns:
+        int: Number of leases removed
+    """
+    now = datetime.now(timezone.utc)
+    query = db.collection(collection_name).where(f'{lease_field(stage)}.expires', '<', now)
+    reclaimed = 0
+    batch = db.batch()
+    for doc in query.stream():
+        batch.update(doc.reference, release_lease(stage))
+        reclaimed += 1
+        if reclaimed % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    return reclaimed